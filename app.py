@@ -1,15 +1,72 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify, session
+from flask import Flask, render_template, request, redirect, url_for, jsonify, session, make_response, g, has_request_context
 from functools import wraps
+from werkzeug.http import is_resource_modified
+import click
 import os
 from dotenv import load_dotenv
-from supabase_client import supabase_client
-from datetime import timedelta
-import copy
+from supabase_client import supabase_client, criar_cliente_auth, cliente_do_usuario
+from cache import TTLCache, MISSING
+from publicacao import PublicadorEstatico
+from metricas import Registro, instrumentar_postgrest
+from detector_consultas import DetectorConsultas
+from repositorio import RepositorioSupabase, criar_repositorio_postgres
+from eventos import criar_barramento
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+import asyncio
+import base64
+import bisect
+import calendar
+import hashlib
+import hmac
+import itertools
+import json
 import re
+from collections import namedtuple
+from contextvars import ContextVar
+import contextvars
+import threading
+import time
 
 # Carregar variáveis de ambiente
 load_dotenv()
 
+# E/S concorrente: consultas independentes de uma mesma requisição são disparadas juntas
+# (no pool _io_executor), de modo que a latência passa a ser a da consulta mais lenta e não a soma.
+# ASYNC_IO=0 volta ao modo sequencial.
+ASYNC_IO = os.getenv('ASYNC_IO', '1') != '0'
+ASYNC_IO_WORKERS = int(os.getenv('ASYNC_IO_WORKERS', '16'))
+_io_executor = ThreadPoolExecutor(max_workers=ASYNC_IO_WORKERS, thread_name_prefix='supabase-io')
+
+async def _gather_queries(*queries):
+    """
+    Awaitable form: runs the query builders' execute() concurrently and returns the
+    responses in order. The synchronous client is used on purpose: its HTTP pool is
+    thread-safe and keeps connections alive across requests, which a per-loop async
+    client would not.
+    """
+    loop = asyncio.get_running_loop()
+    # copy_context: as métricas por requisição (contextvars) também contam estas chamadas
+    return await asyncio.gather(*(loop.run_in_executor(_io_executor, contextvars.copy_context().run, query.execute) for query in queries))
+
+def _execute_concurrently(*queries):
+    """
+    Executes independent query builders on the I/O pool and returns their responses in
+    order. Plain executor map: no event loop is created per call (async views await
+    _gather_queries instead).
+    """
+    if not ASYNC_IO or len(queries) < 2:
+        return [query.execute() for query in queries]
+    # Contextos copiados aqui, na thread da requisição: as métricas (contextvars) seguem as consultas
+    contextos = [contextvars.copy_context() for _ in queries]
+    return list(_io_executor.map(lambda contexto, query: contexto.run(query.execute), contextos, queries))
+
+# Validação no banco: com VALIDACAO_NO_BANCO=1, criar e editar um compromisso viram uma
+# única chamada à função validar_compromisso (schema.sql), que valida as regras e grava na
+# mesma transação sob um lock da agenda, eliminando a corrida entre validar e gravar.
+# Requer a função criada no banco.
+VALIDACAO_NO_BANCO = os.getenv('VALIDACAO_NO_BANCO', '0') == '1'
+
 # Helper Functions for Appointment Validation
 def _time_str_to_minutes(time_str):
     """Converts 'HH:MM:SS' or 'HH:MM' to minutes from midnight."""
@@ -22,75 +79,333 @@ def _time_str_to_minutes(time_str):
     except Exception: # Handle potential errors like invalid format
         return 0
 
-def _get_workplace_details(supabase_client, local_id):
-    """Fetches workplace details relevant for validation."""
-    if not local_id: return None
-    try:
-        response = supabase_client.table('locais_trabalho').select('id_local, nome, cor, acrescimo_ha_percent, periodo_carencia, relacionado_com, usuario_id').eq('id_local', local_id).maybe_single().execute()
-        return response.data
-    except Exception as e:
-        print(f"Error fetching workplace details for {local_id}: {e}")
-        return None
+def _minutes_to_time_str(minutes):
+    """Converts minutes from midnight to 'HH:MM'."""
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
 
-def _get_linked_workplace_ids(supabase_client, local_id_principal, usuario_id):
+# Per-user index of linked workplaces (connected components over relacionado_com)
+WORKPLACE_GROUP_INDEX_TTL = 300  # segundos; protege contra alterações feitas por outros processos
+_workplace_group_indexes = {}
+_workplace_group_indexes_lock = threading.Lock()
+
+class _WorkplaceGroupIndex:
     """
-    Fetches a set of workplace IDs linked to local_id_principal.
-    A workplace is considered linked if it's the principal, related to the principal,
-    or if the principal is related to it (forming a two-way group).
+    Connected components of a user's locais_trabalho, linked through relacionado_com.
+    Groups are transitive (a chain A <- B <- C is one group) and group_of() is O(1).
     """
-    if not local_id_principal or not usuario_id: return set()
 
-    linked_ids = {local_id_principal}
-    try:
-        # First, get the details of the principal workplace
-        principal_details = _get_workplace_details(supabase_client, local_id_principal)
-        if not principal_details or principal_details.get('usuario_id') != usuario_id:
-            # If principal doesn't exist or doesn't belong to user, return empty or just itself if we want to be lenient.
-            # For safety, if it's not the user's, it shouldn't link to others of the user.
-            return set() if principal_details.get('usuario_id') != usuario_id else {local_id_principal}
-
-
-        # Case 1: local_id_principal IS a primary workplace (it has others related to it)
-        query1 = supabase_client.table('locais_trabalho').select('id_local').eq('relacionado_com', local_id_principal).eq('usuario_id', usuario_id).execute()
-        if query1.data:
-            for item in query1.data:
-                linked_ids.add(item['id_local'])
-
-        # Case 2: local_id_principal IS a secondary workplace (it relates to another primary)
-        if principal_details.get('relacionado_com'):
-            primary_of_principal = principal_details['relacionado_com']
-            linked_ids.add(primary_of_principal) # Add its primary
-            # Also add all other secondaries related to that same primary
-            query2 = supabase_client.table('locais_trabalho').select('id_local').eq('relacionado_com', primary_of_principal).eq('usuario_id', usuario_id).execute()
-            if query2.data:
-                for item in query2.data:
-                    linked_ids.add(item['id_local'])
-    except Exception as e:
-        print(f"Error fetching linked workplace IDs for {local_id_principal}: {e}")
-    return linked_ids
+    def __init__(self, workplaces):
+        self.relacionado_com = {w['id_local']: w.get('relacionado_com') for w in workplaces}
+        self.loaded_at = time.monotonic()
+        self._rebuild()
+
+    def _rebuild(self):
+        parent = {local_id: local_id for local_id in self.relacionado_com}
+
+        def find(local_id):
+            while parent[local_id] != local_id:
+                parent[local_id] = parent[parent[local_id]]
+                local_id = parent[local_id]
+            return local_id
+
+        for local_id, related in self.relacionado_com.items():
+            if related in parent:
+                root_a, root_b = find(local_id), find(related)
+                if root_a != root_b:
+                    parent[root_a] = root_b
+
+        members_by_root = {}
+        for local_id in parent:
+            members_by_root.setdefault(find(local_id), set()).add(local_id)
+
+        self._group_of = {}
+        for members in members_by_root.values():
+            group = frozenset(members)
+            for local_id in group:
+                self._group_of[local_id] = group
+
+    def group_of(self, local_id):
+        """All workplace ids linked to local_id (including itself); empty if unknown."""
+        return self._group_of.get(local_id, frozenset())
+
+    # As alterações devolvem um índice novo (copy-on-write): quem obteve o índice do cache
+    # continua lendo o anterior sem lock, e o cache troca um pelo outro sob o lock
+    def _derived(self, relacionado_com):
+        index = _WorkplaceGroupIndex.__new__(_WorkplaceGroupIndex)
+        index.relacionado_com = relacionado_com
+        index.loaded_at = self.loaded_at  # o TTL continua contando da carga no banco
+        return index
+
+    def with_workplace(self, local_id, relacionado_com=None):
+        index = self._derived({**self.relacionado_com, local_id: relacionado_com})
+        # Um novo local nunca separa grupos: basta uni-lo ao grupo do relacionado
+        group = frozenset({local_id} | self._group_of.get(relacionado_com, frozenset()))
+        index._group_of = {**self._group_of, **dict.fromkeys(group, group)}
+        return index
+
+    def with_relation(self, local_id, relacionado_com):
+        if self.relacionado_com.get(local_id) == relacionado_com and local_id in self._group_of:
+            return self
+        index = self._derived({**self.relacionado_com, local_id: relacionado_com})
+        index._rebuild()
+        return index
+
+    def without_workplace(self, local_id):
+        # Espelha o ON DELETE SET NULL de relacionado_com
+        index = self._derived({
+            other_id: None if related == local_id else related
+            for other_id, related in self.relacionado_com.items() if other_id != local_id
+        })
+        index._rebuild()
+        return index
+
+    def is_expired(self):
+        return time.monotonic() - self.loaded_at > WORKPLACE_GROUP_INDEX_TTL
+
+def _cached_workplace_group_index(usuario_id):
+    """Returns the cached index for the user if it is still fresh, else None."""
+    with _workplace_group_indexes_lock:
+        index = _workplace_group_indexes.get(usuario_id)
+        if index and index.is_expired():
+            del _workplace_group_indexes[usuario_id]
+            return None
+        return index
+
+def _store_workplace_group_index(usuario_id, index):
+    with _workplace_group_indexes_lock:
+        _workplace_group_indexes[usuario_id] = index
+
+def _replace_workplace_group_index(usuario_id, change):
+    """Swaps the user's cached index for change(index) under the lock; no-op unless a fresh one is cached."""
+    with _workplace_group_indexes_lock:
+        index = _workplace_group_indexes.get(usuario_id)
+        if index is None or index.is_expired():
+            _workplace_group_indexes.pop(usuario_id, None)
+            return
+        _workplace_group_indexes[usuario_id] = change(index)
+
+def _get_workplace_group_index(supabase_client, usuario_id):
+    """Returns the user's workplace group index, building it with one query if needed."""
+    index = _cached_workplace_group_index(usuario_id)
+    if index is None:
+        index = _WorkplaceGroupIndex(_repositorio(supabase_client).listar('locais_trabalho', 'id_local, relacionado_com', usuario_id=usuario_id))
+        _store_workplace_group_index(usuario_id, index)
+    return index
+
+MINUTES_PER_DAY = 24 * 60
+
+def _interval_mask(start_minutes, end_minutes):
+    """Bit mask covering the minutes [start, end) of a day."""
+    if end_minutes <= start_minutes: return 0
+    return ((1 << (end_minutes - start_minutes)) - 1) << start_minutes
+
+class _DayOccupancy:
+    """
+    One (agenda, dia_semana): a 1440-bit occupancy bitmap plus interval arrays
+    sorted by start and by end. Overlap checks are bit operations and
+    predecessor/successor lookups are binary searches.
+    """
+
+    def __init__(self, appointments):
+        entries = sorted(
+            ((_time_str_to_minutes(app['hora_inicio']), _time_str_to_minutes(app['hora_fim']), app) for app in appointments),
+            key=lambda entry: entry[0]
+        )
+        self.appointments = [app for _, _, app in entries]
+        self.starts = [start for start, _, _ in entries]
+        self.ends = [end for _, end, _ in entries]
+        self._by_end = sorted(range(len(entries)), key=lambda i: self.ends[i])
+        self._ends_sorted = [self.ends[i] for i in self._by_end]
+
+        self.bitmap = 0
+        self.duration_by_local = {}
+        for start, end, app in entries:
+            self.bitmap |= _interval_mask(start, end)
+            self.duration_by_local[app['local_id']] = self.duration_by_local.get(app['local_id'], 0.0) + float(app['duracao'])
+
+    def without(self, appointment_id):
+        return _DayOccupancy([app for app in self.appointments if app['id_compromisso'] != appointment_id])
+
+    def with_appointment(self, appointment):
+        return _DayOccupancy(self.appointments + [appointment])
+
+    def is_free(self, start_minutes, end_minutes):
+        return not (self.bitmap & _interval_mask(start_minutes, end_minutes))
+
+    def first_conflict(self, start_minutes, end_minutes):
+        """First appointment (by hora_inicio) overlapping [start, end), or None."""
+        if self.is_free(start_minutes, end_minutes):
+            return None
+        for i in range(bisect.bisect_left(self.starts, end_minutes)):
+            if self.ends[i] > start_minutes:
+                return self.appointments[i]
+        return None
+
+    def predecessor(self, start_minutes):
+        """Appointment with the latest hora_fim not after start_minutes, or None."""
+        i = bisect.bisect_right(self._ends_sorted, start_minutes) - 1
+        if i < 0:
+            return None
+        # Em caso de empate, o primeiro pela hora_inicio
+        i = bisect.bisect_left(self._ends_sorted, self._ends_sorted[i])
+        return self.appointments[self._by_end[i]]
+
+    def successor(self, end_minutes):
+        """Appointment with the earliest hora_inicio not before end_minutes, or None."""
+        i = bisect.bisect_left(self.starts, end_minutes)
+        return self.appointments[i] if i < len(self.appointments) else None
+
+    def first_start(self):
+        return self.starts[0] if self.starts else None
 
+    def last_end(self):
+        """hora_fim of the last appointment by hora_inicio, or None."""
+        return self.ends[-1] if self.ends else None
 
-def _get_appointments_for_validation(supabase_client, agenda_id, dia_semana, exclude_id=None):
+class _ValidationSnapshot:
     """
-    Fetches appointments for a given agenda and day, ordered by hora_inicio.
-    Excludes a specific appointment if exclude_id is provided.
-    Returns a list of appointment dicts.
+    In-memory view of an agenda's week plus the owner's workplaces, used by
+    _validate_appointment so that all business rules run without extra queries.
+    Loads everything with one repository call (two queries, sent together);
+    backend_calls counts them.
     """
-    if not agenda_id or dia_semana is None: return []
-    try:
-        query = supabase_client.table('compromissos').select('id_compromisso, local_id, hora_inicio, hora_fim, duracao').eq('agenda_id', agenda_id).eq('dia_semana', int(dia_semana)).order('hora_inicio', desc=False)
-        if exclude_id:
-            query = query.neq('id_compromisso', exclude_id)  # Mudança: usar neq ao invés de not_eq
-        response = query.execute()
-        return response.data if response.data else []
-    except Exception as e:
-        print(f"Error fetching appointments for validation (agenda: {agenda_id}, dia: {dia_semana}): {e}")
-        return []
 
-def _validate_appointment(supabase_client, agenda_id, appointment_data, usuario_id, existing_appointment_id=None):
+    def __init__(self, supabase_client, agenda_id, usuario_id):
+        self.agenda_id = agenda_id
+        self.usuario_id = usuario_id
+
+        repositorio = _repositorio(supabase_client)
+        antes = repositorio.consultas_da_thread()
+        compromissos, locais = repositorio.dados_validacao(agenda_id, usuario_id)
+        self.backend_calls = repositorio.consultas_da_thread() - antes
+
+        self.workplaces = {local['id_local']: local for local in locais}
+        # Os locais já foram carregados: aproveitar para renovar o índice de grupos
+        self.workplace_groups = _WorkplaceGroupIndex(locais)
+        _store_workplace_group_index(usuario_id, self.workplace_groups)
+
+        appointments_by_day = {dia: [] for dia in range(7)}
+        self._day_of_appointment = {}
+        for app in compromissos:
+            appointments_by_day.setdefault(int(app['dia_semana']), []).append(app)
+            self._day_of_appointment[app['id_compromisso']] = int(app['dia_semana'])
+        self.days = {dia: _DayOccupancy(apps) for dia, apps in appointments_by_day.items()}
+
+    def get_workplace(self, local_id):
+        """Returns the workplace dict if it belongs to the snapshot's user, else None."""
+        return self.workplaces.get(local_id)
+
+    def get_linked_workplace_ids(self, local_id_principal):
+        """Workplace ids linked to local_id_principal (itself included), answered from memory."""
+        return set(self.workplace_groups.group_of(local_id_principal))
+
+    def add_appointment(self, appointment):
+        """Adds an appointment accepted in memory (e.g. an earlier item of a batch)."""
+        dia_semana = int(appointment['dia_semana'])
+        self.days[dia_semana] = self.get_day(dia_semana).with_appointment(appointment)
+        self._day_of_appointment[appointment['id_compromisso']] = dia_semana
+
+    def get_day(self, dia_semana, exclude_id=None):
+        """_DayOccupancy of the day, optionally without the appointment being edited."""
+        dia_semana = int(dia_semana)
+        day = self.days.get(dia_semana)
+        if day is None:
+            day = self.days[dia_semana] = _DayOccupancy([])
+        if exclude_id is not None and self._day_of_appointment.get(exclude_id) == dia_semana:
+            return day.without(exclude_id)
+        return day
+
+    def get_appointments(self, dia_semana, exclude_id=None):
+        """Appointments of the day ordered by hora_inicio, optionally excluding one."""
+        return self.get_day(dia_semana, exclude_id).appointments
+
+
+# Mensagens das regras de negócio por código de violação (o mesmo código devolvido pela
+# função validar_compromisso do banco)
+MENSAGENS_VIOLACAO = {
+    'agenda_nao_encontrada': "Agenda não encontrada ou não pertence ao usuário.",
+    'compromisso_nao_encontrado': "Compromisso não encontrado ou não pertence à agenda.",
+    'duracao_maxima': "Limite de trabalho contínuo excedido (máx 6 horas).",
+    'local_nao_encontrado': "Local de trabalho do compromisso não encontrado para validação.",
+    'conflito': "Conflito de horário: já existe um compromisso das {hora_inicio} às {hora_fim}.",
+    'limite_diario': "Limite de 8 horas diárias excedido para os locais relacionados ({locais}). Total atual: {total:.1f}h.",
+    'carencia_anterior': "Violação do período de carência com o compromisso anterior. Gap de {gap} min, necessário {necessario} min.",
+    'carencia_seguinte': "Violação do período de carência com o compromisso seguinte. Gap de {gap} min, necessário {necessario} min.",
+    'descanso_anterior': "Violação do período de descanso inter-jornada (com o último compromisso do dia anterior).",
+    'descanso_seguinte': "Violação do período de descanso inter-jornada (com o primeiro compromisso do dia seguinte).",
+}
+STATUS_VIOLACAO = {'agenda_nao_encontrada': 404, 'compromisso_nao_encontrado': 404}
+
+def _mensagem_violacao(codigo, **detalhes):
+    """Error message of a rule violation; detalhes fill the message template."""
+    if isinstance(detalhes.get('locais'), list):
+        detalhes['locais'] = ', '.join(detalhes['locais'])
+    if 'total' in detalhes:
+        detalhes['total'] = float(detalhes['total'])
+    return MENSAGENS_VIOLACAO[codigo].format(**detalhes)
+
+def _appointment_rule_violation(snapshot, local_id, dia_semana, start_minutes, end_minutes, duracao, existing_appointment_id=None):
+    """
+    Runs the four business rules in memory against the snapshot.
+    Returns the error message of the first violated rule, or None if the slot is valid.
+    """
+    # Rule 1: Continuous Work Limit (max 6 hours)
+    if duracao > 6.0:
+        return _mensagem_violacao('duracao_maxima')
+
+    current_workplace_details = snapshot.get_workplace(local_id)
+    if not current_workplace_details:
+        return _mensagem_violacao('local_nao_encontrado')
+
+    # Compromissos existentes no dia (sem o que está sendo editado)
+    day = snapshot.get_day(dia_semana, existing_appointment_id)
+
+    # Verificar sobreposição de horários independente do local
+    conflict = day.first_conflict(start_minutes, end_minutes)
+    if conflict:
+        return _mensagem_violacao('conflito', hora_inicio=conflict['hora_inicio'], hora_fim=conflict['hora_fim'])
+
+    # Rule 2: Limite de 8 horas diárias somando a duração nos locais relacionados
+    linked_workplace_ids = snapshot.workplace_groups.group_of(local_id)
+    total_linked_duration_today = duracao + sum(day.duration_by_local.get(linked_id, 0.0) for linked_id in linked_workplace_ids)
+    if round(total_linked_duration_today, 4) > 8.0:
+        locais_nomes = [(snapshot.get_workplace(linked_id) or {}).get('nome', linked_id) for linked_id in sorted(linked_workplace_ids)]
+        return _mensagem_violacao('limite_diario', locais=locais_nomes, total=total_linked_duration_today)
+
+    # Rule 3: Grace Period (only between workplaces that are not linked)
+    grace_period_minutes = int(current_workplace_details.get('periodo_carencia', 60))
+
+    immediate_predecessor = day.predecessor(start_minutes)
+    if immediate_predecessor and immediate_predecessor['local_id'] not in linked_workplace_ids \
+            and snapshot.get_workplace(immediate_predecessor['local_id']):
+        gap = start_minutes - _time_str_to_minutes(immediate_predecessor['hora_fim'])
+        if gap < grace_period_minutes:
+            return _mensagem_violacao('carencia_anterior', gap=gap, necessario=grace_period_minutes)
+
+    immediate_successor = day.successor(end_minutes)
+    if immediate_successor and immediate_successor['local_id'] not in linked_workplace_ids \
+            and snapshot.get_workplace(immediate_successor['local_id']):
+        gap = _time_str_to_minutes(immediate_successor['hora_inicio']) - end_minutes
+        if gap < grace_period_minutes:
+            return _mensagem_violacao('carencia_seguinte', gap=gap, necessario=grace_period_minutes)
+
+    # Rule 4: Inter-day Rest Period (11 hours = 660 minutes)
+    # O compromisso em edição também é ignorado nos dias vizinhos (pode estar mudando de dia)
+    prev_day_end_minutes = snapshot.get_day((dia_semana - 1 + 7) % 7, existing_appointment_id).last_end()
+    if prev_day_end_minutes is not None and (MINUTES_PER_DAY - prev_day_end_minutes) + start_minutes < 11 * 60:
+        return _mensagem_violacao('descanso_anterior')
+
+    next_day_start_minutes = snapshot.get_day((dia_semana + 1) % 7, existing_appointment_id).first_start()
+    if next_day_start_minutes is not None and (MINUTES_PER_DAY - end_minutes) + next_day_start_minutes < 11 * 60:
+        return _mensagem_violacao('descanso_seguinte')
+
+    return None
+
+def _validate_appointment(supabase_client, agenda_id, appointment_data, usuario_id, existing_appointment_id=None, snapshot=None):
     """
     Validates an appointment against business logic rules.
     appointment_data should contain: local_id, dia_semana (int), hora_inicio (str), hora_fim (str), duracao (float).
+    A _ValidationSnapshot may be passed in; otherwise one is loaded (two queries).
     Returns (True, None, None) if valid, or (False, error_json_response, status_code) if invalid.
     """
     try:
@@ -102,132 +417,101 @@ def _validate_appointment(supabase_client, agenda_id, appointment_data, usuario_
     except (TypeError, ValueError) as e:
         return False, jsonify({"sucesso": False, "mensagem": f"Dados inválidos para validação: {str(e)}"}), 400
 
-    # Rule 1: Continuous Work Limit (max 6 hours)
+    # Rule 1 dispensa o carregamento da semana
     if duracao_new_app > 6.0:
-        return False, jsonify({"sucesso": False, "mensagem": "Limite de trabalho contínuo excedido (máx 6 horas)."}), 400
-
-    current_workplace_details = _get_workplace_details(supabase_client, local_id_new_app)
-    if not current_workplace_details:
-        return False, jsonify({"sucesso": False, "mensagem": "Local de trabalho do compromisso não encontrado para validação."}), 400
-
-    # Get existing appointments for the day (excluding the one being edited)
-    existing_appointments_today = _get_appointments_for_validation(supabase_client, agenda_id, dia_semana_new_app, exclude_id=existing_appointment_id)
-
-    # CORREÇÃO 1: Verificar sobreposição de horários independente do local
-    new_app_start_minutes = _time_str_to_minutes(hora_inicio_new_app)
-    new_app_end_minutes = _time_str_to_minutes(hora_fim_new_app)
-    
-    # Debug
-    print(f"Validando compromisso - Horário: {hora_inicio_new_app} às {hora_fim_new_app}")
-    print(f"Existing appointment ID being edited: {existing_appointment_id}")
-    print(f"Total de compromissos existentes no dia (excluindo o atual): {len(existing_appointments_today)}")
-    
-    for app in existing_appointments_today:
-        app_start = _time_str_to_minutes(app['hora_inicio'])
-        app_end = _time_str_to_minutes(app['hora_fim'])
-        
-        print(f"Verificando conflito com compromisso {app['id_compromisso']}: {app['hora_inicio']} às {app['hora_fim']}")
-        
-        # Verificar se há sobreposição de horários
-        if (new_app_start_minutes < app_end and new_app_end_minutes > app_start):
-            return False, jsonify({
-                "sucesso": False, 
-                "mensagem": f"Conflito de horário: já existe um compromisso das {app['hora_inicio']} às {app['hora_fim']}."
-            }), 400
-
-    # CORREÇÃO 2: Limite de 8 horas diárias - somar DURAÇÃO
-    linked_workplace_ids = _get_linked_workplace_ids(supabase_client, local_id_new_app, usuario_id)
-    
-    print(f"Locais relacionados encontrados: {linked_workplace_ids}")
-    
-    # Iniciar com a duração do novo compromisso
-    total_linked_duration_today = duracao_new_app
-    
-    # Somar as durações dos compromissos existentes em locais relacionados
-    for app in existing_appointments_today:
-        if app['local_id'] in linked_workplace_ids:
-            app_duration = float(app['duracao'])
-            total_linked_duration_today += app_duration
-            print(f"Somando duração do compromisso {app['id_compromisso']}: {app_duration}h (Total parcial: {total_linked_duration_today}h)")
-
-    print(f"Total de horas em locais relacionados: {total_linked_duration_today}h")
-
-    if total_linked_duration_today > 8.0:
-        # Obter nomes dos locais relacionados para mensagem mais clara
-        locais_nomes = []
-        for local_id in linked_workplace_ids:
-            local_details = _get_workplace_details(supabase_client, local_id)
-            if local_details:
-                locais_nomes.append(local_details.get('nome', local_id))
-        
-        return False, jsonify({
-            "sucesso": False, 
-            "mensagem": f"Limite de 8 horas diárias excedido para os locais relacionados ({', '.join(locais_nomes)}). Total atual: {total_linked_duration_today:.1f}h."
-        }), 400
-
-    # Rule 3: Grace Period
-    grace_period_minutes = int(current_workplace_details.get('periodo_carencia', 60))
-
-    immediate_predecessor = None
-    immediate_successor = None
-
-    for app_dict in existing_appointments_today:
-        app_end_m = _time_str_to_minutes(app_dict['hora_fim'])
-        if app_end_m <= new_app_start_minutes:
-            if immediate_predecessor is None or _time_str_to_minutes(immediate_predecessor['hora_fim']) < app_end_m:
-                immediate_predecessor = app_dict
-
-        app_start_m = _time_str_to_minutes(app_dict['hora_inicio'])
-        if app_start_m >= new_app_end_minutes:
-            if immediate_successor is None or _time_str_to_minutes(immediate_successor['hora_inicio']) > app_start_m:
-                immediate_successor = app_dict
-
-    if immediate_predecessor:
-        if immediate_predecessor['local_id'] != local_id_new_app:
-            predecessor_workplace_details = _get_workplace_details(supabase_client, immediate_predecessor['local_id'])
-            if predecessor_workplace_details:
-                predecessor_linked_ids = _get_linked_workplace_ids(supabase_client, immediate_predecessor['local_id'], usuario_id)
-                are_linked_for_grace = immediate_predecessor['local_id'] in linked_workplace_ids
-
-                if not are_linked_for_grace:
-                    gap = new_app_start_minutes - _time_str_to_minutes(immediate_predecessor['hora_fim'])
-                    if gap < grace_period_minutes:
-                        return False, jsonify({"sucesso": False, "mensagem": f"Violação do período de carência com o compromisso anterior. Gap de {gap} min, necessário {grace_period_minutes} min."}), 400
-
-    if immediate_successor:
-        if immediate_successor['local_id'] != local_id_new_app:
-            successor_workplace_details = _get_workplace_details(supabase_client, immediate_successor['local_id'])
-            if successor_workplace_details:
-                successor_linked_ids = _get_linked_workplace_ids(supabase_client, immediate_successor['local_id'], usuario_id)
-                are_linked_for_grace = immediate_successor['local_id'] in linked_workplace_ids
-
-                if not are_linked_for_grace:
-                    gap = _time_str_to_minutes(immediate_successor['hora_inicio']) - new_app_end_minutes
-                    if gap < grace_period_minutes:
-                        return False, jsonify({"sucesso": False, "mensagem": f"Violação do período de carência com o compromisso seguinte. Gap de {gap} min, necessário {grace_period_minutes} min."}), 400
-
-    # Rule 4: Inter-day Rest Period (11 hours = 660 minutes)
-    prev_dia_semana = (dia_semana_new_app - 1 + 7) % 7
-    next_dia_semana = (dia_semana_new_app + 1) % 7
-
-    appointments_prev_day = _get_appointments_for_validation(supabase_client, agenda_id, prev_dia_semana, exclude_id=None)
-    if appointments_prev_day:
-        last_app_prev_day = appointments_prev_day[-1]
-        prev_day_end_minutes = _time_str_to_minutes(last_app_prev_day['hora_fim'])
-        rest_duration_with_prev = (24 * 60 - prev_day_end_minutes) + new_app_start_minutes
-        if rest_duration_with_prev < 11 * 60:
-            return False, jsonify({"sucesso": False, "mensagem": "Violação do período de descanso inter-jornada (com o último compromisso do dia anterior)."}), 400
-
-    appointments_next_day = _get_appointments_for_validation(supabase_client, agenda_id, next_dia_semana, exclude_id=None)
-    if appointments_next_day:
-        first_app_next_day = appointments_next_day[0]
-        next_day_start_minutes = _time_str_to_minutes(first_app_next_day['hora_inicio'])
-        rest_duration_with_next = (24 * 60 - new_app_end_minutes) + next_day_start_minutes
-        if rest_duration_with_next < 11 * 60:
-            return False, jsonify({"sucesso": False, "mensagem": "Violação do período de descanso inter-jornada (com o primeiro compromisso do dia seguinte)."}), 400
+        return False, jsonify({"sucesso": False, "mensagem": _mensagem_violacao('duracao_maxima')}), 400
+
+    if snapshot is None:
+        try:
+            snapshot = _ValidationSnapshot(supabase_client, agenda_id, usuario_id)
+        except Exception as e:
+            print(f"Error loading validation snapshot for agenda {agenda_id}: {e}")
+            return False, jsonify({"sucesso": False, "mensagem": "Erro ao carregar dados para validação."}), 500
+
+    mensagem = _appointment_rule_violation(
+        snapshot,
+        local_id_new_app,
+        dia_semana_new_app,
+        _time_str_to_minutes(hora_inicio_new_app),
+        _time_str_to_minutes(hora_fim_new_app),
+        duracao_new_app,
+        existing_appointment_id
+    )
+    if mensagem:
+        return False, jsonify({"sucesso": False, "mensagem": mensagem}), 400
 
     return True, None, None
 
+def _validar_e_gravar_no_banco(agenda_id, usuario_id, dados, id_compromisso=None):
+    """
+    Validates and writes (insert, or update of id_compromisso) with a single call to the
+    validar_compromisso database function, atomically under a per-agenda lock.
+    Returns (resultado, None) on success or (None, violacao) with the violation details.
+    """
+    resultado = _repositorio().validar_compromisso(agenda_id, usuario_id, dados, id_compromisso)
+    if resultado.get('sucesso'):
+        return resultado, None
+    return None, resultado.get('violacao') or {'codigo': 'desconhecida'}
+
+def _resposta_violacao(violacao):
+    """(response, status) for a violation returned by validar_compromisso."""
+    detalhes = {chave: valor for chave, valor in violacao.items() if chave != 'codigo'}
+    codigo = violacao.get('codigo')
+    mensagem = _mensagem_violacao(codigo, **detalhes) if codigo in MENSAGENS_VIOLACAO else "Compromisso inválido."
+    return jsonify({"sucesso": False, "mensagem": mensagem, "violacao": violacao}), STATUS_VIOLACAO.get(codigo, 400)
+
+# Mesmas restrições das colunas de compromissos no schema.sql (CHECK), verificadas por item
+# para que um item inválido de um lote não derrube o insert de várias linhas
+TIPOS_HORA = ('HA', 'HAE', 'HT')
+HORA_RE = re.compile(r'^([01]\d|2[0-3]):[0-5]\d(:[0-5]\d)?$')
+
+def _prepare_new_appointment(dados, agenda_id):
+    """
+    Checks the required fields of a new appointment payload and the column constraints
+    (dia_semana 0..6, tipo_hora, hora_inicio before hora_fim).
+    Returns (data_for_validation, row_for_insert, None) or (None, None, error_message).
+    """
+    try:
+        compromisso_para_validacao = {
+            "local_id": dados.get('local_id'),
+            "dia_semana": int(dados.get('dia_semana')) if dados.get('dia_semana') is not None else None,
+            "hora_inicio": dados.get('hora_inicio'),
+            "hora_fim": dados.get('hora_fim'),
+            "duracao": float(dados.get('duracao')) if dados.get('duracao') is not None else None,
+            # agenda_id and usuario_id are passed directly to _validate_appointment
+        }
+    except (TypeError, ValueError) as e:
+        return None, None, f"Dados inválidos: {str(e)}"
+
+    # Validar campos obrigatórios para compromisso (antes de passar para _validate_appointment)
+    for campo_key in ['local_id', 'dia_semana', 'hora_inicio', 'hora_fim', 'duracao']: # tipo_hora is not used in validation logic itself
+        if compromisso_para_validacao.get(campo_key) is None:
+            return None, None, f"Campo '{campo_key}' é obrigatório para validação e não pode ser nulo."
+    if dados.get('tipo_hora') is None: # tipo_hora is for DB insertion
+        return None, None, "Campo 'tipo_hora' é obrigatório."
+    if not 0 <= compromisso_para_validacao['dia_semana'] <= 6:
+        return None, None, "Campo 'dia_semana' deve ser um inteiro de 0 a 6."
+    if dados.get('tipo_hora') not in TIPOS_HORA:
+        return None, None, f"Campo 'tipo_hora' deve ser um de: {', '.join(TIPOS_HORA)}."
+    for campo_key in ('hora_inicio', 'hora_fim'):
+        if not isinstance(dados.get(campo_key), str) or not HORA_RE.match(dados[campo_key]):
+            return None, None, f"Campo '{campo_key}' deve estar no formato HH:MM."
+    if _time_str_to_minutes(dados['hora_inicio']) >= _time_str_to_minutes(dados['hora_fim']):
+        return None, None, "O horário de início deve ser anterior ao horário de fim."
+
+    # Prepare final data for insertion, using original 'dados' for DB fields
+    compromisso_to_insert = {
+        "agenda_id": agenda_id,
+        "local_id": dados.get('local_id'),
+        "dia_semana": compromisso_para_validacao['dia_semana'], # Ensure it's int for DB
+        "hora_inicio": dados.get('hora_inicio'),
+        "hora_fim": dados.get('hora_fim'),
+        "descricao": dados.get('descricao'),
+        "tipo_hora": dados.get('tipo_hora'),
+        "duracao": dados.get('duracao') # Let DB handle decimal conversion from string/number
+    }
+    return compromisso_para_validacao, compromisso_to_insert, None
+
 
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "chave-secreta-temporaria")
@@ -235,6 +519,140 @@ app.secret_key = os.getenv("SECRET_KEY", "chave-secreta-temporaria")
 app.config['SESSION_TYPE'] = 'filesystem'
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=24)  # Sessão válida por 24 horas
 
+# Métricas no formato do Prometheus em /metrics: latência e status por rota e, para cada
+# .execute() do Supabase, latência, contagem e erros por tabela/operação.
+# METRICAS=0 desliga a instrumentação. A rota exige "Authorization: Bearer <METRICS_TOKEN>"
+# e, sem METRICS_TOKEN configurado, não é exposta (404).
+METRICAS_ATIVAS = os.getenv('METRICAS', '1') != '0'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+def _recusar_sem_token_de_metricas():
+    """
+    The 404/401 response for a request without the METRICS_TOKEN bearer (also guards
+    /debug/consultas), or None when the token matches.
+    """
+    if not METRICS_TOKEN:
+        return jsonify({"sucesso": False, "mensagem": "Não encontrado."}), 404
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {METRICS_TOKEN}"):
+        return jsonify({"sucesso": False, "mensagem": "Não autorizado."}), 401
+    return None
+
+_metricas = Registro()
+_http_requisicoes = _metricas.contador('agenda_http_requests_total', 'Requisições HTTP atendidas.', ('route', 'method', 'status'))
+_http_latencia = _metricas.histograma('agenda_http_request_duration_seconds', 'Latência das requisições HTTP.', ('route', 'method'))
+_http_excecoes = _metricas.contador('agenda_http_request_exceptions_total', 'Exceções não tratadas nas rotas.', ('route', 'method'))
+_http_chamadas_supabase = _metricas.histograma('agenda_http_request_supabase_calls', 'Chamadas ao Supabase por requisição HTTP.', ('route', 'method'), buckets=(0, 1, 2, 3, 4, 5, 8, 13, 21, 34, 55))
+_supabase_chamadas = _metricas.contador('agenda_supabase_calls_total', 'Chamadas .execute() ao Supabase.', ('table', 'operation'))
+_supabase_latencia = _metricas.histograma('agenda_supabase_call_duration_seconds', 'Latência das chamadas ao Supabase.', ('table', 'operation'))
+_supabase_erros = _metricas.contador('agenda_supabase_call_errors_total', 'Chamadas ao Supabase que levantaram erro.', ('table', 'operation', 'error'))
+
+# Contador de chamadas ao Supabase da requisição atual (lista mutável para ser
+# compartilhada com as threads de _gather_queries via copy_context)
+_chamadas_supabase_requisicao = ContextVar('chamadas_supabase_requisicao', default=None)
+
+def _registrar_chamada_supabase(tabela, operacao, segundos, erro, _request_config=None):
+    _supabase_chamadas.inc(tabela, operacao)
+    _supabase_latencia.observar(segundos, tabela, operacao)
+    if erro is not None:
+        _supabase_erros.inc(tabela, operacao, type(erro).__name__)
+    contador = _chamadas_supabase_requisicao.get()
+    if contador is not None:
+        contador[0] += 1
+
+def _rota_atual():
+    # Padrão da rota (não a URL) para manter a cardinalidade dos rótulos limitada
+    return request.url_rule.rule if request.url_rule else 'sem_rota'
+
+@_metricas.coletor
+def _metricas_caches():
+    caches = {
+        'acesso_agenda': _agenda_access_cache,
+        'agenda_publica': _public_agenda_cache,
+        'agregados_relatorio': _report_aggregates
+    }
+    return [
+        ('agenda_cache_hits_total', 'counter', 'Acertos dos caches em memória.', [({'cache': nome}, cache.hits) for nome, cache in caches.items()]),
+        ('agenda_cache_misses_total', 'counter', 'Faltas dos caches em memória.', [({'cache': nome}, cache.misses) for nome, cache in caches.items()]),
+        ('agenda_cache_entries', 'gauge', 'Entradas nos caches em memória.', [({'cache': nome}, len(cache)) for nome, cache in caches.items()])
+    ]
+
+if METRICAS_ATIVAS:
+    instrumentar_postgrest(_registrar_chamada_supabase)
+
+    @app.before_request
+    def _iniciar_metricas_requisicao():
+        g.metricas_inicio = time.perf_counter()
+        g.metricas_token = _chamadas_supabase_requisicao.set([0])
+
+    @app.after_request
+    def _registrar_metricas_requisicao(response):
+        inicio = g.get('metricas_inicio')
+        if inicio is not None:
+            rota, metodo = _rota_atual(), request.method
+            _http_requisicoes.inc(rota, metodo, str(response.status_code))
+            _http_latencia.observar(time.perf_counter() - inicio, rota, metodo)
+            _http_chamadas_supabase.observar(_chamadas_supabase_requisicao.get()[0], rota, metodo)
+        return response
+
+    @app.teardown_request
+    def _finalizar_metricas_requisicao(erro):
+        if erro is not None:
+            _http_excecoes.inc(_rota_atual(), request.method)
+        token = g.pop('metricas_token', None)
+        if token is not None:
+            _chamadas_supabase_requisicao.reset(token)
+
+# Repositório de dados: as leituras quentes (acesso, validação, relatórios, agenda
+# pública) passam por repositorio.py. REPOSITORIO_BACKEND=postgres troca o PostgREST por
+# SQL direto em um pool de conexões; as escritas e as rotas que usam o cliente do
+# usuário (RLS) continuam no Supabase.
+_repositorio_postgres = criar_repositorio_postgres(_registrar_chamada_supabase if METRICAS_ATIVAS else None)
+
+def _repositorio(cliente=None):
+    """Repository of the configured backend; the Supabase one wraps `cliente` (default: the shared client)."""
+    if _repositorio_postgres is not None:
+        return _repositorio_postgres
+    return RepositorioSupabase(cliente if cliente is not None else supabase_client, _execute_concurrently)
+
+# Detector de consultas N+1 (desenvolvimento e testes): com DETECTOR_CONSULTAS=1 cada
+# requisição tem suas consultas registradas e é sinalizada se repetir consultas, repetir o
+# mesmo formato de consulta (N+1) ou passar do orçamento da rota. Os orçamentos consideram
+# o pior caso com caches vazios (usuário com permissão compartilhada = +1 consulta, nas
+# rotas abertas a ele; relatórios e valores/hora são só do dono).
+DETECTOR_CONSULTAS_ATIVO = os.getenv('DETECTOR_CONSULTAS', '0') == '1'
+ORCAMENTO_CONSULTAS_PADRAO = 6
+ORCAMENTO_CONSULTAS_POR_ROTA = {
+    'POST /agendas/<id_agenda>/compromissos': 5,
+    'POST /agendas/<id_agenda>/compromissos/lote': 5,
+    'PUT /agendas/<id_agenda>/compromissos/<id_compromisso>': 6,
+    'DELETE /agendas/<id_agenda>/compromissos/<id_compromisso>': 3,
+    'GET /agendas/<id_agenda>/horarios_livres': 4,
+    'GET /agendas/<id_agenda>/eventos': 2,
+    'GET /agendas/<id_agenda>/relatorios/semanal': 5,
+    'GET /agendas/<id_agenda>/relatorios/mensal': 5,
+    'GET /agendas/<id_agenda>/relatorios/periodo': 5,
+    'POST /agendas/<id_agenda>/clonar': 7,
+    'GET /api/public/agenda/<link_publico_id>': 3,
+    'GET /public/agenda/<link_publico_id>': 3,
+}
+
+_detector_consultas = DetectorConsultas(
+    orcamentos=ORCAMENTO_CONSULTAS_POR_ROTA,
+    orcamento_padrao=ORCAMENTO_CONSULTAS_PADRAO
+)
+
+if DETECTOR_CONSULTAS_ATIVO:
+    _detector_consultas.init_app(app)
+    instrumentar_postgrest(_detector_consultas.registrar_postgrest)
+
+    @app.route('/debug/consultas', methods=['GET'])
+    def relatorios_consultas():
+        # As consultas registradas trazem filtros e ids de outros usuários: mesmo token das métricas
+        recusa = _recusar_sem_token_de_metricas()
+        if recusa:
+            return recusa
+        return jsonify({"sucesso": True, "relatorios": list(_detector_consultas.relatorios)})
+
 # Middleware para verificar autenticação
 def requer_autenticacao(f):
     @wraps(f)
@@ -244,6 +662,198 @@ def requer_autenticacao(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# Clientes por requisição: com SUPABASE_RLS_POR_USUARIO=1 as rotas que lidam só com dados
+# do próprio usuário usam um cliente ligado ao JWT dele (RLS aplicada pelo banco).
+# Rotas que leem dados de outros usuários (agendas compartilhadas, públicas) e os caches
+# compartilhados entre usuários continuam no supabase_client do servidor.
+SUPABASE_RLS_POR_USUARIO = os.getenv('SUPABASE_RLS_POR_USUARIO', '0') == '1'
+TOKEN_REFRESH_MARGIN = 60  # segundos antes da expiração em que o token é renovado
+
+def _guardar_tokens_sessao(sessao_auth):
+    """Stores the Supabase Auth tokens of the logged user in the Flask session."""
+    session['access_token'] = sessao_auth.access_token
+    session['refresh_token'] = sessao_auth.refresh_token
+    session['token_expira_em'] = sessao_auth.expires_at or int(time.time()) + (sessao_auth.expires_in or 3600)
+
+def _access_token_valido():
+    """The session's access token, refreshed when close to expiring; None if unavailable."""
+    token = session.get('access_token')
+    if not token:
+        return None
+    if session.get('token_expira_em', 0) - TOKEN_REFRESH_MARGIN > time.time():
+        return token
+    try:
+        resposta_auth = criar_cliente_auth().refresh_session(session.get('refresh_token'))
+    except Exception as e:
+        print(f"Erro ao renovar token do usuário {session.get('usuario_id')}: {str(e)}")
+        return None
+    if not resposta_auth.session:
+        return None
+    _guardar_tokens_sessao(resposta_auth.session)
+    return resposta_auth.session.access_token
+
+def _cliente_do_usuario():
+    """
+    Supabase client for the current request: a lightweight per-request client bound to
+    the caller's JWT when SUPABASE_RLS_POR_USUARIO is on, else the shared server client.
+    Created once per request (flask.g) over the process-wide HTTP pool.
+    """
+    if not SUPABASE_RLS_POR_USUARIO or not has_request_context():
+        return supabase_client
+    if 'cliente_usuario' not in g:
+        token = _access_token_valido()
+        g.cliente_usuario = cliente_do_usuario(token) if token else supabase_client
+    return g.cliente_usuario
+
+# Controle de acesso às agendas: decisões "usuário U pode ler/escrever a agenda A"
+# ficam em cache (inclusive negativas) para evitar uma query extra por requisição
+AGENDA_ACCESS_CACHE_SIZE = 4096
+AGENDA_ACCESS_CACHE_TTL = 30  # segundos; limita a defasagem entre workers
+_agenda_access_cache = TTLCache(maxsize=AGENDA_ACCESS_CACHE_SIZE, ttl=AGENDA_ACCESS_CACHE_TTL)
+
+AcessoAgenda = namedtuple('AcessoAgenda', ['proprietario_id', 'pode_escrever'])
+
+def _obter_acesso_agenda(agenda_id, usuario_id):
+    """
+    Returns AcessoAgenda(proprietario_id, pode_escrever) when the user owns the agenda
+    (read/write) or has an active agenda_permissoes grant (read only); otherwise None.
+    """
+    chave = (str(agenda_id), str(usuario_id))
+    acesso = _agenda_access_cache.get(chave)
+    if acesso is not MISSING:
+        return acesso
+
+    resultado = _repositorio().acesso_agenda(agenda_id, usuario_id)
+    acesso = AcessoAgenda(*resultado) if resultado else None
+
+    _agenda_access_cache.set(chave, acesso)
+    return acesso
+
+def _pode_escrever_agenda(agenda_id, usuario_id):
+    acesso = _obter_acesso_agenda(agenda_id, usuario_id)
+    return acesso is not None and acesso.pode_escrever
+
+def _obter_acesso_dono(agenda_id, usuario_id):
+    """
+    The cached access decision, but only for the agenda's owner: routes that expose
+    valor_hora and pay totals stay owner-only for users the agenda is shared with.
+    """
+    acesso = _obter_acesso_agenda(agenda_id, usuario_id)
+    return acesso if acesso is not None and str(acesso.proprietario_id) == str(usuario_id) else None
+
+def _registrar_dono_agenda(agenda_id, usuario_id):
+    """Primes the access cache for a freshly created agenda."""
+    _agenda_access_cache.set((str(agenda_id), str(usuario_id)), AcessoAgenda(usuario_id, True))
+
+def _invalidar_acesso_agenda(agenda_id, usuario_id=None):
+    """Drops cached decisions for the agenda (for every user when usuario_id is None)."""
+    if usuario_id is not None:
+        _agenda_access_cache.invalidate((str(agenda_id), str(usuario_id)))
+    else:
+        _agenda_access_cache.invalidate_where(lambda chave, _: chave[0] == str(agenda_id))
+
+# Cache das agendas públicas: o payload calculado fica em memória por link_publico_id,
+# é invalidado sempre que a agenda, seus compromissos ou os locais do dono mudam neste
+# processo e tem a versão reconferida no banco a cada PUBLIC_AGENDA_REVALIDAR segundos
+# (alterações feitas por outros workers)
+PUBLIC_AGENDA_CACHE_SIZE = 1024
+PUBLIC_AGENDA_CACHE_TTL = 600  # segundos
+PUBLIC_AGENDA_REVALIDAR = 30  # segundos; também o TTL dos links inexistentes
+# Campos de versao_agenda de que o payload público depende
+CAMPOS_VERSAO_PUBLICA = ('nome', 'dias_semana', 'hora_inicio_padrao', 'hora_fim_padrao', 'versao', 'versao_locais')
+PUBLIC_AGENDA_MAX_AGE = 60  # Cache-Control para navegadores/CDN, revalidado via ETag
+_public_agenda_cache = TTLCache(maxsize=PUBLIC_AGENDA_CACHE_SIZE, ttl=PUBLIC_AGENDA_CACHE_TTL)
+
+# Validadores (ETag/Last-Modified) dos feeds iCalendar, por ('link', link_publico_id) ou
+# ('agenda', id_agenda): invalidados junto com o cache público e reconferidos no banco a
+# cada CALENDARIO_REVALIDAR segundos (alterações feitas por outros workers)
+CALENDARIO_CACHE_SIZE = 1024
+CALENDARIO_CACHE_TTL = 86400  # segundos; a reconferência periódica é que mantém o validador em dia
+CALENDARIO_REVALIDAR = 30  # segundos
+_calendario_cache = TTLCache(maxsize=CALENDARIO_CACHE_SIZE, ttl=CALENDARIO_CACHE_TTL)
+
+def _agenda_alterada(agenda_id):
+    """Hook called after any change to an agenda or to its compromissos."""
+    _public_agenda_cache.invalidate_where(lambda _, entrada: entrada is not None and str(entrada['agenda_id']) == str(agenda_id))
+    _calendario_cache.invalidate_where(lambda _, validador: validador is not None and str(validador.agenda_id) == str(agenda_id))
+    if _publicador:
+        _publicador.agendar(('agenda', str(agenda_id)))
+
+def _locais_alterados(usuario_id):
+    """Hook called after any change to a user's locais_trabalho."""
+    _public_agenda_cache.invalidate_where(lambda _, entrada: entrada is not None and str(entrada['proprietario_id']) == str(usuario_id))
+    _calendario_cache.invalidate_where(lambda _, validador: validador is not None and str(validador.proprietario_id) == str(usuario_id))
+    if _publicador:
+        _publicador.agendar(('usuario', str(usuario_id)))
+
+# Sincronização incremental: com ?since=<versao> as listagens de compromissos, locais e
+# configurações de valor/hora devolvem só as linhas alteradas depois dessa versão e os ids
+# excluídos (registros_excluidos no schema.sql), em vez da lista inteira
+MENSAGEM_SINCE_INVALIDO = "Parâmetro 'since' deve ser uma versão (inteiro não negativo)."
+
+def _parametro_since():
+    """The ?since= version as a non-negative int, or None when absent; ValueError when invalid."""
+    valor = request.args.get('since', '')
+    if not valor:
+        return None
+    desde = int(valor)
+    if desde < 0:
+        raise ValueError(valor)
+    return desde
+
+def _listagem_incremental(tabela, dono_id, chave, desde):
+    """
+    Body of a list endpoint: every row, or the changes since `desde`, plus the current
+    version. A version ahead of the counter (another database, a restored backup) gets the
+    full list; "completo" tells the client to replace its cache instead of merging.
+    Returns None when the owner (agenda or user) is gone.
+    """
+    alteracoes = _repositorio().alteracoes(tabela, dono_id, desde)
+    if alteracoes is not None and desde is not None and desde > alteracoes['versao']:
+        desde = None
+        alteracoes = _repositorio().alteracoes(tabela, dono_id)
+    if alteracoes is None:
+        return None
+    return {
+        "sucesso": True,
+        chave: alteracoes['linhas'],
+        "versao": alteracoes['versao'],
+        "excluidos": alteracoes['excluidos'],
+        "completo": desde is None
+    }
+
+# Atualizações ao vivo: cada gravação publica um evento no canal da agenda e o barramento
+# (eventos.py) o entrega aos streams SSE abertos em /agendas/<id>/eventos. Cada stream
+# ocupa uma thread do worker (gthread) enquanto está aberto, por isso o número deles por
+# processo é limitado; ao fim de EVENTOS_DURACAO_MAX o stream fecha, o navegador
+# reconecta sozinho e o acesso à agenda é conferido de novo.
+EVENTOS_MAX_CONEXOES = int(os.getenv('EVENTOS_MAX_CONEXOES', '8'))
+EVENTOS_DURACAO_MAX = int(os.getenv('EVENTOS_DURACAO_MAX', '300'))  # segundos
+EVENTOS_HEARTBEAT = 15  # segundos; comentário SSE que mantém proxies com a conexão aberta
+EVENTOS_RETRY_MS = 3000  # espera do navegador antes de reconectar
+_barramento = criar_barramento()
+_conexoes_eventos = threading.BoundedSemaphore(EVENTOS_MAX_CONEXOES)
+
+def _canal_agenda(agenda_id):
+    return f"agenda:{agenda_id}"
+
+def _publicar_evento(agenda_id, tipo, **dados):
+    """Publishes a change event to the agenda's live viewers; a failure never fails the write."""
+    try:
+        _barramento.publicar(_canal_agenda(agenda_id), tipo, dados)
+    except Exception as e:
+        print(f"Erro ao publicar evento {tipo} da agenda {agenda_id}: {str(e)}")
+
+def _quadro_sse(evento):
+    return f"event: {evento.tipo}\ndata: {evento.json}\n\n"
+
+@_metricas.coletor
+def _metricas_eventos():
+    return [
+        ('agenda_eventos_streams', 'gauge', 'Streams SSE de eventos abertos no processo.', [({}, _barramento.total_assinaturas())]),
+        ('agenda_eventos_publicados_total', 'counter', 'Eventos publicados no barramento pelo processo.', [({}, _barramento.publicados)])
+    ]
+
 # Rotas de páginas
 @app.route('/')
 def index():
@@ -323,8 +933,8 @@ def api_registrar():
     senha = dados.get('senha')
     
     try:
-        # Registrar usuário no Supabase Auth
-        resposta_auth = supabase_client.auth.sign_up({
+        # Registrar usuário no Supabase Auth (cliente descartável: o compartilhado não muda de sessão)
+        resposta_auth = criar_cliente_auth().sign_up({
             "email": email,
             "password": senha
         })
@@ -363,8 +973,8 @@ def api_login():
     senha = dados.get('senha')
     
     try:
-        # Login no Supabase Auth
-        resposta_auth = supabase_client.auth.sign_in_with_password({
+        # Login no Supabase Auth (cliente descartável: o compartilhado não muda de sessão)
+        resposta_auth = criar_cliente_auth().sign_in_with_password({
             "email": email,
             "password": senha
         })
@@ -382,9 +992,11 @@ def api_login():
                 session['usuario_id'] = usuario_id
                 session['nome'] = usuario['nome']
                 session['cpf'] = usuario['cpf']
+                if resposta_auth.session:
+                    _guardar_tokens_sessao(resposta_auth.session)
                 
-                # Para debugging
-                print(f"Sessão criada: {session}")
+                # Para debugging (sem os tokens)
+                print(f"Sessão criada para o usuário {usuario_id}")
                 
                 return jsonify({
                     "sucesso": True, 
@@ -405,11 +1017,17 @@ def api_login():
 
 @app.route('/auth/logout', methods=['POST'])
 def api_logout():
+    access_token = session.get('access_token')
+
     # Limpar sessão
     session.clear()
     
-    # Logout do Supabase Auth
-    supabase_client.auth.sign_out()
+    # Logout do Supabase Auth (revoga apenas a sessão deste usuário)
+    if access_token:
+        try:
+            criar_cliente_auth().admin.sign_out(access_token)
+        except Exception as e:
+            print(f"Erro no logout do Supabase Auth: {str(e)}")
     
     return jsonify({"sucesso": True})
 
@@ -418,8 +1036,47 @@ def api_logout():
 @requer_autenticacao
 def listar_locais():
     try:
-        resposta = supabase_client.table('locais_trabalho').select('*').eq('usuario_id', session['usuario_id']).execute()
-        return jsonify({"sucesso": True, "locais": resposta.data})
+        desde = _parametro_since()
+    except ValueError:
+        return jsonify({"sucesso": False, "mensagem": MENSAGEM_SINCE_INVALIDO}), 400
+    try:
+        # Contador em usuarios, lido sempre com o cliente do servidor: o dono é o da sessão
+        resposta = _listagem_incremental('locais_trabalho', session['usuario_id'], 'locais', desde)
+        if resposta is None:
+            return jsonify({"sucesso": False, "mensagem": "Usuário não encontrado."}), 404
+        return jsonify(resposta)
+    except Exception as e:
+        return jsonify({"sucesso": False, "mensagem": str(e)}), 400
+
+# Carga inicial do painel: agendas, compromissos e configurações de valor/hora da agenda
+# ativa, locais e configurações do usuário em uma resposta (em vez de cinco requisições)
+@app.route('/bootstrap', methods=['GET'])
+@requer_autenticacao
+def carga_inicial():
+    usuario_id = session['usuario_id']
+    try:
+        # A agenda pedida (a última ativa do navegador) pode ter sido excluída: nesse caso
+        # vale a agenda padrão, como no seletor do painel. Só o dono carrega a agenda no
+        # painel (a resposta traz os valores/hora)
+        id_agenda = request.args.get('agenda') or None
+        if id_agenda and not _obter_acesso_dono(id_agenda, usuario_id):
+            id_agenda = None
+
+        dados = _repositorio().dados_iniciais(usuario_id, id_agenda)
+        configuracoes = dados['configuracoes'] or _criar_configuracoes_padrao(usuario_id)
+
+        return jsonify({
+            "sucesso": True,
+            "agenda_ativa": dados['agenda_id'],
+            "agendas": dados['agendas'],
+            "compromissos": dados['compromissos'],
+            "locais_config": dados['locais_config'],
+            "locais": dados['locais'],
+            "configuracoes": configuracoes,
+            # Versões para as listagens com ?since= a partir daqui
+            "versao_agenda": dados['versao_agenda'],
+            "versao_locais": dados['versao_locais']
+        })
     except Exception as e:
         return jsonify({"sucesso": False, "mensagem": str(e)}), 400
 
@@ -446,9 +1103,10 @@ def criar_agenda():
         if 'hora_fim_padrao' in dados:
             nova_agenda_dados['hora_fim_padrao'] = dados.get('hora_fim_padrao')
 
-        resposta = supabase_client.table('agendas').insert(nova_agenda_dados).execute()
+        resposta = _cliente_do_usuario().table('agendas').insert(nova_agenda_dados).execute()
 
         if resposta.data:
+            _registrar_dono_agenda(resposta.data[0]['id_agenda'], usuario_id)
             return jsonify({"sucesso": True, "agenda": resposta.data[0]}), 201
         else:
             # Tentar extrair mensagem de erro do Supabase se disponível
@@ -465,7 +1123,16 @@ def criar_agenda():
 def clonar_agenda(id_agenda):
     dados = request.json
     usuario_id = session['usuario_id']
-    
+    tempos_ms = {}
+    inicio_fase = time.perf_counter()
+
+    def registrar_fase(nome):
+        nonlocal inicio_fase
+        agora = time.perf_counter()
+        tempos_ms[nome] = round((agora - inicio_fase) * 1000, 1)
+        inicio_fase = agora
+
+    nova_agenda_id = None
     try:
         # 1. Verificar se a agenda origem pertence ao usuário
         agenda_origem_resp = supabase_client.table('agendas').select('*').eq('id_agenda', id_agenda).eq('usuario_id', usuario_id).maybe_single().execute()
@@ -473,6 +1140,7 @@ def clonar_agenda(id_agenda):
             return jsonify({"sucesso": False, "mensagem": "Agenda origem não encontrada ou não pertence ao usuário."}), 404
         
         agenda_origem = agenda_origem_resp.data
+        registrar_fase("verificar_origem")
         
         # 2. Criar a nova agenda
         nova_agenda_dados = {
@@ -491,44 +1159,56 @@ def clonar_agenda(id_agenda):
             return jsonify({"sucesso": False, "mensagem": "Erro ao criar nova agenda"}), 400
         
         nova_agenda_id = resposta_nova_agenda.data[0]['id_agenda']
+        _registrar_dono_agenda(nova_agenda_id, usuario_id)
+        registrar_fase("criar_agenda")
         
-        # 3. Clonar configurações de locais (agenda_locais_config)
-        config_origem_resp = supabase_client.table('agenda_locais_config').select('*').eq('agenda_id', id_agenda).execute()
+        # 3. Clonar configurações de locais (agenda_locais_config) com um único insert de várias linhas
+        config_origem_resp = supabase_client.table('agenda_locais_config').select('local_id, valor_hora').eq('agenda_id', id_agenda).execute()
         
-        if config_origem_resp.data:
-            for config in config_origem_resp.data:
-                nova_config = {
-                    "agenda_id": nova_agenda_id,
-                    "local_id": config['local_id'],
-                    "valor_hora": config['valor_hora']
-                }
-                supabase_client.table('agenda_locais_config').insert(nova_config).execute()
+        novas_configs = [{
+            "agenda_id": nova_agenda_id,
+            "local_id": config['local_id'],
+            "valor_hora": config['valor_hora']
+        } for config in (config_origem_resp.data or [])]
+        if novas_configs:
+            supabase_client.table('agenda_locais_config').insert(novas_configs).execute()
+        registrar_fase("clonar_locais_config")
         
-        # 4. Clonar compromissos
-        compromissos_origem_resp = supabase_client.table('compromissos').select('*').eq('agenda_id', id_agenda).execute()
+        # 4. Clonar compromissos com um único insert de várias linhas
+        compromissos_origem_resp = supabase_client.table('compromissos').select('local_id, dia_semana, hora_inicio, hora_fim, duracao, descricao, tipo_hora').eq('agenda_id', id_agenda).execute()
         
-        if compromissos_origem_resp.data:
-            for compromisso in compromissos_origem_resp.data:
-                novo_compromisso = {
-                    "agenda_id": nova_agenda_id,
-                    "local_id": compromisso['local_id'],
-                    "dia_semana": compromisso['dia_semana'],
-                    "hora_inicio": compromisso['hora_inicio'],
-                    "hora_fim": compromisso['hora_fim'],
-                    "duracao": compromisso['duracao'],
-                    "descricao": compromisso['descricao'],
-                    "tipo_hora": compromisso['tipo_hora']
-                }
-                supabase_client.table('compromissos').insert(novo_compromisso).execute()
+        novos_compromissos = [{
+            "agenda_id": nova_agenda_id,
+            "local_id": compromisso['local_id'],
+            "dia_semana": compromisso['dia_semana'],
+            "hora_inicio": compromisso['hora_inicio'],
+            "hora_fim": compromisso['hora_fim'],
+            "duracao": compromisso['duracao'],
+            "descricao": compromisso['descricao'],
+            "tipo_hora": compromisso['tipo_hora']
+        } for compromisso in (compromissos_origem_resp.data or [])]
+        if novos_compromissos:
+            supabase_client.table('compromissos').insert(novos_compromissos).execute()
+        registrar_fase("clonar_compromissos")
         
         return jsonify({
             "sucesso": True, 
             "mensagem": "Agenda clonada com sucesso!",
-            "nova_agenda_id": nova_agenda_id
+            "nova_agenda_id": nova_agenda_id,
+            "locais_config_clonados": len(novas_configs),
+            "compromissos_clonados": len(novos_compromissos),
+            "tempos_ms": tempos_ms
         }), 201
         
     except Exception as e:
         print(f"Erro ao clonar agenda: {str(e)}")
+        # Cada insert em lote é atômico; se um falhar, remover a agenda nova (ON DELETE CASCADE
+        # remove o que já foi copiado) para não deixar uma agenda clonada pela metade
+        if nova_agenda_id:
+            try:
+                supabase_client.table('agendas').delete().eq('id_agenda', nova_agenda_id).eq('usuario_id', usuario_id).execute()
+            except Exception as erro_remocao:
+                print(f"Erro ao desfazer clonagem parcial da agenda {nova_agenda_id}: {str(erro_remocao)}")
         return jsonify({"sucesso": False, "mensagem": f"Erro ao clonar agenda: {str(e)}"}), 500
 
 @app.route('/agendas', methods=['GET'])
@@ -536,7 +1216,7 @@ def clonar_agenda(id_agenda):
 def listar_agendas():
     usuario_id = session['usuario_id']
     try:
-        resposta = supabase_client.table('agendas').select('*').eq('usuario_id', usuario_id).order('data_inicio', desc=True).execute()
+        resposta = _cliente_do_usuario().table('agendas').select('*').eq('usuario_id', usuario_id).order('data_inicio', desc=True).execute()
         return jsonify({"sucesso": True, "agendas": resposta.data})
     except Exception as e:
         return jsonify({"sucesso": False, "mensagem": str(e)}), 400
@@ -561,11 +1241,6 @@ def atualizar_agenda(id_agenda):
     usuario_id = session['usuario_id']
 
     try:
-        # Verificar se a agenda pertence ao usuário
-        verificacao = supabase_client.table('agendas').select('id_agenda').eq('id_agenda', id_agenda).eq('usuario_id', usuario_id).maybe_single().execute()
-        if not verificacao.data:
-            return jsonify({"sucesso": False, "mensagem": "Agenda não encontrada ou não pertence ao usuário"}), 404
-
         campos_atualizaveis = ['nome', 'data_inicio', 'data_fim', 'dias_semana', 'hora_inicio_padrao', 'hora_fim_padrao']
         atualizacao = {}
         for campo in campos_atualizaveis:
@@ -575,15 +1250,14 @@ def atualizar_agenda(id_agenda):
         if not atualizacao:
             return jsonify({"sucesso": False, "mensagem": "Nenhum dado fornecido para atualização"}), 400
 
-        resposta = supabase_client.table('agendas').update(atualizacao).eq('id_agenda', id_agenda).execute()
+        # A posse faz parte do próprio UPDATE: nenhuma linha afetada = não encontrada
+        agendas = _repositorio().atualizar('agendas', atualizacao, usuario_id, id_agenda=id_agenda)
+        if not agendas:
+            return jsonify({"sucesso": False, "mensagem": "Agenda não encontrada ou não pertence ao usuário"}), 404
 
-        if resposta.data:
-            return jsonify({"sucesso": True, "agenda": resposta.data[0]})
-        else:
-            error_message = "Erro ao atualizar agenda."
-            if hasattr(resposta, 'error') and resposta.error and hasattr(resposta.error, 'message'):
-                error_message = resposta.error.message
-            return jsonify({"sucesso": False, "mensagem": error_message}), 400
+        _agenda_alterada(id_agenda)
+        _publicar_evento(id_agenda, 'agenda_atualizada', agenda=agendas[0])
+        return jsonify({"sucesso": True, "agenda": agendas[0]})
 
     except Exception as e:
         return jsonify({"sucesso": False, "mensagem": str(e)}), 400
@@ -593,26 +1267,15 @@ def atualizar_agenda(id_agenda):
 def excluir_agenda(id_agenda):
     usuario_id = session['usuario_id']
     try:
-        # Verificar se a agenda pertence ao usuário
-        verificacao = supabase_client.table('agendas').select('id_agenda').eq('id_agenda', id_agenda).eq('usuario_id', usuario_id).maybe_single().execute()
-        if not verificacao.data:
+        # Um único DELETE com a posse no filtro; as linhas excluídas voltam na resposta
+        if not _repositorio().excluir('agendas', usuario_id, id_agenda=id_agenda):
             return jsonify({"sucesso": False, "mensagem": "Agenda não encontrada ou não pertence ao usuário"}), 404
 
-        resposta = supabase_client.table('agendas').delete().eq('id_agenda', id_agenda).execute()
-
-        # DELETE não retorna dados em 'data' na v2 da API python da Supabase, verificar ausência de erro.
-        if not hasattr(resposta, 'error') or resposta.error is None:
-             # Adicionando uma verificação explícita se a deleção ocorreu (opcional, mas bom para confirmar)
-            confirmacao_delecao = supabase_client.table('agendas').select('id_agenda').eq('id_agenda', id_agenda).execute()
-            if not confirmacao_delecao.data:
-                return jsonify({"sucesso": True, "mensagem": "Agenda excluída com sucesso"})
-            else:
-                return jsonify({"sucesso": False, "mensagem": "Falha ao confirmar exclusão da agenda"}), 500
-        else:
-            error_message = "Erro ao excluir agenda."
-            if hasattr(resposta, 'error') and resposta.error and hasattr(resposta.error, 'message'):
-                error_message = resposta.error.message
-            return jsonify({"sucesso": False, "mensagem": error_message}), 400
+        _invalidar_acesso_agenda(id_agenda)
+        _drop_report_aggregates(agenda_id=id_agenda)
+        _agenda_alterada(id_agenda)
+        _publicar_evento(id_agenda, 'agenda_excluida')
+        return jsonify({"sucesso": True, "mensagem": "Agenda excluída com sucesso"})
 
     except Exception as e:
         return jsonify({"sucesso": False, "mensagem": str(e)}), 400
@@ -635,7 +1298,13 @@ def criar_local():
         if dados.get('relacionado_com'):
             novo_local["relacionado_com"] = dados.get('relacionado_com')
         
-        resposta = supabase_client.table('locais_trabalho').insert(novo_local).execute()
+        resposta = _cliente_do_usuario().table('locais_trabalho').insert(novo_local).execute()
+        
+        # Atualizar o índice de grupos de locais em memória (se carregado)
+        local = resposta.data[0]
+        _replace_workplace_group_index(session['usuario_id'], lambda grupos: grupos.with_workplace(local['id_local'], local.get('relacionado_com')))
+        _update_report_workplace(session['usuario_id'], resposta.data[0])
+        _locais_alterados(session['usuario_id'])
         
         return jsonify({"sucesso": True, "local": resposta.data[0]})
     except Exception as e:
@@ -647,16 +1316,6 @@ def atualizar_local(id_local):
     dados = request.json
     
     try:
-        # Verificar se o local pertence ao usuário
-        verificacao = supabase_client.table('locais_trabalho')\
-            .select('id_local')\
-            .eq('id_local', id_local)\
-            .eq('usuario_id', session['usuario_id'])\
-            .execute()
-            
-        if not verificacao.data:
-            return jsonify({"sucesso": False, "mensagem": "Local não encontrado ou sem permissão"}), 404
-        
         atualizacao = {
             "nome": dados.get('nome'),
             "cor": dados.get('cor'),
@@ -668,12 +1327,15 @@ def atualizar_local(id_local):
         if 'relacionado_com' in dados:
             atualizacao["relacionado_com"] = dados.get('relacionado_com')
         
-        resposta = supabase_client.table('locais_trabalho')\
-            .update(atualizacao)\
-            .eq('id_local', id_local)\
-            .execute()
+        locais = _repositorio(_cliente_do_usuario()).atualizar('locais_trabalho', atualizacao, session['usuario_id'], id_local=id_local)
+        if not locais:
+            return jsonify({"sucesso": False, "mensagem": "Local não encontrado ou sem permissão"}), 404
         
-        return jsonify({"sucesso": True, "local": resposta.data[0]})
+        _replace_workplace_group_index(session['usuario_id'], lambda grupos: grupos.with_relation(id_local, locais[0].get('relacionado_com')))
+        _update_report_workplace(session['usuario_id'], locais[0])
+        _locais_alterados(session['usuario_id'])
+        
+        return jsonify({"sucesso": True, "local": locais[0]})
     except Exception as e:
         return jsonify({"sucesso": False, "mensagem": str(e)}), 400
 
@@ -681,21 +1343,14 @@ def atualizar_local(id_local):
 @requer_autenticacao
 def excluir_local(id_local):
     try:
-        # Verificar se o local pertence ao usuário
-        verificacao = supabase_client.table('locais_trabalho')\
-            .select('id_local')\
-            .eq('id_local', id_local)\
-            .eq('usuario_id', session['usuario_id'])\
-            .execute()
-            
-        if not verificacao.data:
+        # Remover o local (a posse faz parte do DELETE)
+        if not _repositorio(_cliente_do_usuario()).excluir('locais_trabalho', session['usuario_id'], id_local=id_local):
             return jsonify({"sucesso": False, "mensagem": "Local não encontrado ou sem permissão"}), 404
         
-        # Remover o local
-        supabase_client.table('locais_trabalho')\
-            .delete()\
-            .eq('id_local', id_local)\
-            .execute()
+        _replace_workplace_group_index(session['usuario_id'], lambda grupos: grupos.without_workplace(id_local))
+        # A remoção apaga em cascata compromissos e configurações: recarregar os agregados
+        _drop_report_aggregates(usuario_id=session['usuario_id'])
+        _locais_alterados(session['usuario_id'])
         
         return jsonify({"sucesso": True})
     except Exception as e:
@@ -706,14 +1361,20 @@ def excluir_local(id_local):
 @requer_autenticacao
 def listar_compromissos(id_agenda):
     usuario_id = session['usuario_id']
+    try:
+        desde = _parametro_since()
+    except ValueError:
+        return jsonify({"sucesso": False, "mensagem": MENSAGEM_SINCE_INVALIDO}), 400
     try:
         # Verificar se a agenda pertence ao usuário
-        agenda_verif = supabase_client.table('agendas').select('id_agenda').eq('id_agenda', id_agenda).eq('usuario_id', usuario_id).maybe_single().execute()
-        if not agenda_verif.data:
+        acesso = _obter_acesso_agenda(id_agenda, usuario_id)
+        if not acesso:
             return jsonify({"sucesso": False, "mensagem": "Agenda não encontrada ou não pertence ao usuário."}), 404
 
-        resposta = supabase_client.table('compromissos').select('*').eq('agenda_id', id_agenda).execute()
-        return jsonify({"sucesso": True, "compromissos": resposta.data})
+        resposta = _listagem_incremental('compromissos', id_agenda, 'compromissos', desde)
+        if resposta is None:
+            return jsonify({"sucesso": False, "mensagem": "Agenda não encontrada ou não pertence ao usuário."}), 404
+        return jsonify(resposta)
     except Exception as e:
         return jsonify({"sucesso": False, "mensagem": str(e)}), 400
 
@@ -725,33 +1386,34 @@ def criar_compromisso(id_agenda):
     
     try:
         # 1. Verificar se a agenda pertence ao usuário
-        agenda_verif = supabase_client.table('agendas').select('id_agenda').eq('id_agenda', id_agenda).eq('usuario_id', usuario_id).maybe_single().execute()
-        if not agenda_verif.data:
+        if not _pode_escrever_agenda(id_agenda, usuario_id):
             return jsonify({"sucesso": False, "mensagem": "Agenda não encontrada ou não pertence ao usuário."}), 404
 
-        # 2. Verificar se o local_id (workplace) pertence ao usuário - Feito em _validate_appointment indiretamente ou explicitamente antes se necessário
-        # No entanto, a verificação de propriedade do local_id é crucial antes de prosseguir.
-        local_details_check = _get_workplace_details(supabase_client, dados.get('local_id'))
-        if not local_details_check or local_details_check.get('usuario_id') != usuario_id:
+        if VALIDACAO_NO_BANCO:
+            # Validação e inserção atômicas no banco: uma chamada, sob lock da agenda
+            _, compromisso_to_insert, erro_campos = _prepare_new_appointment(dados, id_agenda)
+            if erro_campos:
+                return jsonify({"sucesso": False, "mensagem": erro_campos}), 400
+            resultado, violacao = _validar_e_gravar_no_banco(id_agenda, usuario_id, compromisso_to_insert)
+            if violacao:
+                if violacao['codigo'] == 'local_nao_encontrado':
+                    return jsonify({"sucesso": False, "mensagem": "Local de trabalho não encontrado ou não pertence ao usuário."}), 403
+                return _resposta_violacao(violacao)
+            _update_report_aggregate(id_agenda, new=resultado['compromisso'])
+            _agenda_alterada(id_agenda)
+            _publicar_evento(id_agenda, 'compromisso_criado', compromisso=resultado['compromisso'])
+            return jsonify({"sucesso": True, "compromisso": resultado['compromisso']}), 201
+
+        # 2. Carregar a semana da agenda e os locais do usuário (duas queries) e
+        #    verificar se o local_id (workplace) pertence ao usuário
+        snapshot = _ValidationSnapshot(supabase_client, id_agenda, usuario_id)
+        if not snapshot.get_workplace(dados.get('local_id')):
              return jsonify({"sucesso": False, "mensagem": "Local de trabalho não encontrado ou não pertence ao usuário."}), 403
 
 
-        compromisso_para_validacao = {
-            "local_id": dados.get('local_id'),
-            "dia_semana": int(dados.get('dia_semana')) if dados.get('dia_semana') is not None else None,
-            "hora_inicio": dados.get('hora_inicio'),
-            "hora_fim": dados.get('hora_fim'),
-            "duracao": float(dados.get('duracao')) if dados.get('duracao') is not None else None,
-            # agenda_id and usuario_id are passed directly to _validate_appointment
-        }
-        
-        # Validar campos obrigatórios para compromisso (antes de passar para _validate_appointment)
-        for campo_key in ['local_id', 'dia_semana', 'hora_inicio', 'hora_fim', 'duracao']: # tipo_hora is not used in validation logic itself
-            if compromisso_para_validacao.get(campo_key) is None:
-                return jsonify({"sucesso": False, "mensagem": f"Campo '{campo_key}' é obrigatório para validação e não pode ser nulo."}), 400
-        if dados.get('tipo_hora') is None: # tipo_hora is for DB insertion
-             return jsonify({"sucesso": False, "mensagem": "Campo 'tipo_hora' é obrigatório."}), 400
-
+        compromisso_para_validacao, compromisso_to_insert, erro_campos = _prepare_new_appointment(dados, id_agenda)
+        if erro_campos:
+            return jsonify({"sucesso": False, "mensagem": erro_campos}), 400
 
         # >>> BEGIN BUSINESS LOGIC VALIDATION <<<
         is_valid, error_response, status_code = _validate_appointment(
@@ -759,24 +1421,18 @@ def criar_compromisso(id_agenda):
             id_agenda,
             compromisso_para_validacao,
             usuario_id,
-            existing_appointment_id=None # None for new appointments
+            existing_appointment_id=None, # None for new appointments
+            snapshot=snapshot
         )
         if not is_valid:
             return error_response, status_code
         # >>> END BUSINESS LOGIC VALIDATION <<<
 
-        # Prepare final data for insertion, using original 'dados' for DB fields
-        compromisso_to_insert = {
-            "agenda_id": id_agenda,
-            "local_id": dados.get('local_id'),
-            "dia_semana": int(dados.get('dia_semana')), # Ensure it's int for DB
-            "hora_inicio": dados.get('hora_inicio'),
-            "hora_fim": dados.get('hora_fim'),
-            "descricao": dados.get('descricao'),
-            "tipo_hora": dados.get('tipo_hora'),
-            "duracao": dados.get('duracao') # Let DB handle decimal conversion from string/number
-        }
         resposta = supabase_client.table('compromissos').insert(compromisso_to_insert).execute()
+        if resposta.data:
+            _update_report_aggregate(id_agenda, new=resposta.data[0])
+            _publicar_evento(id_agenda, 'compromisso_criado', compromisso=resposta.data[0])
+        _agenda_alterada(id_agenda)
         
         if resposta.data:
             return jsonify({"sucesso": True, "compromisso": resposta.data[0]}), 201
@@ -789,6 +1445,139 @@ def criar_compromisso(id_agenda):
     except Exception as e:
         return jsonify({"sucesso": False, "mensagem": str(e)}), 400
 
+MAX_COMPROMISSOS_POR_LOTE = 200
+
+@app.route('/agendas/<id_agenda>/compromissos/lote', methods=['POST'])
+@requer_autenticacao
+def criar_compromissos_lote(id_agenda):
+    """Cria vários compromissos de uma vez, validando-os contra a semana e entre si."""
+    dados = request.json or {}
+    usuario_id = session['usuario_id']
+    itens = dados.get('compromissos')
+
+    if not isinstance(itens, list) or not itens:
+        return jsonify({"sucesso": False, "mensagem": "Envie uma lista não vazia em 'compromissos'."}), 400
+    if len(itens) > MAX_COMPROMISSOS_POR_LOTE:
+        return jsonify({"sucesso": False, "mensagem": f"Máximo de {MAX_COMPROMISSOS_POR_LOTE} compromissos por lote."}), 400
+
+    try:
+        # 1. Verificar se a agenda pertence ao usuário
+        if not _pode_escrever_agenda(id_agenda, usuario_id):
+            return jsonify({"sucesso": False, "mensagem": "Agenda não encontrada ou não pertence ao usuário."}), 404
+
+        # 2. Carregar a semana uma única vez; cada item aceito entra no snapshot em memória,
+        #    de modo que os itens seguintes são validados também contra ele
+        snapshot = _ValidationSnapshot(supabase_client, id_agenda, usuario_id)
+
+        resultados = []
+        aceitos = []  # (indice do resultado, registro para inserir)
+        for indice, item in enumerate(itens):
+            if not isinstance(item, dict):
+                resultados.append({"indice": indice, "sucesso": False, "mensagem": "Item inválido."})
+                continue
+
+            if not snapshot.get_workplace(item.get('local_id')):
+                resultados.append({"indice": indice, "sucesso": False, "mensagem": "Local de trabalho não encontrado ou não pertence ao usuário."})
+                continue
+
+            para_validacao, para_inserir, erro_campos = _prepare_new_appointment(item, id_agenda)
+            if erro_campos:
+                resultados.append({"indice": indice, "sucesso": False, "mensagem": erro_campos})
+                continue
+
+            is_valid, error_response, _ = _validate_appointment(
+                supabase_client, id_agenda, para_validacao, usuario_id, snapshot=snapshot
+            )
+            if not is_valid:
+                resultados.append({"indice": indice, "sucesso": False, "mensagem": error_response.get_json().get('mensagem')})
+                continue
+
+            snapshot.add_appointment({**para_validacao, "id_compromisso": f"lote-{indice}"})
+            aceitos.append((len(resultados), para_inserir))
+            resultados.append({"indice": indice, "sucesso": True})
+
+        # 3. Inserir todos os aceitos com um único insert de várias linhas
+        if aceitos:
+            resposta = supabase_client.table('compromissos').insert([registro for _, registro in aceitos]).execute()
+            if not resposta.data or len(resposta.data) != len(aceitos):
+                # Sem uma linha por item não dá para parear as linhas devolvidas com os itens:
+                # nenhum aceito é confirmado, e agregados e visualizadores recarregam do banco
+                for posicao, _ in aceitos:
+                    resultados[posicao].update({"sucesso": False, "mensagem": "Não foi possível confirmar a inserção deste compromisso."})
+                _drop_report_aggregates(agenda_id=id_agenda)
+                _agenda_alterada(id_agenda)
+                _publicar_evento(id_agenda, 'ressincronizar')
+                return jsonify({"sucesso": False, "mensagem": "Erro ao inserir os compromissos do lote.", "resultados": resultados}), 400
+
+            for criado in resposta.data:
+                _update_report_aggregate(id_agenda, new=criado)
+                _publicar_evento(id_agenda, 'compromisso_criado', compromisso=criado)
+            _agenda_alterada(id_agenda)
+            for (posicao, _), criado in zip(aceitos, resposta.data):
+                resultados[posicao]["compromisso"] = criado
+
+        return jsonify({
+            "sucesso": bool(aceitos),
+            "inseridos": len(aceitos),
+            "rejeitados": len(itens) - len(aceitos),
+            "resultados": resultados
+        }), 201 if aceitos else 400
+
+    except Exception as e:
+        return jsonify({"sucesso": False, "mensagem": str(e)}), 400
+
+@app.route('/agendas/<id_agenda>/horarios_livres', methods=['GET'])
+@requer_autenticacao
+def listar_horarios_livres(id_agenda):
+    """Lista os horários em que um compromisso da duração informada passaria em todas as regras."""
+    usuario_id = session['usuario_id']
+    local_id = request.args.get('local_id')
+    duracao = request.args.get('duracao', type=float)
+    passo = min(max(request.args.get('passo', 15, type=int), 1), 60)
+
+    if not local_id or duracao is None or duracao <= 0:
+        return jsonify({"sucesso": False, "mensagem": "Parâmetros 'local_id' e 'duracao' (em horas) são obrigatórios."}), 400
+    dia_semana = request.args.get('dia_semana')
+    if dia_semana is not None and dia_semana not in {str(dia) for dia in range(7)}:
+        return jsonify({"sucesso": False, "mensagem": "Parâmetro 'dia_semana' deve ser um inteiro de 0 a 6."}), 400
+
+    try:
+        agenda_verif = supabase_client.table('agendas').select('id_agenda, dias_semana, hora_inicio_padrao, hora_fim_padrao').eq('id_agenda', id_agenda).eq('usuario_id', usuario_id).maybe_single().execute()
+        # maybe_single() devolve None (e não uma resposta vazia) quando não há linha
+        if not agenda_verif or not agenda_verif.data:
+            return jsonify({"sucesso": False, "mensagem": "Agenda não encontrada ou não pertence ao usuário."}), 404
+        agenda = agenda_verif.data
+
+        snapshot = _ValidationSnapshot(supabase_client, id_agenda, usuario_id)
+        if not snapshot.get_workplace(local_id):
+            return jsonify({"sucesso": False, "mensagem": "Local de trabalho não encontrado ou não pertence ao usuário."}), 404
+
+        if dia_semana is not None:
+            dias = [int(dia_semana)]
+        else:
+            dias = sorted(int(dia) for dia in (agenda.get('dias_semana') or []))
+
+        # Procurar apenas dentro da janela padrão da agenda
+        duracao_minutos = int(round(duracao * 60))
+        janela_inicio = _time_str_to_minutes(agenda.get('hora_inicio_padrao')) or 0
+        janela_fim = _time_str_to_minutes(agenda.get('hora_fim_padrao')) or MINUTES_PER_DAY
+
+        horarios = []
+        for dia in dias:
+            for inicio in range(janela_inicio, janela_fim - duracao_minutos + 1, passo):
+                fim = inicio + duracao_minutos
+                if _appointment_rule_violation(snapshot, local_id, dia, inicio, fim, duracao) is None:
+                    horarios.append({
+                        "dia_semana": dia,
+                        "hora_inicio": _minutes_to_time_str(inicio),
+                        "hora_fim": _minutes_to_time_str(fim)
+                    })
+
+        return jsonify({"sucesso": True, "duracao": duracao, "passo": passo, "horarios": horarios})
+
+    except Exception as e:
+        return jsonify({"sucesso": False, "mensagem": str(e)}), 500
+
 @app.route('/agendas/<id_agenda>/compromissos/<id_compromisso>', methods=['PUT'])
 @requer_autenticacao
 def atualizar_compromisso(id_agenda, id_compromisso):
@@ -800,34 +1589,43 @@ def atualizar_compromisso(id_agenda, id_compromisso):
 
     try:
         # 1. Verificar se a agenda pertence ao usuário
-        agenda_verif = supabase_client.table('agendas').select('id_agenda').eq('id_agenda', id_agenda).eq('usuario_id', usuario_id).maybe_single().execute()
-        if not agenda_verif.data:
+        if not _pode_escrever_agenda(id_agenda, usuario_id):
             return jsonify({"sucesso": False, "mensagem": "Agenda não encontrada ou não pertence ao usuário."}), 404
 
-        # 2. Buscar dados originais do compromisso
+        # 2. Preparar os dados para o banco de dados (apenas o que foi enviado)
+        atualizacao_para_db = {}
+        campos_permitidos_db = ['local_id', 'dia_semana', 'hora_inicio', 'hora_fim',
+                                'descricao', 'tipo_hora', 'duracao']
+        for campo in campos_permitidos_db:
+            if campo in dados:
+                atualizacao_para_db[campo] = dados.get(campo)
+        
+        if not atualizacao_para_db:
+            return jsonify({"sucesso": False, "mensagem": "Nenhum dado válido fornecido para atualização."}), 400
+
+        if VALIDACAO_NO_BANCO:
+            # Validação e atualização atômicas no banco: uma chamada, sob lock da agenda
+            resultado, violacao = _validar_e_gravar_no_banco(id_agenda, usuario_id, atualizacao_para_db, id_compromisso)
+            if violacao:
+                return _resposta_violacao(violacao)
+            _update_report_aggregate(id_agenda, old=resultado['anterior'], new=resultado['compromisso'])
+            _agenda_alterada(id_agenda)
+            _publicar_evento(id_agenda, 'compromisso_atualizado', compromisso=resultado['compromisso'])
+            return jsonify({"sucesso": True, "compromisso": resultado['compromisso']})
+
+        # 3. Buscar dados originais do compromisso
         compromisso_original_resp = supabase_client.table('compromissos')\
             .select('*')\
             .eq('id_compromisso', id_compromisso)\
             .eq('agenda_id', id_agenda)\
             .maybe_single().execute()
             
-        if not compromisso_original_resp.data:
+        if not compromisso_original_resp or not compromisso_original_resp.data:
             return jsonify({"sucesso": False, "mensagem": "Compromisso não encontrado ou não pertence à agenda."}), 404
         
         compromisso_original_data = compromisso_original_resp.data
         print(f"Dados originais do compromisso: {compromisso_original_data}")
 
-        # 3. Preparar os dados para o banco de dados (apenas o que foi enviado)
-        atualizacao_para_db = {}
-        campos_permitidos_db = ['local_id', 'dia_semana', 'hora_inicio', 'hora_fim',
-                                'descricao', 'tipo_hora', 'duracao']
-        for campo in campos_permitidos_db:
-            if campo in dados:
-                atualizacao_para_db[campo] = dados.get(campo)
-        
-        if not atualizacao_para_db:
-            return jsonify({"sucesso": False, "mensagem": "Nenhum dado válido fornecido para atualização."}), 400
-
         # 4. Construir o estado futuro do compromisso para validação
         #    Usando o dado novo se existir, senão, o original.
         dados_para_validar = {
@@ -854,20 +1652,17 @@ def atualizar_compromisso(id_agenda, id_compromisso):
         print("--- VALIDAÇÃO CONCLUÍDA COM SUCESSO ---")
 
         # 6. Se a validação passou, atualizar o banco de dados
-        resposta = supabase_client.table('compromissos')\
-            .update(atualizacao_para_db)\
-            .eq('id_compromisso', id_compromisso)\
-            .execute()
-        
-        if resposta.data:
-            print(f"Compromisso {id_compromisso} atualizado com sucesso no DB.")
-            return jsonify({"sucesso": True, "compromisso": resposta.data[0]})
-        else:
-            error_message = "Erro ao atualizar compromisso no DB."
-            if hasattr(resposta, 'error') and resposta.error and hasattr(resposta.error, 'message'):
-                error_message = resposta.error.message
-            print(f"ERRO NO DB: {error_message}")
-            return jsonify({"sucesso": False, "mensagem": error_message}), 400
+        compromissos = _repositorio().atualizar('compromissos', atualizacao_para_db, usuario_id,
+                                                id_compromisso=id_compromisso, agenda_id=id_agenda)
+        if not compromissos:
+            # Excluído entre a leitura e a gravação
+            return jsonify({"sucesso": False, "mensagem": "Compromisso não encontrado ou não pertence à agenda."}), 404
+
+        _update_report_aggregate(id_agenda, old=compromisso_original_data, new=compromissos[0])
+        _agenda_alterada(id_agenda)
+        _publicar_evento(id_agenda, 'compromisso_atualizado', compromisso=compromissos[0])
+        print(f"Compromisso {id_compromisso} atualizado com sucesso no DB.")
+        return jsonify({"sucesso": True, "compromisso": compromissos[0]})
 
     except Exception as e:
         print(f"ERRO INESPERADO: {str(e)}")
@@ -879,47 +1674,41 @@ def excluir_compromisso(id_agenda, id_compromisso):
     usuario_id = session['usuario_id']
     try:
         # 1. Verificar se a agenda pertence ao usuário
-        agenda_verif = supabase_client.table('agendas').select('id_agenda').eq('id_agenda', id_agenda).eq('usuario_id', usuario_id).maybe_single().execute()
-        if not agenda_verif.data:
+        if not _pode_escrever_agenda(id_agenda, usuario_id):
             return jsonify({"sucesso": False, "mensagem": "Agenda não encontrada ou não pertence ao usuário."}), 404
 
-        # 2. Verificar se o compromisso pertence à agenda especificada
-        verificacao_compromisso = supabase_client.table('compromissos')\
-            .select('id_compromisso')\
-            .eq('id_compromisso', id_compromisso)\
-            .eq('agenda_id', id_agenda)\
-            .maybe_single().execute()
-            
-        if not verificacao_compromisso.data:
+        # 2. Remover o compromisso da agenda; a linha excluída volta na resposta
+        excluidos = _repositorio().excluir('compromissos', usuario_id, id_compromisso=id_compromisso, agenda_id=id_agenda)
+        if not excluidos:
             return jsonify({"sucesso": False, "mensagem": "Compromisso não encontrado ou não pertence à agenda especificada."}), 404
-        
-        # Remover o compromisso
-        resposta = supabase_client.table('compromissos')\
-            .delete()\
-            .eq('id_compromisso', id_compromisso)\
-            .execute()
-        
-        if not hasattr(resposta, 'error') or resposta.error is None:
-            confirmacao_delecao = supabase_client.table('compromissos').select('id_compromisso').eq('id_compromisso', id_compromisso).execute()
-            if not confirmacao_delecao.data:
-                return jsonify({"sucesso": True, "mensagem": "Compromisso excluído com sucesso"})
-            else: # Deveria ser impossível chegar aqui se a deleção foi bem sucedida e o item não existe mais
-                return jsonify({"sucesso": False, "mensagem": "Falha ao confirmar exclusão do compromisso"}), 500
-        else:
-            error_message = "Erro ao excluir compromisso."
-            if hasattr(resposta, 'error') and resposta.error and hasattr(resposta.error, 'message'):
-                error_message = resposta.error.message
-            return jsonify({"sucesso": False, "mensagem": error_message}), 400
+
+        _update_report_aggregate(id_agenda, old=excluidos[0])
+        _agenda_alterada(id_agenda)
+        _publicar_evento(id_agenda, 'compromisso_excluido', id_compromisso=excluidos[0]['id_compromisso'])
+        return jsonify({"sucesso": True, "mensagem": "Compromisso excluído com sucesso"})
 
     except Exception as e:
         return jsonify({"sucesso": False, "mensagem": str(e)}), 400
 
 # API de Configurações
+def _criar_configuracoes_padrao(usuario_id):
+    """Creates and returns the default settings of a user who has none yet."""
+    configuracoes_padrao = {
+        "usuario_id": usuario_id,
+        "dias_semana": [1, 2, 3, 4, 5, 6],
+        "hora_inicio_padrao": "07:00",
+        "hora_fim_padrao": "23:00"
+    }
+    resposta_criacao = _cliente_do_usuario().table('configuracoes_usuario')\
+        .insert(configuracoes_padrao)\
+        .execute()
+    return resposta_criacao.data[0]
+
 @app.route('/configuracoes', methods=['GET'])
 @requer_autenticacao
 def obter_configuracoes():
     try:
-        resposta = supabase_client.table('configuracoes_usuario')\
+        resposta = _cliente_do_usuario().table('configuracoes_usuario')\
             .select('*')\
             .eq('usuario_id', session['usuario_id'])\
             .execute()
@@ -928,18 +1717,7 @@ def obter_configuracoes():
             return jsonify({"sucesso": True, "configuracoes": resposta.data[0]})
         else:
             # Criar configurações padrão se não existirem
-            configuracoes_padrao = {
-                "usuario_id": session['usuario_id'],
-                "dias_semana": [1, 2, 3, 4, 5, 6],
-                "hora_inicio_padrao": "07:00",
-                "hora_fim_padrao": "23:00"
-            }
-            
-            resposta_criacao = supabase_client.table('configuracoes_usuario')\
-                .insert(configuracoes_padrao)\
-                .execute()
-                
-            return jsonify({"sucesso": True, "configuracoes": resposta_criacao.data[0]})
+            return jsonify({"sucesso": True, "configuracoes": _criar_configuracoes_padrao(session['usuario_id'])})
     except Exception as e:
         return jsonify({"sucesso": False, "mensagem": str(e)}), 400
 
@@ -956,24 +1734,11 @@ def atualizar_configuracoes():
             if campo in dados:
                 atualizacao[campo] = dados.get(campo)
         
-        # Verificar se configurações existem
-        verificacao = supabase_client.table('configuracoes_usuario')\
-            .select('id_configuracao')\
-            .eq('usuario_id', session['usuario_id'])\
+        # Atualizar ou criar as configurações em um único upsert (usuario_id é único)
+        atualizacao["usuario_id"] = session['usuario_id']
+        resposta = _cliente_do_usuario().table('configuracoes_usuario')\
+            .upsert(atualizacao, on_conflict='usuario_id')\
             .execute()
-            
-        if verificacao.data:
-            # Atualizar configurações existentes
-            resposta = supabase_client.table('configuracoes_usuario')\
-                .update(atualizacao)\
-                .eq('usuario_id', session['usuario_id'])\
-                .execute()
-        else:
-            # Criar novas configurações
-            atualizacao["usuario_id"] = session['usuario_id']
-            resposta = supabase_client.table('configuracoes_usuario')\
-                .insert(atualizacao)\
-                .execute()
         
         return jsonify({"sucesso": True, "configuracoes": resposta.data[0]})
     except Exception as e:
@@ -994,8 +1759,7 @@ def adicionar_local_config_agenda(id_agenda):
 
     try:
         # 1. Verificar se a agenda pertence ao usuário
-        agenda_verif = supabase_client.table('agendas').select('id_agenda').eq('id_agenda', id_agenda).eq('usuario_id', usuario_id).maybe_single().execute()
-        if not agenda_verif.data:
+        if not _pode_escrever_agenda(id_agenda, usuario_id):
             return jsonify({"sucesso": False, "mensagem": "Agenda não encontrada ou não pertence ao usuário."}), 404
 
         # 2. Verificar se o local_id (workplace) pertence ao usuário
@@ -1012,6 +1776,8 @@ def adicionar_local_config_agenda(id_agenda):
         resposta = supabase_client.table('agenda_locais_config').insert(nova_config_dados).execute()
 
         if resposta.data:
+            _update_report_valor_hora(id_agenda, resposta.data[0])
+            _publicar_evento(id_agenda, 'configuracao_alterada', configuracoes=resposta.data, excluidos=[])
             return jsonify({"sucesso": True, "configuracao": resposta.data[0]}), 201
         else:
             error_message = "Erro ao adicionar configuração de local à agenda."
@@ -1029,16 +1795,21 @@ def adicionar_local_config_agenda(id_agenda):
 @requer_autenticacao
 def listar_locais_config_agenda(id_agenda):
     usuario_id = session['usuario_id']
+    try:
+        desde = _parametro_since()
+    except ValueError:
+        return jsonify({"sucesso": False, "mensagem": MENSAGEM_SINCE_INVALIDO}), 400
     try:
         # 1. Verificar se a agenda pertence ao usuário
-        agenda_verif = supabase_client.table('agendas').select('id_agenda').eq('id_agenda', id_agenda).eq('usuario_id', usuario_id).maybe_single().execute()
-        if not agenda_verif.data:
+        acesso = _obter_acesso_dono(id_agenda, usuario_id)
+        if not acesso:
             return jsonify({"sucesso": False, "mensagem": "Agenda não encontrada ou não pertence ao usuário."}), 404
 
-        # 2. Selecionar as configurações, opcionalmente com join no nome do local
-        resposta = supabase_client.table('agenda_locais_config').select('*, locais_trabalho(nome, cor)').eq('agenda_id', id_agenda).execute()
-
-        return jsonify({"sucesso": True, "configuracoes": resposta.data})
+        # 2. Selecionar as configurações (todas ou as alteradas), com o nome e a cor do local
+        resposta = _listagem_incremental('agenda_locais_config', id_agenda, 'configuracoes', desde)
+        if resposta is None:
+            return jsonify({"sucesso": False, "mensagem": "Agenda não encontrada ou não pertence ao usuário."}), 404
+        return jsonify(resposta)
     except Exception as e:
         return jsonify({"sucesso": False, "mensagem": str(e)}), 500
 
@@ -1054,27 +1825,18 @@ def atualizar_local_config_agenda(id_agenda, id_agenda_local):
 
     try:
         # 1. Verificar se a agenda pertence ao usuário
-        agenda_verif = supabase_client.table('agendas').select('id_agenda').eq('id_agenda', id_agenda).eq('usuario_id', usuario_id).maybe_single().execute()
-        if not agenda_verif.data:
+        if not _pode_escrever_agenda(id_agenda, usuario_id):
             return jsonify({"sucesso": False, "mensagem": "Agenda não encontrada ou não pertence ao usuário."}), 404
 
-        # 2. Verificar se a configuração (id_agenda_local) existe e pertence à agenda especificada
-        #    Esta etapa também implicitamente verifica se o usuario_id tem acesso, devido ao JOIN interno que o Supabase RLS faria ou por esta query:
-        config_verif = supabase_client.table('agenda_locais_config').select('id_agenda_local').eq('id_agenda_local', id_agenda_local).eq('agenda_id', id_agenda).maybe_single().execute()
-        if not config_verif.data:
+        # 2. Atualizar o valor_hora da configuração, presa à agenda pelo filtro
+        configuracoes = _repositorio().atualizar('agenda_locais_config', {"valor_hora": valor_hora}, usuario_id,
+                                                 id_agenda_local=id_agenda_local, agenda_id=id_agenda)
+        if not configuracoes:
             return jsonify({"sucesso": False, "mensagem": "Configuração de local não encontrada ou não pertence à agenda especificada."}), 404
 
-        # 3. Atualizar o valor_hora
-        atualizacao_dados = {"valor_hora": valor_hora}
-        resposta = supabase_client.table('agenda_locais_config').update(atualizacao_dados).eq('id_agenda_local', id_agenda_local).execute()
-
-        if resposta.data:
-            return jsonify({"sucesso": True, "configuracao": resposta.data[0]})
-        else:
-            error_message = "Erro ao atualizar configuração de local."
-            if hasattr(resposta, 'error') and resposta.error and hasattr(resposta.error, 'message'):
-                error_message = resposta.error.message
-            return jsonify({"sucesso": False, "mensagem": error_message}), 400
+        _update_report_valor_hora(id_agenda, configuracoes[0])
+        _publicar_evento(id_agenda, 'configuracao_alterada', configuracoes=configuracoes, excluidos=[])
+        return jsonify({"sucesso": True, "configuracao": configuracoes[0]})
 
     except Exception as e:
         return jsonify({"sucesso": False, "mensagem": str(e)}), 500
@@ -1085,30 +1847,17 @@ def excluir_local_config_agenda(id_agenda, id_agenda_local):
     usuario_id = session['usuario_id']
     try:
         # 1. Verificar se a agenda pertence ao usuário
-        agenda_verif = supabase_client.table('agendas').select('id_agenda').eq('id_agenda', id_agenda).eq('usuario_id', usuario_id).maybe_single().execute()
-        if not agenda_verif.data:
+        if not _pode_escrever_agenda(id_agenda, usuario_id):
             return jsonify({"sucesso": False, "mensagem": "Agenda não encontrada ou não pertence ao usuário."}), 404
 
-        # 2. Verificar se a configuração (id_agenda_local) existe e pertence à agenda especificada
-        config_verif = supabase_client.table('agenda_locais_config').select('id_agenda_local').eq('id_agenda_local', id_agenda_local).eq('agenda_id', id_agenda).maybe_single().execute()
-        if not config_verif.data:
+        # 2. Deletar a configuração da agenda; a linha excluída volta na resposta
+        excluidas = _repositorio().excluir('agenda_locais_config', usuario_id, id_agenda_local=id_agenda_local, agenda_id=id_agenda)
+        if not excluidas:
             return jsonify({"sucesso": False, "mensagem": "Configuração de local não encontrada ou não pertence à agenda especificada."}), 404
 
-        # 3. Deletar a configuração
-        resposta = supabase_client.table('agenda_locais_config').delete().eq('id_agenda_local', id_agenda_local).execute()
-
-        if not hasattr(resposta, 'error') or resposta.error is None:
-            # Adicionando uma verificação explícita se a deleção ocorreu (opcional, mas bom para confirmar)
-            confirmacao_delecao = supabase_client.table('agenda_locais_config').select('id_agenda_local').eq('id_agenda_local', id_agenda_local).execute()
-            if not confirmacao_delecao.data:
-                return jsonify({"sucesso": True, "mensagem": "Configuração de local excluída com sucesso"})
-            else:
-                 return jsonify({"sucesso": False, "mensagem": "Falha ao confirmar exclusão da configuração"}), 500
-        else:
-            error_message = "Erro ao excluir configuração de local."
-            if hasattr(resposta, 'error') and resposta.error and hasattr(resposta.error, 'message'):
-                error_message = resposta.error.message
-            return jsonify({"sucesso": False, "mensagem": error_message}), 400
+        _update_report_valor_hora(id_agenda, excluidas[0], excluida=True)
+        _publicar_evento(id_agenda, 'configuracao_alterada', configuracoes=[], excluidos=[excluidas[0]['id_agenda_local']])
+        return jsonify({"sucesso": True, "mensagem": "Configuração de local excluída com sucesso"})
 
     except Exception as e:
         return jsonify({"sucesso": False, "mensagem": str(e)}), 500
@@ -1126,8 +1875,7 @@ def compartilhar_agenda_privado(id_agenda):
 
     try:
         # 1. Verificar se a agenda pertence ao usuário que está concedendo
-        agenda_propria_resp = supabase_client.table('agendas').select('id_agenda, usuario_id').eq('id_agenda', id_agenda).eq('usuario_id', usuario_concedeu_id).maybe_single().execute()
-        if not agenda_propria_resp.data:
+        if not _pode_escrever_agenda(id_agenda, usuario_concedeu_id):
             return jsonify({"sucesso": False, "mensagem": "Agenda não encontrada ou não pertence ao usuário."}), 404
 
         # 2. Encontrar o usuário que receberá o compartilhamento pelo e-mail
@@ -1157,6 +1905,7 @@ def compartilhar_agenda_privado(id_agenda):
                     .update({"status": "ativo", "data_concessao": "now()"}) \
                     .eq('id_permissao', permissao_existente['id_permissao'])\
                     .execute()
+                _invalidar_acesso_agenda(id_agenda, usuario_recebeu_id)
                 if update_resp.data:
                     return jsonify({"sucesso": True, "mensagem": "Permissão reativada com sucesso.", "permissao": update_resp.data[0]})
                 else:
@@ -1170,6 +1919,7 @@ def compartilhar_agenda_privado(id_agenda):
             "status": "ativo"
         }
         insert_resp = supabase_client.table('agenda_permissoes').insert(nova_permissao_dados).execute()
+        _invalidar_acesso_agenda(id_agenda, usuario_recebeu_id)
 
         if insert_resp.data:
             return jsonify({"sucesso": True, "mensagem": "Agenda compartilhada com sucesso.", "permissao": insert_resp.data[0]}), 201
@@ -1191,8 +1941,7 @@ def listar_compartilhamentos_agenda(id_agenda):
     usuario_id = session['usuario_id']
     try:
         # 1. Verificar se a agenda pertence ao usuário
-        agenda_propria_resp = supabase_client.table('agendas').select('id_agenda').eq('id_agenda', id_agenda).eq('usuario_id', usuario_id).maybe_single().execute()
-        if not agenda_propria_resp.data:
+        if not _pode_escrever_agenda(id_agenda, usuario_id):
             return jsonify({"sucesso": False, "mensagem": "Agenda não encontrada ou não pertence ao usuário."}), 404
 
         # 2. Buscar permissões ativas para esta agenda, com detalhes do usuário que recebeu
@@ -1226,35 +1975,77 @@ def revogar_compartilhamento_agenda(id_agenda, id_permissao):
     usuario_concedeu_id = session['usuario_id']
     try:
         # 1. Verificar se a agenda pertence ao usuário
-        agenda_propria_resp = supabase_client.table('agendas').select('id_agenda').eq('id_agenda', id_agenda).eq('usuario_id', usuario_concedeu_id).maybe_single().execute()
-        if not agenda_propria_resp.data:
+        if not _pode_escrever_agenda(id_agenda, usuario_concedeu_id):
             return jsonify({"sucesso": False, "mensagem": "Agenda não encontrada ou não pertence ao usuário."}), 404
 
-        # 2. Verificar se a permissão existe, pertence à agenda e foi concedida pelo usuário logado
-        permissao_resp = supabase_client.table('agenda_permissoes')\
-            .select('id_permissao')\
-            .eq('id_permissao', id_permissao)\
-            .eq('agenda_id', id_agenda)\
-            .eq('usuario_concedeu_id', usuario_concedeu_id)\
-            .maybe_single().execute()
-
-        if not permissao_resp.data:
+        # 2. Revogar a permissão se existir, for da agenda e tiver sido concedida pelo usuário logado
+        permissoes = _repositorio().atualizar('agenda_permissoes', {"status": "revogado"}, usuario_concedeu_id,
+                                              id_permissao=id_permissao, agenda_id=id_agenda,
+                                              usuario_concedeu_id=usuario_concedeu_id)
+        if not permissoes:
             return jsonify({"sucesso": False, "mensagem": "Permissão não encontrada, não pertence à agenda especificada ou não foi concedida por este usuário."}), 404
-            
-        # 3. Atualizar status para 'revogado'
-        update_resp = supabase_client.table('agenda_permissoes')\
-            .update({"status": "revogado"})\
-            .eq('id_permissao', id_permissao)\
-            .execute()
-            
-        if update_resp.data:
-            return jsonify({"sucesso": True, "mensagem": "Permissão revogada com sucesso."})
-        else:
-            return jsonify({"sucesso": False, "mensagem": "Erro ao revogar permissão."}), 500
+
+        _invalidar_acesso_agenda(id_agenda, permissoes[0]['usuario_recebeu_id'])
+        _publicar_evento(id_agenda, 'permissao_revogada', usuario_id=permissoes[0]['usuario_recebeu_id'])
+        return jsonify({"sucesso": True, "mensagem": "Permissão revogada com sucesso."})
 
     except Exception as e:
         return jsonify({"sucesso": False, "mensagem": f"Erro interno: {str(e)}"}), 500
 
+@app.route('/agendas/<id_agenda>/eventos', methods=['GET'])
+@requer_autenticacao
+def eventos_agenda(id_agenda):
+    """Stream SSE com as alterações da agenda, para o dono e quem a recebeu compartilhada."""
+    usuario_id = str(session['usuario_id'])
+    try:
+        if not _obter_acesso_agenda(id_agenda, usuario_id):
+            return jsonify({"sucesso": False, "mensagem": "Agenda não encontrada ou não pertence ao usuário."}), 404
+    except Exception as e:
+        return jsonify({"sucesso": False, "mensagem": str(e)}), 500
+
+    if not _conexoes_eventos.acquire(blocking=False):
+        resposta = jsonify({"sucesso": False, "mensagem": "Muitas conexões de eventos abertas. Tente novamente em instantes."})
+        resposta.status_code = 503
+        resposta.headers['Retry-After'] = str(EVENTOS_HEARTBEAT)
+        return resposta
+
+    assinatura = _barramento.assinar(_canal_agenda(id_agenda))
+    liberada = []
+
+    def liberar():
+        # Chamado pelo servidor ao fechar a resposta, mesmo que o gerador nem tenha começado
+        if not liberada:
+            liberada.append(True)
+            assinatura.cancelar()
+            _conexoes_eventos.release()
+
+    def gerar():
+        yield f"retry: {EVENTOS_RETRY_MS}\n\n"
+        limite = time.monotonic() + EVENTOS_DURACAO_MAX
+        while assinatura.ativa:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                return
+            evento = assinatura.proximo(min(EVENTOS_HEARTBEAT, restante))
+            if evento is None:
+                # Sem eventos no intervalo: o comentário também revela clientes já desconectados
+                yield ": ping\n\n"
+            elif evento.tipo == 'permissao_revogada':
+                # Só interessa (e só é revelado) a quem perdeu o acesso, cujo stream termina aqui
+                if str(evento.dados.get('usuario_id')) == usuario_id:
+                    yield _quadro_sse(evento)
+                    return
+            else:
+                yield _quadro_sse(evento)
+                if evento.tipo == 'agenda_excluida':
+                    return
+
+    resposta = app.response_class(gerar(), mimetype='text/event-stream')
+    resposta.headers['Cache-Control'] = 'no-cache'
+    resposta.headers['X-Accel-Buffering'] = 'no'  # nginx: entregar cada evento sem bufferizar
+    resposta.call_on_close(liberar)
+    return resposta
+
 @app.route('/agendas/shared_with_me', methods=['GET'])
 @requer_autenticacao
 def listar_agendas_compartilhadas_comigo():
@@ -1316,50 +2107,143 @@ def obter_link_publico_agenda(id_agenda):
     except Exception as e:
         return jsonify({"sucesso": False, "mensagem": f"Erro ao obter link público: {str(e)}"}), 500
 
+def _versao_publica(agenda):
+    return {campo: agenda.get(campo) for campo in CAMPOS_VERSAO_PUBLICA}
+
+def _obter_agenda_publica(link_publico_id):
+    """
+    Returns the cached public view of an agenda as a dict with agenda_id,
+    proprietario_id, dados (the public payload) and etag; None if the link is unknown.
+    A cached view older than PUBLIC_AGENDA_REVALIDAR is served again only if the
+    agenda's version in the database still matches the one it was built from.
+    """
+    entrada = _public_agenda_cache.get(link_publico_id)
+    agora = time.monotonic()
+    if entrada is None or (entrada is not MISSING and agora - entrada['conferido_em'] < PUBLIC_AGENDA_REVALIDAR):
+        return entrada
+
+    if entrada is not MISSING:
+        versao = _repositorio().versao_agenda(link_publico_id=link_publico_id)
+        if versao is None:
+            _public_agenda_cache.set(link_publico_id, None, ttl=PUBLIC_AGENDA_REVALIDAR)
+            return None
+        if _versao_publica(versao) == entrada['versao']:
+            entrada = {**entrada, "conferido_em": agora}
+            _public_agenda_cache.set(link_publico_id, entrada)
+            return entrada
+
+    # 1-2. Agenda pelo link_publico_id (com as versões), seus compromissos e os locais de
+    #      trabalho do proprietário (apenas campos não sensíveis)
+    encontrada = _repositorio().agenda_publica(link_publico_id)
+    if not encontrada:
+        _public_agenda_cache.set(link_publico_id, None, ttl=PUBLIC_AGENDA_REVALIDAR)
+        return None
+
+    agenda_data, compromissos_publicos, locais = encontrada
+    agenda_id = agenda_data['id_agenda']
+    proprietario_id = agenda_data['usuario_id']
+
+    locais_map = {local['id_local']: {"nome": local['nome'], "cor": local['cor']} for local in locais}
+
+    # 4. Calcular total de horas por local
+    total_horas_por_local = {}
+    for comp in compromissos_publicos:
+        local_id = comp['local_id']
+        total_horas_por_local[local_id] = total_horas_por_local.get(local_id, 0.0) + float(comp.get('duracao', 0))
+
+    dados = {
+        "agenda_nome": agenda_data['nome'],
+        "dias_semana": agenda_data['dias_semana'],
+        "hora_inicio_padrao": agenda_data['hora_inicio_padrao'],
+        "hora_fim_padrao": agenda_data['hora_fim_padrao'],
+        "compromissos": compromissos_publicos, # Each compromisso contains local_id
+        "locais_map": locais_map, # Maps local_id to name and color
+        "total_horas_por_local": {lid: round(horas, 1) for lid, horas in total_horas_por_local.items()}
+    }
+    entrada = {
+        "agenda_id": agenda_id,
+        "proprietario_id": proprietario_id,
+        "dados": dados,
+        "etag": hashlib.sha256(json.dumps(dados, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:32],
+        "versao": _versao_publica(agenda_data),
+        "conferido_em": agora
+    }
+    _public_agenda_cache.set(link_publico_id, entrada)
+    return entrada
+
+def _resposta_publica_condicional(resposta, etag):
+    """Adds a strong ETag and Cache-Control; answers 304 when If-None-Match matches."""
+    resposta.set_etag(etag)
+    resposta.headers['Cache-Control'] = f"public, max-age={PUBLIC_AGENDA_MAX_AGE}"
+    return resposta.make_conditional(request)
+
+# Snapshots estáticos das agendas públicas (HTML + JSON), regravados a cada alteração.
+# Habilitado apenas quando PUBLIC_SNAPSHOT_DIR está definido (o Vercel não tem disco gravável).
+PUBLIC_SNAPSHOT_DIR = os.getenv('PUBLIC_SNAPSHOT_DIR')
+
+def _resolver_publicacao(tarefa):
+    """Maps a ('agenda', id) or ('usuario', id) task to the (agenda_id, link_publico_id) pairs it affects."""
+    tipo, identificador = tarefa
+    coluna = 'id_agenda' if tipo == 'agenda' else 'usuario_id'
+    resposta = supabase_client.table('agendas').select('id_agenda, link_publico_id').eq(coluna, identificador).execute()
+    afetadas = [(agenda['id_agenda'], agenda['link_publico_id']) for agenda in (resposta.data or [])]
+    if tipo == 'agenda' and not afetadas:
+        # Agenda excluída: o publicador remove o snapshot pelo manifesto
+        return [(identificador, None)]
+    return afetadas
+
+def _gerar_snapshot_publico(link_publico_id):
+    """Renders the public HTML and JSON for a link, or None if it no longer exists."""
+    entrada = _obter_agenda_publica(link_publico_id)
+    if not entrada:
+        return None
+    with app.app_context():
+        html = render_template('agenda_publica_compartilhada.html', **entrada['dados'])
+    return html, json.dumps({"sucesso": True, **entrada['dados']}, ensure_ascii=False, default=str)
+
+def _criar_publicador(diretorio):
+    return PublicadorEstatico(diretorio, _resolver_publicacao, _gerar_snapshot_publico)
+
+_publicador = _criar_publicador(PUBLIC_SNAPSHOT_DIR) if PUBLIC_SNAPSHOT_DIR else None
+
+@app.cli.command('publicar-agendas')
+@click.option('--diretorio', default=None, help='Diretório de saída (padrão: PUBLIC_SNAPSHOT_DIR).')
+def publicar_agendas_comando(diretorio):
+    """Regera os snapshots estáticos de todas as agendas públicas."""
+    diretorio = diretorio or PUBLIC_SNAPSHOT_DIR
+    if not diretorio:
+        raise click.UsageError("Informe --diretorio ou defina PUBLIC_SNAPSHOT_DIR.")
+
+    publicador = _criar_publicador(diretorio)
+    tamanho_pagina = 1000
+    agenda_ids = []
+    publicadas = 0
+    inicio = 0
+    while True:
+        pagina = supabase_client.table('agendas').select('id_agenda, link_publico_id')\
+            .order('id_agenda').range(inicio, inicio + tamanho_pagina - 1).execute().data or []
+        for agenda in pagina:
+            agenda_ids.append(agenda['id_agenda'])
+            # Sempre dados frescos do banco, nunca do cache em memória
+            _public_agenda_cache.invalidate(agenda['link_publico_id'])
+            if publicador.publicar(agenda['id_agenda'], agenda['link_publico_id']):
+                publicadas += 1
+        if len(pagina) < tamanho_pagina:
+            break
+        inicio += tamanho_pagina
+
+    publicador.remover_ausentes(agenda_ids)
+    click.echo(f"{publicadas} agenda(s) publicada(s) em {diretorio}")
+
 @app.route('/api/public/agenda/<link_publico_id>', methods=['GET'])
 def obter_dados_agenda_publica(link_publico_id):
     try:
-        # 1. Encontrar agenda pelo link_publico_id
-        agenda_resp = supabase_client.table('agendas').select('id_agenda, nome, dias_semana, hora_inicio_padrao, hora_fim_padrao, usuario_id').eq('link_publico_id', link_publico_id).maybe_single().execute()
-        
-        if not agenda_resp.data:
+        entrada = _obter_agenda_publica(link_publico_id)
+        if not entrada:
             return jsonify({"sucesso": False, "mensagem": "Agenda pública não encontrada."}), 404
 
-        agenda_data = agenda_resp.data
-        agenda_id = agenda_data['id_agenda']
-        proprietario_id = agenda_data['usuario_id']
-
-        # 2. Buscar compromissos associados (apenas campos não sensíveis)
-        compromissos_resp = supabase_client.table('compromissos').select('dia_semana, hora_inicio, hora_fim, descricao, local_id, duracao').eq('agenda_id', agenda_id).execute()
-        compromissos_publicos = compromissos_resp.data if compromissos_resp.data else []
-
-        # 3. Buscar locais de trabalho do proprietário da agenda (apenas campos não sensíveis)
-        locais_resp = supabase_client.table('locais_trabalho').select('id_local, nome, cor').eq('usuario_id', proprietario_id).execute()
-        locais_map = {local['id_local']: {"nome": local['nome'], "cor": local['cor']} for local in (locais_resp.data if locais_resp.data else [])}
-
-        # 4. Calcular total de horas por local
-        total_horas_por_local = {}
-        for comp in compromissos_publicos:
-            local_id = comp['local_id']
-            duracao = float(comp.get('duracao', 0))
-            if local_id not in total_horas_por_local:
-                total_horas_por_local[local_id] = 0.0
-            total_horas_por_local[local_id] += duracao
-            # Remove duracao from individual compromisso if not desired in public view, or keep it
-            # For now, let's remove it from individual and only show total.
-            # del comp['duracao']
-
-
-        return jsonify({
-            "sucesso": True,
-            "agenda_nome": agenda_data['nome'],
-            "dias_semana": agenda_data['dias_semana'],
-            "hora_inicio_padrao": agenda_data['hora_inicio_padrao'],
-            "hora_fim_padrao": agenda_data['hora_fim_padrao'],
-            "compromissos": compromissos_publicos, # Each compromisso contains local_id
-            "locais_map": locais_map, # Maps local_id to name and color
-            "total_horas_por_local": {lid: round(horas,1) for lid, horas in total_horas_por_local.items()}
-        })
+        resposta = jsonify({"sucesso": True, **entrada['dados']})
+        return _resposta_publica_condicional(resposta, entrada['etag'] + '-json')
 
     except Exception as e:
         print(f"Erro ao buscar dados da agenda pública {link_publico_id}: {str(e)}")
@@ -1369,78 +2253,76 @@ def obter_dados_agenda_publica(link_publico_id):
 def visualizar_agenda_publica(link_publico_id):
     """Renderiza a página HTML da agenda pública compartilhada"""
     try:
-        # 1. Encontrar agenda pelo link_publico_id
-        agenda_resp = supabase_client.table('agendas').select('id_agenda, nome, dias_semana, hora_inicio_padrao, hora_fim_padrao, usuario_id').eq('link_publico_id', link_publico_id).maybe_single().execute()
-        
-        if not agenda_resp.data:
+        entrada = _obter_agenda_publica(link_publico_id)
+        if not entrada:
             return render_template('erro.html', mensagem="Agenda não encontrada"), 404
 
-        agenda_data = agenda_resp.data
-        agenda_id = agenda_data['id_agenda']
-        proprietario_id = agenda_data['usuario_id']
-
-        # 2. Buscar compromissos associados
-        compromissos_resp = supabase_client.table('compromissos').select('dia_semana, hora_inicio, hora_fim, descricao, local_id, duracao').eq('agenda_id', agenda_id).execute()
-        compromissos_publicos = compromissos_resp.data if compromissos_resp.data else []
-
-        # 3. Buscar locais de trabalho do proprietário da agenda
-        locais_resp = supabase_client.table('locais_trabalho').select('id_local, nome, cor').eq('usuario_id', proprietario_id).execute()
-        locais_map = {local['id_local']: {"nome": local['nome'], "cor": local['cor']} for local in (locais_resp.data if locais_resp.data else [])}
-
-        # 4. Calcular total de horas por local
-        total_horas_por_local = {}
-        for comp in compromissos_publicos:
-            local_id = comp['local_id']
-            duracao = float(comp.get('duracao', 0))
-            if local_id not in total_horas_por_local:
-                total_horas_por_local[local_id] = 0.0
-            total_horas_por_local[local_id] += duracao
+        # Se o cliente já tem esta versão, evitar renderizar o template
+        etag = entrada['etag'] + '-html'
+        if etag in request.if_none_match:
+            return _resposta_publica_condicional(make_response('', 304), etag)
 
-        # 5. Renderizar template HTML
-        return render_template(
-            'agenda_publica_compartilhada.html',
-            agenda_nome=agenda_data['nome'],
-            dias_semana=agenda_data['dias_semana'],
-            hora_inicio_padrao=agenda_data['hora_inicio_padrao'],
-            hora_fim_padrao=agenda_data['hora_fim_padrao'],
-            compromissos=compromissos_publicos,
-            locais_map=locais_map,
-            total_horas_por_local={lid: round(horas, 1) for lid, horas in total_horas_por_local.items()}
-        )
+        resposta = make_response(render_template('agenda_publica_compartilhada.html', **entrada['dados']))
+        return _resposta_publica_condicional(resposta, etag)
 
     except Exception as e:
         print(f"Erro ao buscar dados da agenda pública {link_publico_id}: {str(e)}")
         return render_template('erro.html', mensagem="Erro ao carregar agenda compartilhada"), 500
 
+# Helpers for calendar-accurate period reports
+def _dia_semana_de(data):
+    """dia_semana of a date, using the frontend convention (0 = Sunday ... 6 = Saturday)."""
+    return (data.weekday() + 1) % 7
+
+def _count_weekday_occurrences(de, ate):
+    """
+    Number of occurrences of each dia_semana (index 0-6) in the closed range [de, ate].
+    Closed form: whole weeks plus the leftover days, so cost does not depend on the range length.
+    """
+    if not de or not ate or ate < de:
+        return [0] * 7
+    semanas_completas, dias_restantes = divmod((ate - de).days + 1, 7)
+    primeiro_dia = _dia_semana_de(de)
+    return [semanas_completas + (1 if (dia - primeiro_dia) % 7 < dias_restantes else 0) for dia in range(7)]
+
+def _intersect_agenda_period(agenda, de, ate):
+    """Clamps [de, ate] to the agenda's [data_inicio, data_fim]; returns (de, ate), possibly empty (de > ate)."""
+    if agenda.get('data_inicio'):
+        de = max(de, date.fromisoformat(str(agenda['data_inicio'])[:10]))
+    if agenda.get('data_fim'):
+        ate = min(ate, date.fromisoformat(str(agenda['data_fim'])[:10]))
+    return de, ate
+
 # Helper function for generating report data
-def _generate_report_data(id_agenda_verified, supabase_client, usuario_id):
+def _generate_report_data(id_agenda_verified, supabase_client, usuario_id, ocorrencias_por_dia=None):
+    """
+    Per-local hours and values for the agenda. Without ocorrencias_por_dia the figures are
+    for one template week; otherwise each appointment counts ocorrencias_por_dia[dia_semana] times.
+    """
     report_details = {}
     grand_total_horas = 0.0
     grand_total_valor = 0.0
 
     try:
-        # 1. Fetch agenda_locais_config for valor_hora
-        config_resp = supabase_client.table('agenda_locais_config').select('local_id, valor_hora').eq('agenda_id', id_agenda_verified).execute()
-        if not config_resp.data: # No configurations for this agenda, report will be empty
+        # 1-3. Fetch valor_hora config, the user's workplaces and the agenda's appointments concurrently
+        configs, workplaces, appointments = _repositorio(supabase_client).dados_relatorio(id_agenda_verified, usuario_id)
+        if not configs: # No configurations for this agenda, report will be empty
             return {"locais": [], "total_horas": 0.0, "total_valor": 0.0, "erros": ["Nenhuma configuração de local/hora encontrada para esta agenda."]}
 
-        valor_hora_map = {item['local_id']: float(item['valor_hora']) for item in config_resp.data}
+        valor_hora_map = {item['local_id']: float(item['valor_hora']) for item in configs}
 
-        # 2. Fetch all workplaces for the user
-        workplaces_resp = supabase_client.table('locais_trabalho').select('id_local, nome, acrescimo_ha_percent, relacionado_com').eq('usuario_id', usuario_id).execute()
-        if not workplaces_resp.data: # User has no workplaces defined
+        if not workplaces: # User has no workplaces defined
              return {"locais": [], "total_horas": 0.0, "total_valor": 0.0, "erros": ["Nenhum local de trabalho encontrado para o usuário."]}
-        workplaces_map = {item['id_local']: item for item in workplaces_resp.data}
-
-        # 3. Fetch all appointments for the agenda
-        appointments_resp = supabase_client.table('compromissos').select('local_id, tipo_hora, duracao').eq('agenda_id', id_agenda_verified).execute()
+        workplaces_map = {item['id_local']: item for item in workplaces}
 
         calculation_errors = []
 
-        for app in appointments_resp.data:
+        for app in appointments:
             local_id = app['local_id']
             tipo_hora = app['tipo_hora']
             duracao = float(app['duracao'])
+            if ocorrencias_por_dia is not None:
+                duracao *= ocorrencias_por_dia[int(app['dia_semana'])]
 
             if local_id not in valor_hora_map:
                 calculation_errors.append(f"Configuração de valor/hora não encontrada para o local ID {local_id} (compromisso ignorado).")
@@ -1497,6 +2379,262 @@ def _generate_report_data(id_agenda_verified, supabase_client, usuario_id):
         print(f"Error generating report data for agenda {id_agenda_verified}: {e}")
         return {"locais": [], "total_horas": 0.0, "total_valor": 0.0, "erros": [f"Erro interno ao gerar relatório: {str(e)}"]}
 
+# Agregados dos relatórios: totais de horas por (local, tipo_hora, dia_semana) mantidos
+# em memória e atualizados pelas rotas de escrita, para que ler um relatório não
+# precise percorrer todos os compromissos da agenda. Cada agregado guarda a versão da
+# agenda e dos locais do dono (schema.sql) que reflete: a leitura só o usa se a versão no
+# banco for a mesma (escritas de outros workers a mudam), e uma escrita só é aplicada se
+# for a versão seguinte; fora disso o agregado é descartado e recarregado.
+REPORT_AGGREGATE_CACHE_SIZE = 512
+REPORT_AGGREGATE_CACHE_TTL = 300  # segundos; só libera memória, a versão é que garante o conteúdo
+REPORT_AGGREGATE_TOLERANCE = 1e-6
+_report_aggregates = TTLCache(maxsize=REPORT_AGGREGATE_CACHE_SIZE, ttl=REPORT_AGGREGATE_CACHE_TTL)
+
+def _versao_relatorio(agenda):
+    """[versao, versao_locais] of a versao_agenda row: the database version a report reflects."""
+    return [agenda.get('versao'), agenda.get('versao_locais')]
+
+class _ReportAggregate:
+    """
+    Running totals of one agenda: [count, base_horas, acrescimo_horas] per
+    (local_id, tipo_hora, dia_semana), plus the valor_hora and workplace details the
+    report needs. Writes apply deltas; report() only walks the keys, which are bounded
+    by #locals x 3 x 7 regardless of the number of appointments.
+    """
+
+    def __init__(self, agenda_id, proprietario_id, valor_hora_map, workplaces, appointments, versao=(None, None)):
+        self.agenda_id = str(agenda_id)
+        self.proprietario_id = str(proprietario_id)
+        self.valor_hora = dict(valor_hora_map)
+        self.workplaces = {w['id_local']: w for w in workplaces}
+        self.versao = list(versao)
+        self.totals = {}
+        self._lock = threading.Lock()
+        for app in appointments:
+            self._apply(app, 1)
+
+    @classmethod
+    def load(cls, supabase_client, agenda_id, proprietario_id, versao):
+        """
+        Builds the aggregate from scratch (same three queries as _generate_report_data),
+        tagged with versao, read from the database before the rows. Returns
+        (aggregate, exact): exact is False when a row is newer than versao (a write landed
+        between the two reads), so the aggregate may be used but not cached.
+        """
+        configs, workplaces, appointments = _repositorio(supabase_client).dados_relatorio(agenda_id, proprietario_id)
+        valor_hora_map = {item['local_id']: float(item['valor_hora']) for item in configs}
+        aggregate = cls(agenda_id, proprietario_id, valor_hora_map, workplaces, appointments, versao)
+        exact = not any(
+            atual is not None and (linha.get('versao') or 0) > atual
+            for linhas, atual in ((configs, versao[0]), (appointments, versao[0]), (workplaces, versao[1]))
+            for linha in linhas
+        )
+        return aggregate, exact
+
+    def _advance(self, indice, versao):
+        """Moves versao[indice] to versao if it is the next one; False when a change was missed."""
+        if self.versao[indice] is None or versao is None or int(versao) != self.versao[indice] + 1:
+            return False
+        self.versao[indice] = int(versao)
+        return True
+
+    def _acrescimo(self, local_id, tipo_hora, base_horas):
+        workplace = self.workplaces.get(local_id)
+        acrescimo_ha_percent = float(workplace.get('acrescimo_ha_percent') or 0) if workplace else 0.0
+        if tipo_hora == 'HA' and acrescimo_ha_percent > 0:
+            return base_horas * (acrescimo_ha_percent / 100)
+        return 0.0
+
+    def _apply(self, app, sign):
+        key = (app['local_id'], app['tipo_hora'], int(app['dia_semana']))
+        base_horas = float(app['duracao']) * sign
+        entry = self.totals.setdefault(key, [0, 0.0, 0.0])
+        entry[0] += sign
+        entry[1] += base_horas
+        entry[2] += self._acrescimo(key[0], key[1], base_horas)
+        if entry[0] <= 0:
+            # Sem compromissos na chave: descarta em vez de guardar resíduo de ponto flutuante
+            del self.totals[key]
+
+    # As alterações devolvem False quando não puderam ser aplicadas (o chamador descarta o agregado)
+    def apply(self, old=None, new=None):
+        """Replaces old by new (old may be None for an insert), new being the row as written."""
+        with self._lock:
+            if not self._advance(0, new.get('versao')):
+                return False
+            if old:
+                self._apply(old, -1)
+            self._apply(new, 1)
+            return True
+
+    def remove(self, old):
+        """Takes out a deleted row, chained on its tombstone version (versao_exclusao)."""
+        with self._lock:
+            if not self._advance(0, old.get('versao_exclusao')):
+                return False
+            self._apply(old, -1)
+            return True
+
+    def set_valor_hora(self, config):
+        with self._lock:
+            if not self._advance(0, config.get('versao')):
+                return False
+            self.valor_hora[config['local_id']] = float(config['valor_hora'])
+            return True
+
+    def remove_valor_hora(self, config):
+        with self._lock:
+            if not self._advance(0, config.get('versao_exclusao')):
+                return False
+            self.valor_hora.pop(config['local_id'], None)
+            return True
+
+    def set_workplace(self, workplace):
+        """Stores new workplace details and re-derives the acréscimo of its keys."""
+        local_id = workplace['id_local']
+        with self._lock:
+            if not self._advance(1, workplace.get('versao')):
+                return False
+            self.workplaces[local_id] = {**self.workplaces.get(local_id, {}), **workplace}
+            for key, entry in self.totals.items():
+                if key[0] == local_id:
+                    entry[2] = self._acrescimo(local_id, key[1], entry[1])
+            return True
+
+    def report(self, ocorrencias_por_dia=None):
+        """Same shape as _generate_report_data."""
+        with self._lock:
+            if not self.valor_hora:
+                return {"locais": [], "total_horas": 0.0, "total_valor": 0.0, "erros": ["Nenhuma configuração de local/hora encontrada para esta agenda."]}
+            if not self.workplaces:
+                return {"locais": [], "total_horas": 0.0, "total_valor": 0.0, "erros": ["Nenhum local de trabalho encontrado para o usuário."]}
+
+            report_details = {}
+            calculation_errors = []
+            for (local_id, tipo_hora, dia_semana), (count, base_horas, acrescimo_horas) in self.totals.items():
+                if local_id not in self.valor_hora:
+                    calculation_errors.extend([f"Configuração de valor/hora não encontrada para o local ID {local_id} (compromisso ignorado)."] * count)
+                    continue
+                if local_id not in self.workplaces:
+                    calculation_errors.extend([f"Detalhes do local de trabalho ID {local_id} não encontrados (compromisso ignorado)."] * count)
+                    continue
+
+                peso = 1 if ocorrencias_por_dia is None else ocorrencias_por_dia[dia_semana]
+                if local_id not in report_details:
+                    workplace = self.workplaces[local_id]
+                    report_details[local_id] = {
+                        'id_local': local_id,
+                        'nome': workplace.get('nome', 'Nome Desconhecido'),
+                        'relacionado_com': workplace.get('relacionado_com'),
+                        'base_horas': 0.0,
+                        'acrescimo_horas': 0.0,
+                        'total_horas': 0.0,
+                        'valor_hora_aplicado': self.valor_hora[local_id],
+                        'valor_total': 0.0
+                    }
+                entry = report_details[local_id]
+                entry['base_horas'] += base_horas * peso
+                entry['acrescimo_horas'] += acrescimo_horas * peso
+
+        grand_total_horas = 0.0
+        grand_total_valor = 0.0
+        for entry in report_details.values():
+            # Somas e subtrações sucessivas deixam ruído na 15ª casa; 6 casas bastam
+            entry['base_horas'] = round(entry['base_horas'], 6)
+            entry['acrescimo_horas'] = round(entry['acrescimo_horas'], 6)
+            entry['total_horas'] = round(entry['base_horas'] + entry['acrescimo_horas'], 6)
+            entry['valor_total'] = round(entry['total_horas'] * entry['valor_hora_aplicado'], 6)
+            grand_total_horas += entry['total_horas']
+            grand_total_valor += entry['valor_total']
+
+        final_report = {
+            "locais": list(report_details.values()),
+            "total_horas": round(grand_total_horas, 2),
+            "total_valor": round(grand_total_valor, 2)
+        }
+        if calculation_errors:
+            final_report["erros_calculo"] = calculation_errors
+        return final_report
+
+def _get_report_aggregate(supabase_client, agenda, proprietario_id):
+    """
+    Aggregate of the agenda at the database version of `agenda` (a versao_agenda row):
+    the cached one when it is at that version, else loaded from scratch.
+    """
+    agenda_id, versao = str(agenda['id_agenda']), _versao_relatorio(agenda)
+    aggregate = _report_aggregates.get(agenda_id)
+    if aggregate is not MISSING and aggregate.versao == versao:
+        return aggregate
+    aggregate, exact = _ReportAggregate.load(supabase_client, agenda_id, proprietario_id, versao)
+    if exact:
+        _report_aggregates.set(agenda_id, aggregate)
+    else:
+        _report_aggregates.invalidate(agenda_id)
+    return aggregate
+
+def _update_report_aggregate(agenda_id, old=None, new=None):
+    """
+    Applies a compromisso change (old -> new rows as written) to the cached aggregate, if
+    any. A delete (new None) chains on the versao_exclusao the repository returns with old.
+    """
+    aggregate = _report_aggregates.get(str(agenda_id), None)
+    if aggregate and not (aggregate.apply(old, new) if new else aggregate.remove(old)):
+        _report_aggregates.invalidate(str(agenda_id))
+
+def _update_report_valor_hora(agenda_id, config, excluida=False):
+    """Applies an agenda_locais_config row as written, or as deleted (with versao_exclusao)."""
+    aggregate = _report_aggregates.get(str(agenda_id), None)
+    if aggregate and not (aggregate.remove_valor_hora(config) if excluida else aggregate.set_valor_hora(config)):
+        _report_aggregates.invalidate(str(agenda_id))
+
+def _update_report_workplace(usuario_id, workplace):
+    """Applies a locais_trabalho row as written to every cached aggregate owned by usuario_id."""
+    for aggregate in _report_aggregates.values():
+        if aggregate.proprietario_id == str(usuario_id) and not aggregate.set_workplace(workplace):
+            _report_aggregates.invalidate(aggregate.agenda_id)
+
+def _drop_report_aggregates(agenda_id=None, usuario_id=None):
+    """For changes with no cheap delta (deleted agenda, cascaded local removal)."""
+    if agenda_id is not None:
+        _report_aggregates.invalidate(str(agenda_id))
+    if usuario_id is not None:
+        _report_aggregates.invalidate_where(lambda _, aggregate: aggregate.proprietario_id == str(usuario_id))
+
+def _check_report_aggregate(supabase_client, agenda_id, proprietario_id):
+    """
+    Recomputes the weekly report from scratch and compares it with the cached aggregate.
+    Returns the list of divergences (empty when consistent), or None when no aggregate at
+    the agenda's current version is cached (nothing to check). A divergent aggregate is
+    dropped, so the next read reloads it.
+    """
+    agenda = _repositorio(supabase_client).versao_agenda(agenda_id)
+    aggregate = _report_aggregates.get(str(agenda_id), None)
+    if not agenda or not aggregate or aggregate.versao != _versao_relatorio(agenda):
+        return None
+
+    incremental = aggregate.report()
+    recomputed = _generate_report_data(agenda_id, supabase_client, proprietario_id)
+    if recomputed.get("erros") and recomputed["erros"][0].startswith("Erro interno"):
+        raise RuntimeError(recomputed["erros"][0])
+
+    divergences = []
+    incremental_locais = {local['id_local']: local for local in incremental["locais"]}
+    recomputed_locais = {local['id_local']: local for local in recomputed["locais"]}
+    for local_id in incremental_locais.keys() | recomputed_locais.keys():
+        atual, esperado = incremental_locais.get(local_id), recomputed_locais.get(local_id)
+        if atual is None or esperado is None:
+            divergences.append({"id_local": local_id, "campo": "local", "agregado": atual is not None, "recalculado": esperado is not None})
+            continue
+        for campo in ("base_horas", "acrescimo_horas", "total_horas", "valor_hora_aplicado", "valor_total"):
+            if abs(atual[campo] - esperado[campo]) > REPORT_AGGREGATE_TOLERANCE:
+                divergences.append({"id_local": local_id, "campo": campo, "agregado": atual[campo], "recalculado": esperado[campo]})
+    for campo in ("erros", "erros_calculo"):
+        if sorted(incremental.get(campo, [])) != sorted(recomputed.get(campo, [])):
+            divergences.append({"id_local": None, "campo": campo, "agregado": incremental.get(campo, []), "recalculado": recomputed.get(campo, [])})
+    if divergences:
+        _drop_report_aggregates(agenda_id=agenda_id)
+    return divergences
+
 # API de Relatórios
 @app.route('/agendas/<id_agenda>/relatorios/semanal', methods=['GET'])
 @requer_autenticacao
@@ -1504,11 +2642,14 @@ def relatorio_semanal(id_agenda):
     usuario_id = session['usuario_id']
     try:
         # Verificar se a agenda pertence ao usuário
-        agenda_verif = supabase_client.table('agendas').select('id_agenda').eq('id_agenda', id_agenda).eq('usuario_id', usuario_id).maybe_single().execute()
-        if not agenda_verif.data:
+        acesso = _obter_acesso_dono(id_agenda, usuario_id)
+        if not acesso:
             return jsonify({"sucesso": False, "mensagem": "Agenda não encontrada ou não pertence ao usuário."}), 404
 
-        report_data = _generate_report_data(id_agenda, supabase_client, usuario_id)
+        agenda = _repositorio(supabase_client).versao_agenda(id_agenda)
+        if not agenda:
+            return jsonify({"sucesso": False, "mensagem": "Agenda não encontrada ou não pertence ao usuário."}), 404
+        report_data = _get_report_aggregate(supabase_client, agenda, acesso.proprietario_id).report()
 
         if "erros" in report_data and report_data["erros"]:
              # You might want to distinguish between data not found errors (404-like) vs internal processing errors (500-like)
@@ -1519,37 +2660,422 @@ def relatorio_semanal(id_agenda):
     except Exception as e:
         return jsonify({"sucesso": False, "mensagem": f"Erro ao gerar relatório semanal: {str(e)}"}), 500
 
+def _dia_na_vigencia(agenda, dia):
+    """dia moved into the agenda's [data_inicio, data_fim] when it falls outside."""
+    if agenda.get('data_inicio'):
+        dia = max(dia, date.fromisoformat(str(agenda['data_inicio'])[:10]))
+    if agenda.get('data_fim'):
+        dia = min(dia, date.fromisoformat(str(agenda['data_fim'])[:10]))
+    return dia
+
+def _generate_period_report(id_agenda, supabase_client, proprietario_id, periodo):
+    """
+    Report for the dates [de, ate] = periodo(agenda) intersected with the agenda's
+    validity, counting the real occurrences of each dia_semana. Returns the report dict
+    (with "erros" on failure).
+    """
+    # A versão da agenda traz também data_inicio e data_fim
+    agenda = _repositorio(supabase_client).versao_agenda(id_agenda)
+    if not agenda:
+        return {"locais": [], "total_horas": 0.0, "total_valor": 0.0, "erros": ["Agenda não encontrada."]}
+
+    de, ate = periodo(agenda)
+    de_efetivo, ate_efetivo = _intersect_agenda_period(agenda, de, ate)
+    ocorrencias_por_dia = _count_weekday_occurrences(de_efetivo, ate_efetivo)
+
+    report = _get_report_aggregate(supabase_client, agenda, proprietario_id).report(ocorrencias_por_dia)
+    for local in report["locais"]:
+        for campo in ("base_horas", "acrescimo_horas", "total_horas", "valor_total"):
+            local[campo] = round(local[campo], 2)
+    report["periodo"] = {
+        "de": de.isoformat(),
+        "ate": ate.isoformat(),
+        "de_efetivo": de_efetivo.isoformat() if de_efetivo <= ate_efetivo else None,
+        "ate_efetivo": ate_efetivo.isoformat() if de_efetivo <= ate_efetivo else None,
+        "ocorrencias_por_dia": ocorrencias_por_dia
+    }
+    return report
+
 @app.route('/agendas/<id_agenda>/relatorios/mensal', methods=['GET'])
 @requer_autenticacao
 def relatorio_mensal(id_agenda):
+    """
+    Relatório do mês civil (?ano=&mes=) com as ocorrências reais de cada dia. Sem os
+    parâmetros, o mês atual, ou o primeiro/último mês da agenda se hoje está fora da vigência.
+    """
     usuario_id = session['usuario_id']
+    ano = request.args.get('ano', type=int)
+    mes = request.args.get('mes', type=int)
+    if mes is not None and not 1 <= mes <= 12:
+        return jsonify({"sucesso": False, "mensagem": "Parâmetro 'mes' deve estar entre 1 e 12."}), 400
+
+    def periodo(agenda):
+        referencia = date.today()
+        if ano is None and mes is None:
+            referencia = _dia_na_vigencia(agenda, referencia)
+        ano_relatorio = referencia.year if ano is None else ano
+        mes_relatorio = referencia.month if mes is None else mes
+        return date(ano_relatorio, mes_relatorio, 1), date(ano_relatorio, mes_relatorio, calendar.monthrange(ano_relatorio, mes_relatorio)[1])
+
     try:
         # Verificar se a agenda pertence ao usuário
-        agenda_verif = supabase_client.table('agendas').select('id_agenda').eq('id_agenda', id_agenda).eq('usuario_id', usuario_id).maybe_single().execute()
-        if not agenda_verif.data:
+        acesso = _obter_acesso_dono(id_agenda, usuario_id)
+        if not acesso:
             return jsonify({"sucesso": False, "mensagem": "Agenda não encontrada ou não pertence ao usuário."}), 404
 
-        weekly_data_result = _generate_report_data(id_agenda, supabase_client, usuario_id)
+        monthly_report = _generate_period_report(id_agenda, supabase_client, acesso.proprietario_id, periodo)
 
-        if "erros" in weekly_data_result and weekly_data_result["erros"]:
-            return jsonify({"sucesso": False, "mensagem": "Não foi possível gerar a base semanal para o relatório mensal.", "detalhes": weekly_data_result["erros"]}), 400
+        if "erros" in monthly_report and monthly_report["erros"]:
+            return jsonify({"sucesso": False, "mensagem": "Não foi possível gerar o relatório mensal.", "detalhes": monthly_report["erros"]}), 400
 
-        # Deepcopy para não alterar o original (se _generate_report_data for usado em outro lugar)
-        monthly_report = copy.deepcopy(weekly_data_result) # weekly_data_result is already the content of 'relatorio'
+        return jsonify({"sucesso": True, "relatorio": monthly_report})
+
+    except Exception as e:
+        return jsonify({"sucesso": False, "mensagem": f"Erro ao gerar relatório mensal: {str(e)}"}), 500
 
-        for local in monthly_report["locais"]:
-            local["base_horas"] = round(local["base_horas"] * 4.5, 2)
-            local["acrescimo_horas"] = round(local["acrescimo_horas"] * 4.5, 2)
-            local["total_horas"] = round(local["total_horas"] * 4.5, 2)
-            local["valor_total"] = round(local["valor_total"] * 4.5, 2)
+@app.route('/agendas/<id_agenda>/relatorios/periodo', methods=['GET'])
+@requer_autenticacao
+def relatorio_periodo(id_agenda):
+    """Relatório para um intervalo arbitrário de datas (?de=AAAA-MM-DD&ate=AAAA-MM-DD)."""
+    usuario_id = session['usuario_id']
+    try:
+        de = date.fromisoformat(request.args.get('de', ''))
+        ate = date.fromisoformat(request.args.get('ate', ''))
+    except ValueError:
+        return jsonify({"sucesso": False, "mensagem": "Parâmetros 'de' e 'ate' são obrigatórios no formato AAAA-MM-DD."}), 400
+    if ate < de:
+        return jsonify({"sucesso": False, "mensagem": "'ate' deve ser igual ou posterior a 'de'."}), 400
 
-        monthly_report["total_horas"] = round(monthly_report["total_horas"] * 4.5, 2)
-        monthly_report["total_valor"] = round(monthly_report["total_valor"] * 4.5, 2)
+    try:
+        acesso = _obter_acesso_dono(id_agenda, usuario_id)
+        if not acesso:
+            return jsonify({"sucesso": False, "mensagem": "Agenda não encontrada ou não pertence ao usuário."}), 404
 
-        return jsonify({"sucesso": True, "relatorio": monthly_report})
+        report = _generate_period_report(id_agenda, supabase_client, acesso.proprietario_id, lambda _: (de, ate))
+
+        if "erros" in report and report["erros"]:
+            return jsonify({"sucesso": False, "mensagem": "Não foi possível gerar o relatório do período.", "detalhes": report["erros"]}), 400
+
+        return jsonify({"sucesso": True, "relatorio": report})
 
     except Exception as e:
-        return jsonify({"sucesso": False, "mensagem": f"Erro ao gerar relatório mensal: {str(e)}"}), 500
+        return jsonify({"sucesso": False, "mensagem": f"Erro ao gerar relatório do período: {str(e)}"}), 500
+
+# Ocorrências datadas: a semana-modelo (compromissos por dia_semana) expandida nas datas de
+# [de, ate] ∩ [data_inicio, data_fim] da agenda, em páginas com cursor. As ocorrências são
+# geradas sob demanda e escritas na resposta à medida que saem, então o custo acompanha a
+# janela e a página pedidas, não a duração da agenda.
+OCORRENCIAS_LIMITE_PADRAO = 200
+OCORRENCIAS_LIMITE_MAX = 1000
+
+def _ordem_ocorrencia(compromisso):
+    return str(compromisso['hora_inicio']), str(compromisso['id_compromisso'])
+
+def _gerar_ocorrencias(por_dia, de, ate, apos=None):
+    """
+    Lazily yields (data, compromisso) for each date in [de, ate], ordered by date, hora_inicio
+    and id_compromisso. por_dia maps dia_semana to that day's compromissos, already in that
+    order; apos = (data, hora_inicio, id_compromisso) resumes right after that occurrence.
+    """
+    data = de if apos is None else max(de, apos[0])
+    while data <= ate:
+        for compromisso in por_dia.get(_dia_semana_de(data), ()):
+            if apos is not None and data == apos[0] and _ordem_ocorrencia(compromisso) <= apos[1:]:
+                continue
+            yield data, compromisso
+        data += timedelta(days=1)
+
+def _cursor_ocorrencia(data, compromisso):
+    bruto = f"{data.isoformat()}|{compromisso['hora_inicio']}|{compromisso['id_compromisso']}"
+    return base64.urlsafe_b64encode(bruto.encode()).decode().rstrip('=')
+
+def _ler_cursor_ocorrencia(cursor):
+    """(data, hora_inicio, id_compromisso) of an occurrence cursor; ValueError when malformed."""
+    bruto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    data, hora_inicio, id_compromisso = bruto.split('|')
+    return date.fromisoformat(data), hora_inicio, id_compromisso
+
+@app.route('/agendas/<id_agenda>/ocorrencias', methods=['GET'])
+@requer_autenticacao
+def listar_ocorrencias(id_agenda):
+    """Compromissos em datas concretas (?de=AAAA-MM-DD&ate=AAAA-MM-DD[&limite=N&cursor=...])."""
+    usuario_id = session['usuario_id']
+    try:
+        de = date.fromisoformat(request.args.get('de', ''))
+        ate = date.fromisoformat(request.args.get('ate', ''))
+    except ValueError:
+        return jsonify({"sucesso": False, "mensagem": "Parâmetros 'de' e 'ate' são obrigatórios no formato AAAA-MM-DD."}), 400
+    if ate < de:
+        return jsonify({"sucesso": False, "mensagem": "'ate' deve ser igual ou posterior a 'de'."}), 400
+    try:
+        limite = int(request.args.get('limite', OCORRENCIAS_LIMITE_PADRAO))
+        apos = _ler_cursor_ocorrencia(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError:
+        return jsonify({"sucesso": False, "mensagem": "Parâmetro 'limite' ou 'cursor' inválido."}), 400
+    if not 1 <= limite <= OCORRENCIAS_LIMITE_MAX:
+        return jsonify({"sucesso": False, "mensagem": f"'limite' deve estar entre 1 e {OCORRENCIAS_LIMITE_MAX}."}), 400
+
+    try:
+        acesso = _obter_acesso_agenda(id_agenda, usuario_id)
+        if not acesso:
+            return jsonify({"sucesso": False, "mensagem": "Agenda não encontrada ou não pertence ao usuário."}), 404
+
+        # Janela de menos de uma semana: só os compromissos dos dias que ela contém
+        dias = {_dia_semana_de(de + timedelta(days=n)) for n in range(min(7, (ate - de).days + 1))}
+        resultado = _repositorio().calendario(id_agenda, dias if len(dias) < 7 else None)
+        if resultado is None:
+            return jsonify({"sucesso": False, "mensagem": "Agenda não encontrada ou não pertence ao usuário."}), 404
+    except Exception as e:
+        return jsonify({"sucesso": False, "mensagem": f"Erro ao listar ocorrências: {str(e)}"}), 500
+
+    agenda, compromissos = resultado
+    de_efetivo, ate_efetivo = _intersect_agenda_period(agenda, de, ate)
+    por_dia = {}
+    for compromisso in sorted(compromissos, key=_ordem_ocorrencia):
+        por_dia.setdefault(int(compromisso['dia_semana']), []).append(compromisso)
+    # Uma ocorrência além do limite só indica que existe a próxima página
+    ocorrencias = itertools.islice(_gerar_ocorrencias(por_dia, de_efetivo, ate_efetivo, apos), limite + 1)
+
+    def gerar():
+        periodo = {
+            "de_efetivo": de_efetivo.isoformat() if de_efetivo <= ate_efetivo else None,
+            "ate_efetivo": ate_efetivo.isoformat() if de_efetivo <= ate_efetivo else None
+        }
+        yield f'{{"sucesso":true,"versao":{json.dumps(agenda.get("versao"))},"periodo":{json.dumps(periodo)},"ocorrencias":['
+        anterior = None
+        for indice, (data, compromisso) in enumerate(ocorrencias):
+            if indice == limite:
+                yield f'],"proximo_cursor":{json.dumps(_cursor_ocorrencia(*anterior))}}}'
+                return
+            yield (',' if indice else '') + json.dumps({**compromisso, "data": data.isoformat()}, default=str)
+            anterior = data, compromisso
+        yield '],"proximo_cursor":null}'
+
+    return app.response_class(gerar(), mimetype='application/json')
+
+# Feeds iCalendar (RFC 5545) para assinar a agenda em apps de calendário: cada compromisso
+# vira um VEVENT semanal (RRULE) entre data_inicio e data_fim, com horários locais
+# (flutuantes) no fuso CALENDARIO_FUSO. Os apps consultam a URL com frequência: o validador
+# vem das versões da agenda e dos locais do dono (schema.sql), fica em memória e quase
+# toda consulta termina em 304 sem ler os compromissos nem montar o feed.
+CALENDARIO_FUSO = os.getenv('CALENDARIO_FUSO', 'America/Sao_Paulo')
+CALENDARIO_INTERVALO_ATUALIZACAO = 'PT1H'  # sugestão de intervalo de consulta aos apps
+
+ValidadorCalendario = namedtuple('ValidadorCalendario', ['agenda_id', 'proprietario_id', 'etag', 'ultima_modificacao', 'conferido_em'])
+
+def _validador_calendario(chave, agenda_id=None, link_publico_id=None):
+    """
+    ValidadorCalendario of an agenda (by id or public link), or None if it does not exist.
+    The ETag hashes the agenda fields and its sync versions; Last-Modified is the latest
+    of the agenda's and the owner's locais updated_at, so every worker sends the same one.
+    """
+    validador = _calendario_cache.get(chave)
+    agora = time.monotonic()
+    if validador is None or (validador is not MISSING and agora - validador.conferido_em < CALENDARIO_REVALIDAR):
+        return validador
+
+    versao = _repositorio().versao_agenda(agenda_id, link_publico_id)
+    if versao is None:
+        _calendario_cache.set(chave, None, ttl=CALENDARIO_REVALIDAR)
+        return None
+    etag = hashlib.sha256(json.dumps(versao, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:32] + '-ics'
+    # Last-Modified tem resolução de segundos
+    ultima_modificacao = max(
+        datetime.fromisoformat(str(versao[coluna])).astimezone(timezone.utc) for coluna in ('updated_at', 'updated_at_locais')
+    ).replace(microsecond=0)
+    validador = ValidadorCalendario(versao['id_agenda'], versao['usuario_id'], etag, ultima_modificacao, agora)
+    _calendario_cache.set(chave, validador)
+    return validador
+
+def _ics_texto(valor):
+    """Escapes a TEXT value (RFC 5545, 3.3.11)."""
+    return (str(valor).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+def _ics_linha(linha):
+    """Content line folded at 75 octets (RFC 5545, 3.1), with its CRLF."""
+    partes, atual, tamanho = [], '', 0
+    for caractere in linha:
+        octetos = len(caractere.encode('utf-8'))
+        if tamanho + octetos > 75:
+            partes.append(atual)
+            atual, tamanho = ' ', 1
+        atual += caractere
+        tamanho += octetos
+    partes.append(atual)
+    return '\r\n'.join(partes) + '\r\n'
+
+def _ics_hora(minutos):
+    return f"{minutos // 60:02d}{minutos % 60:02d}00"
+
+def _gerar_ics(agenda, compromissos, locais, gerado_em):
+    """Yields the feed piece by piece: the calendar header, then one weekly VEVENT per compromisso."""
+    yield ''.join(_ics_linha(linha) for linha in (
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//Agenda de Trabalho//Agenda//PT-BR',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f"X-WR-CALNAME:{_ics_texto(agenda['nome'])}",
+        f"X-WR-TIMEZONE:{CALENDARIO_FUSO}",
+        f"REFRESH-INTERVAL;VALUE=DURATION:{CALENDARIO_INTERVALO_ATUALIZACAO}",
+        f"X-PUBLISHED-TTL:{CALENDARIO_INTERVALO_ATUALIZACAO}",
+    ))
+    inicio = date.fromisoformat(str(agenda['data_inicio'])[:10])
+    fim = date.fromisoformat(str(agenda['data_fim'])[:10])
+    carimbo = gerado_em.strftime('%Y%m%dT%H%M%SZ')
+    for compromisso in sorted(compromissos, key=lambda c: (int(c['dia_semana']), str(c['hora_inicio']))):
+        # Primeira data do dia da semana a partir de data_inicio; a RRULE repete até data_fim
+        primeira = inicio + timedelta(days=(int(compromisso['dia_semana']) - _dia_semana_de(inicio)) % 7)
+        if primeira > fim:
+            continue
+        minutos_inicio = _time_str_to_minutes(str(compromisso['hora_inicio']))
+        minutos_fim = _time_str_to_minutes(str(compromisso['hora_fim']))
+        termino = primeira + timedelta(days=1) if minutos_fim <= minutos_inicio else primeira
+        local = locais.get(compromisso['local_id'])
+        linhas = [
+            'BEGIN:VEVENT',
+            f"UID:{hashlib.sha256(str(compromisso['id_compromisso']).encode('utf-8')).hexdigest()[:32]}@agenda-de-trabalho",
+            f"DTSTAMP:{carimbo}",
+            f"DTSTART:{primeira.strftime('%Y%m%d')}T{_ics_hora(minutos_inicio)}",
+            f"DTEND:{termino.strftime('%Y%m%d')}T{_ics_hora(minutos_fim)}",
+            f"RRULE:FREQ=WEEKLY;UNTIL={fim.strftime('%Y%m%d')}T235959",
+            f"SUMMARY:{_ics_texto(compromisso.get('descricao') or local or 'Compromisso')}",
+        ]
+        if local:
+            linhas.append(f"LOCATION:{_ics_texto(local)}")
+        linhas.append('END:VEVENT')
+        yield ''.join(_ics_linha(linha) for linha in linhas)
+    yield _ics_linha('END:VCALENDAR')
+
+def _resposta_calendario(validador, publico):
+    """304 when the client's copy is current; otherwise the feed, streamed as it is generated."""
+    cache_control = f"public, max-age={PUBLIC_AGENDA_MAX_AGE}" if publico else "private, no-cache"
+    if not is_resource_modified(request.environ, etag=validador.etag, last_modified=validador.ultima_modificacao):
+        resposta = app.response_class(status=304)
+    else:
+        encontrada = _repositorio().calendario(validador.agenda_id)
+        if encontrada is None:
+            _calendario_cache.invalidate_where(lambda _, v: v is not None and v.agenda_id == validador.agenda_id)
+            return jsonify({"sucesso": False, "mensagem": "Agenda não encontrada."}), 404
+        agenda, compromissos = encontrada
+        locais = {
+            local['id_local']: local['nome']
+            for local in _repositorio().listar('locais_trabalho', 'id_local, nome', usuario_id=validador.proprietario_id)
+        }
+        resposta = app.response_class(_gerar_ics(agenda, compromissos, locais, validador.ultima_modificacao),
+                                      mimetype='text/calendar')
+        resposta.headers['Content-Disposition'] = 'inline; filename="agenda.ics"'
+    resposta.set_etag(validador.etag)
+    resposta.last_modified = validador.ultima_modificacao
+    resposta.headers['Cache-Control'] = cache_control
+    return resposta
+
+@app.route('/public/agenda/<link_publico_id>/calendario.ics', methods=['GET'])
+def calendario_agenda_publica(link_publico_id):
+    """Feed iCalendar da agenda pública, para assinar em apps de calendário."""
+    try:
+        validador = _validador_calendario(('link', str(link_publico_id)), link_publico_id=link_publico_id)
+        if not validador:
+            return jsonify({"sucesso": False, "mensagem": "Agenda pública não encontrada."}), 404
+        return _resposta_calendario(validador, publico=True)
+    except Exception as e:
+        print(f"Erro ao gerar o calendário da agenda pública {link_publico_id}: {str(e)}")
+        return jsonify({"sucesso": False, "mensagem": "Erro interno ao gerar o calendário."}), 500
+
+@app.route('/agendas/<id_agenda>/calendario.ics', methods=['GET'])
+@requer_autenticacao
+def calendario_agenda(id_agenda):
+    """Feed iCalendar de uma agenda do usuário ou compartilhada com ele."""
+    usuario_id = session['usuario_id']
+    try:
+        if not _obter_acesso_agenda(id_agenda, usuario_id):
+            return jsonify({"sucesso": False, "mensagem": "Agenda não encontrada ou não pertence ao usuário."}), 404
+        validador = _validador_calendario(('agenda', str(id_agenda)), agenda_id=id_agenda)
+        if not validador:
+            return jsonify({"sucesso": False, "mensagem": "Agenda não encontrada ou não pertence ao usuário."}), 404
+        return _resposta_calendario(validador, publico=False)
+    except Exception as e:
+        return jsonify({"sucesso": False, "mensagem": f"Erro ao gerar o calendário: {str(e)}"}), 500
+
+@app.route('/agendas/<id_agenda>/relatorios/consistencia', methods=['GET'])
+@requer_autenticacao
+def verificar_consistencia_relatorio(id_agenda):
+    """Compara os totais incrementais com um recálculo completo e reporta as divergências."""
+    usuario_id = session['usuario_id']
+    try:
+        acesso = _obter_acesso_dono(id_agenda, usuario_id)
+        if not acesso:
+            return jsonify({"sucesso": False, "mensagem": "Agenda não encontrada ou não pertence ao usuário."}), 404
+
+        divergencias = _check_report_aggregate(supabase_client, id_agenda, acesso.proprietario_id)
+        if divergencias is None:
+            # Nenhum agregado da versão atual em memória neste processo: nada foi comparado
+            return jsonify({"sucesso": True, "verificado": False, "consistente": None, "divergencias": []})
+        if divergencias:
+            print(f"Agregado do relatório da agenda {id_agenda} divergente (descartado): {divergencias}")
+
+        return jsonify({"sucesso": True, "verificado": True, "consistente": not divergencias, "divergencias": divergencias})
+
+    except Exception as e:
+        return jsonify({"sucesso": False, "mensagem": f"Erro ao verificar relatório: {str(e)}"}), 500
+
+@app.route('/relatorios/consolidado', methods=['GET'])
+@requer_autenticacao
+def relatorio_consolidado():
+    """Relatório semanal de todas as agendas do usuário, agregado no banco (RPC relatorio_consolidado)."""
+    usuario_id = session['usuario_id']
+    try:
+        linhas = _repositorio().relatorio_consolidado(usuario_id)
+
+        agendas = {}
+        for linha in linhas:
+            agenda = agendas.setdefault(linha['agenda_id'], {
+                "agenda_id": linha['agenda_id'],
+                "agenda_nome": linha['agenda_nome'],
+                "data_inicio": linha['data_inicio'],
+                "data_fim": linha['data_fim'],
+                "locais": [],
+                "total_horas": 0.0,
+                "total_valor": 0.0
+            })
+            base_horas = float(linha['base_horas'] or 0)
+            if linha['local_id'] is None:
+                if base_horas:
+                    agenda.setdefault("erros_calculo", []).append("Compromissos com local de trabalho não encontrado foram ignorados.")
+                continue
+            if linha['valor_hora'] is None:
+                agenda.setdefault("erros_calculo", []).append(f"Configuração de valor/hora não encontrada para o local ID {linha['local_id']} (compromissos ignorados).")
+                continue
+
+            valor_hora = float(linha['valor_hora'])
+            acrescimo_horas = float(linha['acrescimo_horas'] or 0)
+            total_horas = base_horas + acrescimo_horas
+            agenda["locais"].append({
+                'id_local': linha['local_id'],
+                'nome': linha['local_nome'],
+                'relacionado_com': linha['relacionado_com'],
+                'base_horas': round(base_horas, 2),
+                'acrescimo_horas': round(acrescimo_horas, 2),
+                'total_horas': round(total_horas, 2),
+                'valor_hora_aplicado': valor_hora,
+                'valor_total': round(total_horas * valor_hora, 2)
+            })
+            agenda["total_horas"] += total_horas
+            agenda["total_valor"] += total_horas * valor_hora
+
+        for agenda in agendas.values():
+            agenda["total_horas"] = round(agenda["total_horas"], 2)
+            agenda["total_valor"] = round(agenda["total_valor"], 2)
+
+        return jsonify({"sucesso": True, "relatorio": {
+            "agendas": list(agendas.values()),
+            "total_horas": round(sum(agenda["total_horas"] for agenda in agendas.values()), 2),
+            "total_valor": round(sum(agenda["total_valor"] for agenda in agendas.values()), 2)
+        }})
+
+    except Exception as e:
+        return jsonify({"sucesso": False, "mensagem": f"Erro ao gerar relatório consolidado: {str(e)}"}), 500
 
 @app.route('/public/agenda/<link_publico_id>')
 def visualizar_agenda_compartilhada(link_publico_id):
@@ -1607,6 +3133,15 @@ def visualizar_agenda_compartilhada(link_publico_id):
         print(f"Erro ao buscar dados da agenda compartilhada {link_publico_id}: {str(e)}")
         return render_template('erro.html', mensagem="Erro ao processar a agenda compartilhada."), 500
 
+@app.route('/metrics', methods=['GET'])
+def metricas():
+    recusa = _recusar_sem_token_de_metricas()
+    if recusa:
+        return recusa
+    resposta = make_response(_metricas.exportar())
+    resposta.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return resposta
+
 @app.route('/health', methods=['GET'])
 def health_check():
     try:
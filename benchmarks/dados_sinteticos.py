@@ -0,0 +1,118 @@
+"""
+Geradores de dados sintéticos para os benchmarks: usuários com muitos locais_trabalho
+ligados em cadeias por relacionado_com e agendas com semanas densas.
+Tudo é determinístico a partir da semente.
+"""
+import random
+
+# Tamanhos pré-definidos: (locais, tamanho das cadeias de relacionado_com, compromissos por dia)
+CENARIOS = {
+    'pequeno': {'locais': 10, 'cadeia': 2, 'compromissos_por_dia': 6},
+    'medio': {'locais': 60, 'cadeia': 5, 'compromissos_por_dia': 20},
+    'grande': {'locais': 400, 'cadeia': 10, 'compromissos_por_dia': 60},
+}
+
+USUARIO_ID = 'usuario-bench'
+AGENDA_ID = 'agenda-bench'
+
+
+def _hora(minutos):
+    return f"{minutos // 60:02d}:{minutos % 60:02d}:00"
+
+
+def gerar_locais(usuario_id, quantidade, tamanho_cadeia, rnd, prefixo=''):
+    """
+    Locais em cadeias: cada local aponta (relacionado_com) para o anterior da sua cadeia,
+    então um grupo tem tamanho_cadeia locais e só é descoberto seguindo a cadeia inteira.
+    """
+    locais = []
+    for indice in range(quantidade):
+        anterior = locais[-1]['id_local'] if indice % tamanho_cadeia else None
+        locais.append({
+            'id_local': f"{prefixo}local-{indice:04d}",
+            'usuario_id': usuario_id,
+            'nome': f"Local {indice}",
+            'cor': f"#{rnd.randrange(0x1000000):06x}",
+            'acrescimo_ha_percent': rnd.choice([0, 0, 10, 20]),
+            'periodo_carencia': rnd.choice([0, 30, 60]),
+            'relacionado_com': anterior
+        })
+    return locais
+
+
+def gerar_semana_densa(agenda_id, locais, compromissos_por_dia, rnd, prefixo=''):
+    """
+    Semana com compromissos_por_dia compromissos curtos e sem sobreposição em cada dia,
+    espalhados entre 06:00 e 23:30. Não precisa respeitar as regras de negócio (dados
+    antigos também não respeitam); serve como carga para a validação e os relatórios.
+    """
+    compromissos = []
+    inicio_dia, fim_dia = 6 * 60, 23 * 60 + 30
+    passo = max(1, (fim_dia - inicio_dia) // compromissos_por_dia)
+    for dia_semana in range(7):
+        for indice in range(compromissos_por_dia):
+            inicio = inicio_dia + indice * passo
+            duracao_min = max(1, min(passo - 1, rnd.choice([15, 30, 45, 50, 60])))
+            compromissos.append({
+                'id_compromisso': f"{prefixo}comp-{dia_semana}-{indice:03d}",
+                'agenda_id': agenda_id,
+                'local_id': rnd.choice(locais)['id_local'],
+                'dia_semana': dia_semana,
+                'hora_inicio': _hora(inicio),
+                'hora_fim': _hora(inicio + duracao_min),
+                'duracao': round(duracao_min / 60, 4),
+                'tipo_hora': rnd.choice(['HA', 'HT']),
+                'descricao': None
+            })
+    return compromissos
+
+
+def gerar_candidatos(locais, quantidade, rnd):
+    """Compromissos novos a validar: mistura de válidos, conflitantes e longos demais."""
+    candidatos = []
+    for _ in range(quantidade):
+        inicio = rnd.randrange(6 * 60, 22 * 60, 5)
+        duracao_min = rnd.choice([30, 60, 90, 120, 420])
+        candidatos.append({
+            'local_id': rnd.choice(locais)['id_local'],
+            'dia_semana': rnd.randrange(7),
+            'hora_inicio': _hora(inicio)[:5],
+            'hora_fim': _hora(min(inicio + duracao_min, 24 * 60 - 1))[:5],
+            'duracao': duracao_min / 60
+        })
+    return candidatos
+
+
+def gerar_tabelas(cenario, semente=42, prefixo=''):
+    """
+    Tabelas em memória de um cenário (dict tabela -> linhas) e os locais gerados.
+    Com prefixo, todos os ids (usuário, agenda, link, locais...) recebem o prefixo, para
+    juntar vários usuários no mesmo banco.
+    """
+    parametros = CENARIOS[cenario]
+    rnd = random.Random(semente)
+    usuario_id, agenda_id = f"{prefixo}{USUARIO_ID}", f"{prefixo}{AGENDA_ID}"
+    locais = gerar_locais(usuario_id, parametros['locais'], parametros['cadeia'], rnd, prefixo)
+    compromissos = gerar_semana_densa(agenda_id, locais, parametros['compromissos_por_dia'], rnd, prefixo)
+    tabelas = {
+        'agendas': [{
+            'id_agenda': agenda_id,
+            'usuario_id': usuario_id,
+            'nome': 'Agenda de benchmark',
+            'data_inicio': '2026-02-01',
+            'data_fim': '2026-12-15',
+            'dias_semana': [1, 2, 3, 4, 5, 6],
+            'hora_inicio_padrao': '07:00:00',
+            'hora_fim_padrao': '23:00:00',
+            'link_publico_id': f"{prefixo}link-bench"
+        }],
+        'locais_trabalho': locais,
+        'agenda_locais_config': [
+            {'id_agenda_local': f"config-{local['id_local']}", 'agenda_id': agenda_id,
+             'local_id': local['id_local'], 'valor_hora': float(rnd.randrange(30, 120))}
+            for local in locais
+        ],
+        'compromissos': compromissos,
+        'agenda_permissoes': []
+    }
+    return tabelas, locais
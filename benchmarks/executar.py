@@ -0,0 +1,228 @@
+"""
+Microbenchmarks dos núcleos de agenda e relatório do app.py contra o Supabase falso.
+
+    python -m benchmarks.executar [--cenario medio] [--repeticoes 200] [--latencia-ms 0]
+                                  [--saida benchmarks/resultados/atual.json]
+                                  [--comparar benchmarks/resultados/base.json]
+
+Para cada benchmark mede o tempo de parede por iteração (média, p50, p95, mín.) e as
+chamadas ao backend (total e por iteração, por tabela/operação). O resultado é salvo em
+JSON para comparar execuções antes/depois de uma otimização (--comparar).
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+# O app exige as variáveis do Supabase ao ser importado; o cliente real não é usado
+os.environ.setdefault('SUPABASE_URL', 'http://localhost:54321')
+os.environ.setdefault('SUPABASE_KEY', 'chave-benchmark')
+
+import app as aplicacao  # noqa: E402
+from benchmarks.dados_sinteticos import AGENDA_ID, CENARIOS, USUARIO_ID, gerar_candidatos, gerar_tabelas  # noqa: E402
+from benchmarks.supabase_falso import ClienteSupabaseFalso  # noqa: E402
+
+
+def _limpar_caches():
+    with aplicacao._workplace_group_indexes_lock:
+        aplicacao._workplace_group_indexes.clear()
+    aplicacao._report_aggregates.clear()
+    aplicacao._agenda_access_cache.clear()
+    aplicacao._public_agenda_cache.clear()
+
+
+def _percentil(ordenados, fracao):
+    if not ordenados:
+        return 0.0
+    return ordenados[min(len(ordenados) - 1, int(round(fracao * (len(ordenados) - 1))))]
+
+
+def medir(nome, cliente, funcao, repeticoes, lote=1, preparar=None):
+    """
+    Executa funcao(i) repeticoes x lote vezes; cada amostra de tempo cobre um lote
+    (para funções curtas demais para medir uma a uma). preparar(i), se houver, roda antes
+    de cada amostra, fora do tempo medido.
+    """
+    amostras_ns = []
+    cliente.zerar_chamadas()
+    chamadas_preparo = 0
+    for repeticao in range(repeticoes):
+        if preparar:
+            antes = cliente.total_chamadas()
+            preparar(repeticao)
+            chamadas_preparo += cliente.total_chamadas() - antes
+        inicio = time.perf_counter_ns()
+        for indice in range(lote):
+            funcao(repeticao * lote + indice)
+        amostras_ns.append(time.perf_counter_ns() - inicio)
+
+    iteracoes = repeticoes * lote
+    por_chamada_us = sorted(amostra / lote / 1000 for amostra in amostras_ns)
+    chamadas = {f"{operacao} {tabela}": quantidade for (tabela, operacao), quantidade in sorted(cliente.chamadas.items())}
+    total_chamadas = sum(cliente.chamadas.values()) - chamadas_preparo
+    return nome, {
+        "iteracoes": iteracoes,
+        "tempo_total_s": round(sum(amostras_ns) / 1e9, 6),
+        "media_us": round(sum(por_chamada_us) / len(por_chamada_us), 3),
+        "p50_us": round(_percentil(por_chamada_us, 0.50), 3),
+        "p95_us": round(_percentil(por_chamada_us, 0.95), 3),
+        "min_us": round(por_chamada_us[0], 3),
+        "chamadas_backend": total_chamadas,
+        "chamadas_por_iteracao": round(total_chamadas / iteracoes, 3),
+        "chamadas_por_operacao": chamadas
+    }
+
+
+def executar(cenario, repeticoes, latencia_ms, semente=42):
+    tabelas, locais = gerar_tabelas(cenario, semente)
+    cliente = ClienteSupabaseFalso(tabelas, latencia_ms=latencia_ms)
+    aplicacao.supabase_client = cliente
+    candidatos = gerar_candidatos(locais, 500, random.Random(semente))
+    horarios = [c['hora_inicio'] for c in candidatos] + [c['hora_fim'] + ':00' for c in candidatos]
+    ids_locais = [local['id_local'] for local in locais]
+    resultados = {}
+
+    def registrar(resultado):
+        nome, dados = resultado
+        resultados[nome] = dados
+
+    # _time_str_to_minutes: função pura, medida em lotes de 1000 conversões
+    registrar(medir(
+        '_time_str_to_minutes', cliente,
+        lambda i: aplicacao._time_str_to_minutes(horarios[i % len(horarios)]),
+        repeticoes, lote=1000
+    ))
+
+    with aplicacao.app.app_context():
+        # _validate_appointment sem snapshot: carrega a semana e os locais a cada chamada
+        _limpar_caches()
+        registrar(medir(
+            '_validate_appointment (frio)', cliente,
+            lambda i: aplicacao._validate_appointment(cliente, AGENDA_ID, candidatos[i % len(candidatos)], USUARIO_ID),
+            repeticoes
+        ))
+
+        # _validate_appointment com snapshot compartilhado (caminho do lote): só as regras
+        snapshot = aplicacao._ValidationSnapshot(cliente, AGENDA_ID, USUARIO_ID)
+        registrar(medir(
+            '_validate_appointment (snapshot)', cliente,
+            lambda i: aplicacao._validate_appointment(cliente, AGENDA_ID, candidatos[i % len(candidatos)], USUARIO_ID, snapshot=snapshot),
+            repeticoes, lote=10
+        ))
+
+    # _get_workplace_group_index: frio (índice reconstruído a cada amostra) e com o índice em cache
+    def limpar_indice(_):
+        with aplicacao._workplace_group_indexes_lock:
+            aplicacao._workplace_group_indexes.clear()
+
+    registrar(medir(
+        '_get_workplace_group_index (frio)', cliente,
+        lambda i: aplicacao._get_workplace_group_index(cliente, USUARIO_ID).group_of(ids_locais[i % len(ids_locais)]),
+        repeticoes, preparar=limpar_indice
+    ))
+    aplicacao._get_workplace_group_index(cliente, USUARIO_ID)
+    registrar(medir(
+        '_get_workplace_group_index (cache)', cliente,
+        lambda i: aplicacao._get_workplace_group_index(cliente, USUARIO_ID).group_of(ids_locais[i % len(ids_locais)]),
+        repeticoes, lote=100
+    ))
+
+    # _generate_report_data: recálculo completo; e a leitura dos agregados incrementais
+    registrar(medir(
+        '_generate_report_data', cliente,
+        lambda i: aplicacao._generate_report_data(AGENDA_ID, cliente, USUARIO_ID),
+        repeticoes
+    ))
+    ocorrencias = aplicacao._count_weekday_occurrences(aplicacao.date(2026, 2, 1), aplicacao.date(2026, 12, 15))
+    registrar(medir(
+        '_generate_report_data (período)', cliente,
+        lambda i: aplicacao._generate_report_data(AGENDA_ID, cliente, USUARIO_ID, ocorrencias),
+        repeticoes
+    ))
+    aplicacao._report_aggregates.clear()
+    agenda = aplicacao._repositorio(cliente).versao_agenda(AGENDA_ID)
+    aplicacao._get_report_aggregate(cliente, agenda, USUARIO_ID)
+    registrar(medir(
+        '_ReportAggregate.report (cache)', cliente,
+        lambda i: aplicacao._get_report_aggregate(cliente, aplicacao._repositorio(cliente).versao_agenda(AGENDA_ID), USUARIO_ID).report(),
+        repeticoes
+    ))
+
+    return resultados
+
+
+def _commit_atual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def comparar(base, atual):
+    """Tabela texto com a razão atual/base do tempo médio e a diferença de chamadas por iteração."""
+    linhas = [f"{'benchmark':40} {'base us':>12} {'atual us':>12} {'razão':>8} {'chamadas/it':>14}"]
+    for nome, dados in atual["resultados"].items():
+        anterior = base["resultados"].get(nome)
+        if anterior is None:
+            linhas.append(f"{nome:40} {'-':>12} {dados['media_us']:>12.3f} {'novo':>8}")
+            continue
+        razao = dados['media_us'] / anterior['media_us'] if anterior['media_us'] else float('inf')
+        chamadas = f"{anterior['chamadas_por_iteracao']:g} -> {dados['chamadas_por_iteracao']:g}"
+        linhas.append(f"{nome:40} {anterior['media_us']:>12.3f} {dados['media_us']:>12.3f} {razao:>7.2f}x {chamadas:>14}")
+    return '\n'.join(linhas)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cenario', choices=sorted(CENARIOS), default='medio')
+    parser.add_argument('--repeticoes', type=int, default=200)
+    parser.add_argument('--latencia-ms', type=float, default=0.0, help='latência simulada por chamada ao backend')
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--saida', help='arquivo JSON de saída (padrão: benchmarks/resultados/<cenario>-<data>.json)')
+    parser.add_argument('--comparar', help='JSON de uma execução anterior para comparar')
+    args = parser.parse_args(argv)
+
+    resultados = executar(args.cenario, args.repeticoes, args.latencia_ms, args.semente)
+    relatorio = {
+        "meta": {
+            "data": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            "commit": _commit_atual(),
+            "python": platform.python_version(),
+            "plataforma": platform.platform(),
+            "cenario": args.cenario,
+            "parametros_cenario": CENARIOS[args.cenario],
+            "repeticoes": args.repeticoes,
+            "latencia_ms": args.latencia_ms,
+            "semente": args.semente,
+            "async_io": aplicacao.ASYNC_IO
+        },
+        "resultados": resultados
+    }
+
+    saida = args.saida or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'resultados',
+        f"{args.cenario}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(saida)), exist_ok=True)
+    with open(saida, 'w', encoding='utf-8') as arquivo:
+        json.dump(relatorio, arquivo, indent=2, ensure_ascii=False)
+
+    for nome, dados in resultados.items():
+        print(f"{nome:40} média {dados['media_us']:>10.3f} us  p95 {dados['p95_us']:>10.3f} us  "
+              f"chamadas/it {dados['chamadas_por_iteracao']:g}")
+    print(f"Resultados salvos em {saida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as arquivo:
+            print(comparar(json.load(arquivo), relatorio))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
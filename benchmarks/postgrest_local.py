@@ -0,0 +1,480 @@
+"""
+Substituto local, em memória, do Supabase (PostgREST em /rest/v1 e o mínimo do Auth em
+/auth/v1) para testes de carga sem rede. Implementa o subconjunto usado pelo app.py:
+
+- select com projeção de colunas e embeds muitos-para-um (ex.: '*, locais_trabalho(nome, cor)')
+  e um-para-muitos (ex.: 'compromissos(*)' a partir de agendas, como lista);
+- filtros eq, neq, gt, gte, lt, lte, in, is (também nas linhas embutidas, ex.:
+  'compromissos.versao=gt.5'); order, limit, offset;
+- insert/upsert (lista ou objeto), update e delete com Prefer: return=representation;
+- Accept: application/vnd.pgrst.object+json (single);
+- POST /auth/v1/token (password e refresh_token), POST /auth/v1/signup e /auth/v1/logout;
+- os gatilhos de versionamento do schema.sql (versao, updated_at, registros_excluidos e
+  o updated_at das agendas), sem as exclusões em cascata;
+- a função alterar_da_agenda do schema.sql (POST /rest/v1/rpc/alterar_da_agenda).
+
+Conta cada requisição por (tabela, operação) em `chamadas`; latencia_ms simula a ida ao banco.
+
+    python -m benchmarks.postgrest_local --porta 54321 [--usuarios 20] [--cenario pequeno]
+"""
+import argparse
+import base64
+import datetime
+import json
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+from benchmarks.supabase_falso import CHAVES_PRIMARIAS
+from repositorio import ATUALIZACAO_DO_CONTADOR, SINCRONIZACAO
+
+# Chaves estrangeiras para embeds: (tabela, tabela embutida) -> (coluna local, coluna remota);
+# lidas ao contrário, dão os embeds um-para-muitos
+CHAVES_ESTRANGEIRAS = {
+    ('agenda_locais_config', 'locais_trabalho'): ('local_id', 'id_local'),
+    ('agenda_locais_config', 'agendas'): ('agenda_id', 'id_agenda'),
+    ('compromissos', 'locais_trabalho'): ('local_id', 'id_local'),
+    ('compromissos', 'agendas'): ('agenda_id', 'id_agenda'),
+    ('agenda_permissoes', 'agendas'): ('agenda_id', 'id_agenda'),
+    ('agenda_permissoes', 'usuarios'): ('usuario_recebeu_id', 'id_usuario'),
+    ('locais_trabalho', 'usuarios'): ('usuario_id', 'id_usuario'),
+    ('agendas', 'usuarios'): ('usuario_id', 'id_usuario'),
+    ('configuracoes_usuario', 'usuarios'): ('usuario_id', 'id_usuario'),
+    ('registros_excluidos', 'agendas'): ('agenda_id', 'id_agenda'),
+    ('registros_excluidos', 'usuarios'): ('usuario_id', 'id_usuario'),
+}
+PARAMETROS_RESERVADOS = ('select', 'order', 'limit', 'offset', 'on_conflict', 'columns')
+
+
+def _dividir_nivel_zero(texto):
+    """Divide por vírgulas fora de parênteses."""
+    partes, profundidade, atual = [], 0, ''
+    for caractere in texto:
+        if caractere == ',' and profundidade == 0:
+            partes.append(atual.strip())
+            atual = ''
+            continue
+        profundidade += caractere == '('
+        profundidade -= caractere == ')'
+        atual += caractere
+    if atual.strip():
+        partes.append(atual.strip())
+    return partes
+
+
+def _como_numero(valor):
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def _comparar(valor_linha, valor_filtro):
+    """Compara numericamente quando ambos são números; senão como texto."""
+    numero_linha, numero_filtro = _como_numero(valor_linha), _como_numero(valor_filtro)
+    if numero_linha is not None and numero_filtro is not None:
+        return (numero_linha > numero_filtro) - (numero_linha < numero_filtro)
+    texto_linha, texto_filtro = str(valor_linha), str(valor_filtro)
+    return (texto_linha > texto_filtro) - (texto_linha < texto_filtro)
+
+
+def _agora():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def _predicado(coluna, expressao):
+    negado = expressao.startswith('not.')
+    if negado:
+        expressao = expressao[4:]
+    operador, _, valor = expressao.partition('.')
+    valor = unquote(valor)
+
+    if operador == 'eq':
+        teste = lambda v: v is not None and _comparar(v, valor) == 0
+    elif operador == 'neq':
+        teste = lambda v: v is not None and _comparar(v, valor) != 0
+    elif operador in ('gt', 'gte', 'lt', 'lte'):
+        limites = {'gt': (1,), 'gte': (0, 1), 'lt': (-1,), 'lte': (-1, 0)}[operador]
+        teste = lambda v: v is not None and _comparar(v, valor) in limites
+    elif operador == 'in':
+        valores = [item.strip().strip('"') for item in valor.strip('()').split(',')] if valor.strip('()') else []
+        teste = lambda v: v is not None and any(_comparar(v, item) == 0 for item in valores)
+    elif operador == 'is':
+        esperado = {'null': None, 'true': True, 'false': False}.get(valor.lower(), valor)
+        teste = lambda v: v is esperado or v == esperado
+    else:
+        raise ValueError(f"Operador não suportado: {operador}")
+    return (lambda linha: not teste(linha.get(coluna))) if negado else (lambda linha: teste(linha.get(coluna)))
+
+
+class BancoEmMemoria:
+    """Tabelas (dict tabela -> linhas) protegidas por um lock, com contagem de chamadas."""
+
+    def __init__(self, tabelas=None, senhas=None, latencia_ms=0.0):
+        self.tabelas = tabelas if tabelas is not None else {}
+        self.senhas = senhas if senhas is not None else {}  # email -> (senha, id do usuário)
+        self.refresh_tokens = {}
+        self.latencia_ms = latencia_ms
+        self.chamadas = Counter()
+        self._lock = threading.Lock()
+        for tabela, linhas in self.tabelas.items():
+            for linha in linhas:
+                self._padroes(tabela, linha)
+
+    def registrar_chamada(self, tabela, operacao):
+        with self._lock:
+            self.chamadas[(tabela, operacao)] += 1
+        if self.latencia_ms:
+            time.sleep(self.latencia_ms / 1000)
+
+    def total_chamadas(self):
+        with self._lock:
+            return sum(self.chamadas.values())
+
+    def zerar_chamadas(self):
+        with self._lock:
+            self.chamadas.clear()
+
+    # Sincronização incremental (gatilho versionar_registro do schema.sql)
+
+    @staticmethod
+    def _padroes(tabela, linha):
+        """Defaults das colunas de versão, como os DEFAULTs do schema."""
+        for dono, _, contador, _ in SINCRONIZACAO.values():
+            if tabela == dono:
+                linha.setdefault(contador, 0)
+                linha.setdefault(ATUALIZACAO_DO_CONTADOR[dono], _agora())
+        if tabela in SINCRONIZACAO:
+            linha.setdefault('versao', 0)
+            linha.setdefault('updated_at', _agora())
+
+    def _versionar(self, tabela, linha, excluida=False):
+        """Incrementa o contador do dono e grava a versão na linha, ou a lápide da excluída."""
+        if tabela not in SINCRONIZACAO:
+            return
+        dono, chave, contador, coluna_dono = SINCRONIZACAO[tabela]
+        registro_dono = next((l for l in self.tabelas.get(dono, []) if str(l.get(chave)) == str(linha.get(coluna_dono))), None)
+        versao = None
+        if registro_dono is not None:
+            versao = registro_dono[contador] = (registro_dono.get(contador) or 0) + 1
+            registro_dono[ATUALIZACAO_DO_CONTADOR[dono]] = _agora()
+        if not excluida:
+            linha['versao'] = versao or 0
+            linha['updated_at'] = _agora()
+            return
+        if versao is None:
+            return
+        id_registro = linha[CHAVES_PRIMARIAS[tabela]]
+        lapides = self.tabelas.setdefault('registros_excluidos', [])
+        lapides[:] = [l for l in lapides if not (l['tabela'] == tabela and l['id_registro'] == id_registro)]
+        lapides.append({
+            'tabela': tabela, 'id_registro': id_registro,
+            'agenda_id': linha.get('agenda_id') if coluna_dono == 'agenda_id' else None,
+            'usuario_id': linha.get('usuario_id') if coluna_dono == 'usuario_id' else None,
+            'versao': versao, 'excluido_em': _agora()
+        })
+
+    # PostgREST
+
+    def _projetar(self, tabela, linha, colunas, filtros_embutidos=None):
+        if not colunas or colunas == ['*']:
+            return dict(linha)
+        resultado = {}
+        for coluna in colunas:
+            if coluna == '*':
+                resultado.update(linha)
+                continue
+            embed = re.match(r'^(\w+)(![\w!]+)?\((.*)\)$', coluna, re.S)
+            if embed:
+                nome, sufixo, internas = embed.group(1), embed.group(2) or '', embed.group(3)
+                ligacao = CHAVES_ESTRANGEIRAS.get((tabela, nome))
+                dica = next((parte for parte in sufixo.split('!') if parte.endswith('_fkey')), None)
+                if dica and dica.startswith(f"{tabela}_"):
+                    ligacao = (dica[len(tabela) + 1:-len('_fkey')], ligacao[1] if ligacao else f"id_{nome.rstrip('s')}")
+                if not ligacao and (nome, tabela) in CHAVES_ESTRANGEIRAS:
+                    coluna_filha, coluna_pai = CHAVES_ESTRANGEIRAS[(nome, tabela)]
+                    predicados = (filtros_embutidos or {}).get(nome, [])
+                    resultado[nome] = [
+                        self._projetar(nome, filha, _dividir_nivel_zero(internas))
+                        for filha in self.tabelas.get(nome, [])
+                        if str(filha.get(coluna_filha)) == str(linha.get(coluna_pai)) and all(p(filha) for p in predicados)
+                    ]
+                    continue
+                if not ligacao:
+                    continue
+                alvo = next((l for l in self.tabelas.get(nome, []) if str(l.get(ligacao[1])) == str(linha.get(ligacao[0]))), None)
+                resultado[nome] = self._projetar(nome, alvo, _dividir_nivel_zero(internas)) if alvo else None
+                continue
+            nome_coluna = coluna.split(':')[-1].split('::')[0].strip()
+            resultado[nome_coluna] = linha.get(nome_coluna)
+        return resultado
+
+    def _filtrar(self, linhas, parametros):
+        predicados = [_predicado(chave, valor) for chave, valor in parametros if chave not in PARAMETROS_RESERVADOS]
+        return [linha for linha in linhas if all(predicado(linha) for predicado in predicados)]
+
+    def selecionar(self, tabela, parametros):
+        # Filtros "embed.coluna" restringem as linhas embutidas, não as da tabela
+        filtros_embutidos = {}
+        for chave, valor in parametros:
+            nome, ponto, coluna = chave.partition('.')
+            if ponto and chave not in PARAMETROS_RESERVADOS:
+                filtros_embutidos.setdefault(nome, []).append(_predicado(coluna, valor))
+        parametros = [(chave, valor) for chave, valor in parametros if '.' not in chave]
+        with self._lock:
+            linhas = self._filtrar(self.tabelas.get(tabela, []), parametros)
+            colunas = _dividir_nivel_zero(dict(parametros).get('select', '*'))
+            # Embeds com !inner descartam linhas sem correspondência
+            resultado = []
+            for linha in linhas:
+                projetada = self._projetar(tabela, linha, colunas, filtros_embutidos)
+                if any('!inner' in coluna and projetada.get(coluna.split('!')[0]) is None for coluna in colunas):
+                    continue
+                resultado.append(projetada)
+        parametros_dict = dict(parametros)
+        for termo in reversed(parametros_dict.get('order', '').split(',') if parametros_dict.get('order') else []):
+            coluna, *modificadores = termo.split('.')
+            resultado.sort(key=lambda l: (l.get(coluna) is None, str(l.get(coluna))), reverse='desc' in modificadores)
+        inicio = int(parametros_dict.get('offset', 0))
+        fim = inicio + int(parametros_dict['limit']) if 'limit' in parametros_dict else None
+        return resultado[inicio:fim]
+
+    def inserir(self, tabela, corpo, upsert=False, conflito=None):
+        novas = corpo if isinstance(corpo, list) else [corpo]
+        chave = conflito or CHAVES_PRIMARIAS.get(tabela)
+        criadas = []
+        with self._lock:
+            linhas = self.tabelas.setdefault(tabela, [])
+            for nova in novas:
+                nova = dict(nova)
+                if CHAVES_PRIMARIAS.get(tabela) and CHAVES_PRIMARIAS[tabela] not in nova:
+                    nova[CHAVES_PRIMARIAS[tabela]] = str(uuid.uuid4())
+                existente = None
+                if upsert and chave:
+                    colunas = chave.split(',')
+                    existente = next((l for l in linhas if all(str(l.get(c)) == str(nova.get(c)) for c in colunas)), None)
+                if existente is not None:
+                    existente.update(nova)
+                    self._versionar(tabela, existente)
+                    criadas.append(dict(existente))
+                else:
+                    self._padroes(tabela, nova)
+                    self._versionar(tabela, nova)
+                    linhas.append(nova)
+                    criadas.append(dict(nova))
+        return criadas
+
+    def atualizar(self, tabela, parametros, corpo):
+        with self._lock:
+            linhas = self._filtrar(self.tabelas.get(tabela, []), parametros)
+            for linha in linhas:
+                linha.update(corpo)
+                self._versionar(tabela, linha)
+                if tabela == 'agendas':
+                    # Gatilho tocar_agendas
+                    linha['updated_at'] = _agora()
+            return [dict(linha) for linha in linhas]
+
+    def excluir(self, tabela, parametros):
+        with self._lock:
+            todas = self.tabelas.get(tabela, [])
+            removidas = self._filtrar(todas, parametros)
+            ids = {id(linha) for linha in removidas}
+            self.tabelas[tabela] = [linha for linha in todas if id(linha) not in ids]
+            for linha in removidas:
+                self._versionar(tabela, linha, excluida=True)
+            return [dict(linha) for linha in removidas]
+
+    # Funções do schema.sql
+
+    def alterar_da_agenda(self, parametros):
+        """UPDATE/DELETE de uma tabela filha da agenda com a posse verificada junto, como no schema.sql."""
+        tabela, filtros, valores = parametros['p_tabela'], parametros['p_filtros'], parametros.get('p_valores')
+        with self._lock:
+            agenda = next((a for a in self.tabelas.get('agendas', []) if str(a['id_agenda']) == str(filtros.get('agenda_id'))), None)
+            if agenda is None or str(agenda['usuario_id']) != str(parametros['p_usuario_id']):
+                return []
+            todas = self.tabelas.get(tabela, [])
+            alteradas = self._filtrar(todas, [(coluna, f"eq.{valor}") for coluna, valor in filtros.items()])
+            if valores is not None:
+                for linha in alteradas:
+                    linha.update(valores)
+                    self._versionar(tabela, linha)
+                return [dict(linha) for linha in alteradas]
+            ids = {id(linha) for linha in alteradas}
+            self.tabelas[tabela] = [linha for linha in todas if id(linha) not in ids]
+            excluidas = []
+            for linha in alteradas:
+                self._versionar(tabela, linha, excluida=True)
+                excluida = dict(linha)
+                if tabela in SINCRONIZACAO:
+                    chave = CHAVES_PRIMARIAS[tabela]
+                    excluida['versao_exclusao'] = next(
+                        (l['versao'] for l in self.tabelas.get('registros_excluidos', [])
+                         if l['tabela'] == tabela and l['id_registro'] == linha[chave]), None)
+                excluidas.append(excluida)
+            return excluidas
+
+    # Auth
+
+    def sessao(self, usuario_id, email):
+        agora = int(time.time())
+        cabecalho = base64.urlsafe_b64encode(b'{"alg":"HS256","typ":"JWT"}').rstrip(b'=').decode()
+        carga = base64.urlsafe_b64encode(json.dumps({
+            'sub': usuario_id, 'email': email, 'role': 'authenticated', 'aud': 'authenticated', 'exp': agora + 3600, 'iat': agora
+        }).encode()).rstrip(b'=').decode()
+        refresh_token = uuid.uuid4().hex
+        with self._lock:
+            self.refresh_tokens[refresh_token] = (usuario_id, email)
+        return {
+            'access_token': f"{cabecalho}.{carga}.assinatura-local",
+            'token_type': 'bearer',
+            'expires_in': 3600,
+            'expires_at': agora + 3600,
+            'refresh_token': refresh_token,
+            'user': {
+                'id': usuario_id, 'aud': 'authenticated', 'role': 'authenticated', 'email': email,
+                'app_metadata': {}, 'user_metadata': {}, 'created_at': '2026-01-01T00:00:00Z'
+            }
+        }
+
+
+class _Manipulador(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Cabeçalhos e corpo saem em writes separados; com Nagle ligado o keep-alive espera o ACK atrasado (~40 ms)
+    disable_nagle_algorithm = True
+    banco = None  # definido por criar_servidor
+
+    def log_message(self, *args):
+        pass
+
+    def _responder(self, status, corpo=None, cabecalhos=None):
+        dados = b'' if corpo is None else json.dumps(corpo, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(dados)))
+        for chave, valor in (cabecalhos or {}).items():
+            self.send_header(chave, valor)
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def _corpo(self):
+        tamanho = int(self.headers.get('Content-Length') or 0)
+        bruto = self.rfile.read(tamanho) if tamanho else b''
+        return json.loads(bruto) if bruto else None
+
+    def _tratar(self):
+        url = urlsplit(self.path)
+        parametros = parse_qsl(url.query, keep_blank_values=True)
+        corpo = self._corpo()
+        try:
+            if url.path.startswith('/auth/v1/'):
+                return self._auth(url.path[len('/auth/v1/'):], dict(parametros), corpo or {})
+            if url.path.startswith('/rest/v1/'):
+                return self._rest(url.path[len('/rest/v1/'):], parametros, corpo)
+            return self._responder(404, {'message': 'Not found'})
+        except ValueError as e:
+            return self._responder(400, {'message': str(e), 'code': 'PGRST100', 'hint': None, 'details': None})
+
+    do_GET = do_POST = do_PATCH = do_DELETE = do_HEAD = _tratar
+
+    def _rest(self, caminho, parametros, corpo):
+        banco = self.banco
+        if caminho.startswith('rpc/'):
+            banco.registrar_chamada(caminho[4:], 'rpc')
+            if caminho[4:] == 'alterar_da_agenda':
+                return self._responder(200, banco.alterar_da_agenda(corpo or {}))
+            return self._responder(404, {'message': f"Função {caminho[4:]} não disponível no substituto local",
+                                         'code': 'PGRST202', 'hint': None, 'details': None})
+
+        tabela = caminho.strip('/')
+        prefer = self.headers.get('Prefer', '')
+        if self.command in ('GET', 'HEAD'):
+            banco.registrar_chamada(tabela, 'select')
+            linhas = banco.selecionar(tabela, parametros)
+        elif self.command == 'POST':
+            upsert = 'resolution=' in prefer
+            banco.registrar_chamada(tabela, 'upsert' if upsert else 'insert')
+            linhas = banco.inserir(tabela, corpo, upsert, dict(parametros).get('on_conflict'))
+        elif self.command == 'PATCH':
+            banco.registrar_chamada(tabela, 'update')
+            linhas = banco.atualizar(tabela, parametros, corpo or {})
+        else:
+            banco.registrar_chamada(tabela, 'delete')
+            linhas = banco.excluir(tabela, parametros)
+
+        cabecalhos = {'Content-Range': f"0-{max(len(linhas) - 1, 0)}/{len(linhas)}"}
+        if self.command in ('POST', 'PATCH', 'DELETE') and 'return=representation' not in prefer:
+            return self._responder(204 if self.command != 'POST' else 201, None, cabecalhos)
+        if 'vnd.pgrst.object' in (self.headers.get('Accept') or ''):
+            if len(linhas) != 1:
+                return self._responder(406, {'message': 'JSON object requested, multiple (or no) rows returned',
+                                             'code': 'PGRST116', 'hint': None, 'details': f"{len(linhas)} rows"})
+            return self._responder(200, linhas[0], cabecalhos)
+        return self._responder(201 if self.command == 'POST' else 200, linhas, cabecalhos)
+
+    def _auth(self, caminho, parametros, corpo):
+        banco = self.banco
+        banco.registrar_chamada(f"auth/{caminho}", parametros.get('grant_type', 'post'))
+        if caminho == 'token' and parametros.get('grant_type') == 'password':
+            senha_usuario = banco.senhas.get(corpo.get('email'))
+            if not senha_usuario or senha_usuario[0] != corpo.get('password'):
+                return self._responder(400, {'error': 'invalid_grant', 'error_description': 'Invalid login credentials',
+                                             'code': 400, 'msg': 'Invalid login credentials'})
+            return self._responder(200, banco.sessao(senha_usuario[1], corpo['email']))
+        if caminho == 'token' and parametros.get('grant_type') == 'refresh_token':
+            dono = banco.refresh_tokens.get(corpo.get('refresh_token'))
+            if not dono:
+                return self._responder(400, {'error': 'invalid_grant', 'code': 400, 'msg': 'Invalid Refresh Token'})
+            return self._responder(200, banco.sessao(*dono))
+        if caminho == 'signup':
+            usuario_id = str(uuid.uuid4())
+            banco.senhas[corpo.get('email')] = (corpo.get('password'), usuario_id)
+            return self._responder(200, banco.sessao(usuario_id, corpo.get('email')))
+        if caminho == 'logout':
+            return self._responder(204)
+        return self._responder(404, {'message': 'Not found'})
+
+
+def criar_servidor(banco, host='127.0.0.1', porta=0):
+    """ThreadingHTTPServer servindo o banco em memória (porta 0 = porta livre qualquer)."""
+    manipulador = type('Manipulador', (_Manipulador,), {'banco': banco})
+    servidor = ThreadingHTTPServer((host, porta), manipulador)
+    servidor.daemon_threads = True
+    return servidor
+
+
+def iniciar_em_thread(banco, host='127.0.0.1', porta=0):
+    """Sobe o servidor em uma thread daemon e devolve (servidor, url_base)."""
+    servidor = criar_servidor(banco, host, porta)
+    threading.Thread(target=servidor.serve_forever, name='postgrest-local', daemon=True).start()
+    return servidor, f"http://{host}:{servidor.server_port}"
+
+
+def main(argv=None):
+    from benchmarks.carga import popular_banco
+
+    parser = argparse.ArgumentParser(description='Substituto local do Supabase para testes de carga.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--porta', type=int, default=54321)
+    parser.add_argument('--usuarios', type=int, default=20)
+    parser.add_argument('--cenario', default='pequeno')
+    parser.add_argument('--latencia-ms', type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    banco, _ = popular_banco(args.usuarios, args.cenario)
+    banco.latencia_ms = args.latencia_ms
+    servidor = criar_servidor(banco, args.host, args.porta)
+    print(f"Supabase local em http://{args.host}:{args.porta} ({args.usuarios} usuários, senha 'senha-carga')")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
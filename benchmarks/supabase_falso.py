@@ -0,0 +1,210 @@
+"""
+Fake em memória do cliente Supabase (query builder do postgrest-py), suficiente para
+as consultas do app.py. Cada execute() é contado em `chamadas` por (tabela, operação),
+e uma latência fixa por chamada pode ser simulada para medir o efeito das idas ao banco.
+"""
+import copy
+import threading
+import time
+import uuid
+from collections import Counter
+
+CHAVES_PRIMARIAS = {
+    'agendas': 'id_agenda',
+    'locais_trabalho': 'id_local',
+    'compromissos': 'id_compromisso',
+    'agenda_locais_config': 'id_agenda_local',
+    'agenda_permissoes': 'id_permissao',
+    'configuracoes_usuario': 'id_configuracao',
+}
+
+
+class RespostaFalsa:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+        self.error = None
+
+
+class ConsultaFalsa:
+    """Acumula filtros e modificadores como o request builder real; execute() resolve em memória."""
+
+    def __init__(self, cliente, tabela):
+        self._cliente = cliente
+        self._tabela = tabela
+        self._operacao = 'select'
+        self._filtros = []
+        self._payload = None
+        self._ordem = []
+        self._limite = None
+        self._intervalo = None
+        self._unico = None  # None, 'maybe' ou 'single'
+
+    # Operações
+    def select(self, *colunas, **opcoes):
+        return self
+
+    def insert(self, payload, **opcoes):
+        self._operacao, self._payload = 'insert', payload
+        return self
+
+    def upsert(self, payload, **opcoes):
+        self._operacao, self._payload = 'upsert', payload
+        return self
+
+    def update(self, payload, **opcoes):
+        self._operacao, self._payload = 'update', payload
+        return self
+
+    def delete(self, **opcoes):
+        self._operacao = 'delete'
+        return self
+
+    # Filtros (comparação como texto, como os valores chegam ao PostgREST)
+    def _filtrar(self, coluna, predicado):
+        self._filtros.append(lambda linha: predicado(linha.get(coluna)))
+        return self
+
+    def eq(self, coluna, valor):
+        return self._filtrar(coluna, lambda v: str(v) == str(valor))
+
+    def neq(self, coluna, valor):
+        return self._filtrar(coluna, lambda v: str(v) != str(valor))
+
+    def in_(self, coluna, valores):
+        valores = {str(valor) for valor in valores}
+        return self._filtrar(coluna, lambda v: str(v) in valores)
+
+    def gt(self, coluna, valor):
+        return self._filtrar(coluna, lambda v: v is not None and str(v) > str(valor))
+
+    def gte(self, coluna, valor):
+        return self._filtrar(coluna, lambda v: v is not None and str(v) >= str(valor))
+
+    def lt(self, coluna, valor):
+        return self._filtrar(coluna, lambda v: v is not None and str(v) < str(valor))
+
+    def lte(self, coluna, valor):
+        return self._filtrar(coluna, lambda v: v is not None and str(v) <= str(valor))
+
+    # Modificadores
+    def order(self, coluna, desc=False, **opcoes):
+        self._ordem.append((coluna, desc))
+        return self
+
+    def limit(self, quantidade, **opcoes):
+        self._limite = quantidade
+        return self
+
+    def range(self, inicio, fim, **opcoes):
+        self._intervalo = (inicio, fim)
+        return self
+
+    def maybe_single(self):
+        self._unico = 'maybe'
+        return self
+
+    def single(self):
+        self._unico = 'single'
+        return self
+
+    def execute(self):
+        self._cliente._registrar(self._tabela, self._operacao)
+        with self._cliente._lock:
+            return self._resolver(self._cliente.tabelas.setdefault(self._tabela, []))
+
+    def _resolver(self, linhas):
+        if self._operacao in ('insert', 'upsert'):
+            novas = self._payload if isinstance(self._payload, list) else [self._payload]
+            chave = CHAVES_PRIMARIAS.get(self._tabela)
+            criadas = []
+            for nova in novas:
+                nova = dict(nova)
+                if chave and chave not in nova:
+                    nova[chave] = str(uuid.uuid4())
+                linhas.append(nova)
+                criadas.append(copy.deepcopy(nova))
+            return RespostaFalsa(criadas)
+
+        selecionadas = [linha for linha in linhas if all(filtro(linha) for filtro in self._filtros)]
+        if self._operacao == 'update':
+            for linha in selecionadas:
+                linha.update(self._payload)
+            return RespostaFalsa(copy.deepcopy(selecionadas))
+        if self._operacao == 'delete':
+            for linha in selecionadas:
+                linhas.remove(linha)
+            return RespostaFalsa(copy.deepcopy(selecionadas))
+
+        for coluna, desc in reversed(self._ordem):
+            selecionadas.sort(key=lambda linha: str(linha.get(coluna)), reverse=desc)
+        if self._intervalo:
+            selecionadas = selecionadas[self._intervalo[0]:self._intervalo[1] + 1]
+        if self._limite is not None:
+            selecionadas = selecionadas[:self._limite]
+        # Cópia profunda: o cliente real entrega objetos novos (JSON decodificado) a cada chamada
+        selecionadas = copy.deepcopy(selecionadas)
+        if self._unico == 'maybe':
+            return RespostaFalsa(selecionadas[0]) if selecionadas else None
+        if self._unico == 'single':
+            return RespostaFalsa(selecionadas[0] if selecionadas else None)
+        return RespostaFalsa(selecionadas)
+
+
+def alterar_da_agenda(tabelas, params):
+    """A função alterar_da_agenda do schema.sql (sem os gatilhos de versionamento)."""
+    filtros = params['p_filtros']
+    agenda = next((a for a in tabelas.get('agendas', []) if str(a['id_agenda']) == str(filtros.get('agenda_id'))), None)
+    if agenda is None or str(agenda['usuario_id']) != str(params['p_usuario_id']):
+        return []
+    linhas = tabelas.setdefault(params['p_tabela'], [])
+    alteradas = [linha for linha in linhas if all(str(linha.get(coluna)) == str(valor) for coluna, valor in filtros.items())]
+    for linha in alteradas:
+        if params.get('p_valores') is None:
+            linhas.remove(linha)
+        else:
+            linha.update(params['p_valores'])
+    return copy.deepcopy(alteradas)
+
+
+class ClienteSupabaseFalso:
+    """
+    Substituto de supabase_client: table(nome) -> ConsultaFalsa; rpc(nome, params) usa
+    `rpcs` (nome -> função(tabelas, params)), que já traz as funções do schema.sql usadas
+    por toda alteração.
+    """
+
+    def __init__(self, tabelas=None, latencia_ms=0.0):
+        self.tabelas = tabelas if tabelas is not None else {}
+        self.latencia_ms = latencia_ms
+        self.rpcs = {'alterar_da_agenda': alterar_da_agenda}
+        self.chamadas = Counter()
+        self._lock = threading.Lock()
+
+    def _registrar(self, tabela, operacao):
+        with self._lock:
+            self.chamadas[(tabela, operacao)] += 1
+        if self.latencia_ms:
+            time.sleep(self.latencia_ms / 1000)
+
+    def table(self, nome):
+        return ConsultaFalsa(self, nome)
+
+    def rpc(self, nome, params=None):
+        cliente = self
+
+        class _Rpc:
+            def execute(self):
+                cliente._registrar(nome, 'rpc')
+                with cliente._lock:
+                    return RespostaFalsa(cliente.rpcs[nome](cliente.tabelas, params or {}))
+
+        return _Rpc()
+
+    def total_chamadas(self):
+        with self._lock:
+            return sum(self.chamadas.values())
+
+    def zerar_chamadas(self):
+        with self._lock:
+            self.chamadas.clear()
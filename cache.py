@@ -0,0 +1,68 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Valor retornado por TTLCache.get quando a chave não está no cache
+# (permite guardar None como uma decisão válida)
+MISSING = object()
+
+
+class TTLCache:
+    """
+    Cache em memória com tamanho máximo (LRU) e tempo de vida por entrada.
+    Seguro para uso entre threads. Cada processo (worker) tem o seu próprio.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        """Remove todas as entradas para as quais predicate(key, value) é verdadeiro."""
+        with self._lock:
+            for key in [key for key, (value, _) in self._data.items() if predicate(key, value)]:
+                del self._data[key]
+
+    def values(self):
+        """Lista (cópia) dos valores ainda válidos, sem alterar a ordem LRU."""
+        agora = time.monotonic()
+        with self._lock:
+            return [value for value, expires_at in self._data.values() if expires_at >= agora]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,158 @@
+import threading
+from collections import Counter, deque, namedtuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import g, request
+
+from metricas import descrever_postgrest
+
+# Uma consulta ao backend registrada durante a requisição
+Consulta = namedtuple('Consulta', ['tabela', 'operacao', 'assinatura', 'formato', 'segundos'])
+
+
+class OrcamentoConsultasExcedido(AssertionError):
+    """Levantada por DetectorConsultas.verificar quando um relatório tem problemas."""
+
+
+class DetectorConsultas:
+    """
+    Middleware de depuração que registra as consultas ao backend feitas em cada requisição
+    e sinaliza:
+      - consultas idênticas repetidas (mesma assinatura mais de uma vez);
+      - o padrão N+1 (o mesmo formato de consulta, variando só os valores dos filtros,
+        repetido limiar_n1 vezes ou mais);
+      - requisições acima do orçamento de consultas da rota.
+
+    orcamentos mapeia "MÉTODO /padrao/da/<rota>" (ou só o padrão da rota) para o número
+    máximo de consultas; rotas sem entrada usam orcamento_padrao (None = sem limite).
+    Os relatórios com problemas vão para ao_reportar (padrão: print) e ficam nos
+    últimos `historico` itens de self.relatorios.
+    """
+
+    def __init__(self, app=None, orcamentos=None, orcamento_padrao=None, limiar_n1=3, ao_reportar=None, historico=100):
+        self.orcamentos = dict(orcamentos or {})
+        self.orcamento_padrao = orcamento_padrao
+        self.limiar_n1 = limiar_n1
+        self.ao_reportar = ao_reportar or self._imprimir
+        self.relatorios = deque(maxlen=historico)
+        self._lock = threading.Lock()
+        self._consultas = ContextVar('detector_consultas', default=None)
+        self._observadores = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._iniciar)
+        app.after_request(self._finalizar)
+        app.teardown_request(self._limpar)
+        app.extensions['detector_consultas'] = self
+
+    # Registro
+
+    def registrar_postgrest(self, tabela, operacao, segundos, erro, request_config):
+        """Ouvinte para metricas.instrumentar_postgrest."""
+        if self._consultas.get() is None:
+            return
+        assinatura, formato = descrever_postgrest(request_config)
+        self.registrar(tabela, operacao, assinatura, formato, segundos)
+
+    def registrar(self, tabela, operacao, assinatura, formato=None, segundos=0.0):
+        """Registra uma consulta na requisição/captura atual (no-op fora delas)."""
+        consultas = self._consultas.get()
+        if consultas is not None:
+            consultas.append(Consulta(tabela, operacao, assinatura, formato or assinatura, segundos))
+
+    @contextmanager
+    def capturar(self):
+        """Registra as consultas do bloco (fora de requisições: CLI, testes); produz a lista."""
+        consultas = []
+        token = self._consultas.set(consultas)
+        try:
+            yield consultas
+        finally:
+            self._consultas.reset(token)
+
+    # Análise
+
+    def orcamento(self, metodo, rota):
+        return self.orcamentos.get(f"{metodo} {rota}", self.orcamentos.get(rota, self.orcamento_padrao))
+
+    def analisar(self, metodo, rota, consultas, orcamento=None):
+        """Relatório (dict) de uma lista de Consulta; orcamento None usa o configurado para a rota."""
+        limite = orcamento if orcamento is not None else self.orcamento(metodo, rota)
+        repetidas = [
+            {"assinatura": assinatura, "vezes": vezes}
+            for assinatura, vezes in Counter(c.assinatura for c in consultas).items() if vezes > 1
+        ]
+        n_mais_1 = [
+            {"formato": formato, "vezes": vezes}
+            for formato, vezes in Counter(c.formato for c in consultas).items() if vezes >= self.limiar_n1
+        ]
+        excedeu = limite is not None and len(consultas) > limite
+        return {
+            "metodo": metodo,
+            "rota": rota,
+            "consultas": len(consultas),
+            "orcamento": limite,
+            "excedeu_orcamento": excedeu,
+            "repetidas": repetidas,
+            "n_mais_1": n_mais_1,
+            "tempo_backend_ms": round(sum(c.segundos for c in consultas) * 1000, 1),
+            "por_tabela": dict(Counter(f"{c.operacao} {c.tabela}" for c in consultas)),
+            "problemas": bool(excedeu or repetidas or n_mais_1)
+        }
+
+    @staticmethod
+    def verificar(relatorio):
+        """Levanta OrcamentoConsultasExcedido se o relatório tiver problemas."""
+        if relatorio["problemas"]:
+            raise OrcamentoConsultasExcedido(DetectorConsultas.formatar(relatorio))
+
+    @staticmethod
+    def formatar(relatorio):
+        linhas = [f"{relatorio['metodo']} {relatorio['rota']}: {relatorio['consultas']} consulta(s) "
+                  f"(orçamento: {relatorio['orcamento'] if relatorio['orcamento'] is not None else 'sem limite'})"]
+        for item in relatorio["repetidas"]:
+            linhas.append(f"  repetida {item['vezes']}x: {item['assinatura']}")
+        for item in relatorio["n_mais_1"]:
+            linhas.append(f"  N+1 ({item['vezes']}x): {item['formato']}")
+        return '\n'.join(linhas)
+
+    def observar(self, funcao):
+        """Registra funcao(relatorio) chamada ao fim de toda requisição analisada (ex.: plugin do pytest)."""
+        self._observadores.append(funcao)
+        return funcao
+
+    def remover_observador(self, funcao):
+        if funcao in self._observadores:
+            self._observadores.remove(funcao)
+
+    # Hooks do Flask
+
+    def _iniciar(self):
+        g._detector_consultas_token = self._consultas.set([])
+
+    def _finalizar(self, response):
+        consultas = self._consultas.get()
+        if consultas is None or '_detector_consultas_token' not in g:
+            return response
+        rota = request.url_rule.rule if request.url_rule else 'sem_rota'
+        relatorio = self.analisar(request.method, rota, consultas)
+        response.headers['X-Consultas-Backend'] = str(len(consultas))
+        for observador in list(self._observadores):
+            observador(relatorio)
+        if relatorio["problemas"]:
+            with self._lock:
+                self.relatorios.append(relatorio)
+            self.ao_reportar(relatorio)
+        return response
+
+    def _limpar(self, erro):
+        token = g.pop('_detector_consultas_token', None)
+        if token is not None:
+            self._consultas.reset(token)
+
+    @staticmethod
+    def _imprimir(relatorio):
+        print(f"[detector de consultas] {DetectorConsultas.formatar(relatorio)}")
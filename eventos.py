@@ -0,0 +1,220 @@
+"""
+Barramento de eventos das agendas: quem grava publica um evento no canal da agenda e o
+barramento o entrega a cada assinante (os streams SSE de /agendas/<id>/eventos), de modo
+que uma gravação vira um único broadcast em vez de N consultas de polling dos leitores.
+
+- BarramentoLocal: fan-out em memória, dentro do processo. Com vários workers (gunicorn)
+  cada um só entrega os eventos das gravações que ele mesmo atendeu.
+- BarramentoPostgres: o mesmo fan-out local, alimentado por LISTEN/NOTIFY do Postgres
+  (POSTGRES_DSN), de modo que um evento publicado em qualquer worker chega a todos.
+
+O evento é serializado uma única vez na publicação; os assinantes recebem o mesmo objeto.
+Cada assinatura tem uma fila limitada: o assinante que não acompanha é encerrado (em vez
+de perder eventos em silêncio) e o cliente, ao reconectar, ressincroniza pelo ?since=.
+
+Escolha por configuração: EVENTOS_BACKEND=local ou postgres; o padrão é postgres quando
+POSTGRES_DSN está definido, senão local. O gunicorn.conf.py recusa local com mais de um worker.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque, namedtuple
+
+# Com POSTGRES_DSN configurado o padrão é postgres, que funciona com qualquer número de workers
+EVENTOS_BACKEND = os.getenv('EVENTOS_BACKEND', 'postgres' if os.getenv('POSTGRES_DSN') else 'local')
+EVENTOS_FILA_MAX = int(os.getenv('EVENTOS_FILA_MAX', '256'))
+# Canal do LISTEN/NOTIFY compartilhado por todas as agendas, e o limite do payload do
+# NOTIFY (8000 bytes no Postgres): eventos maiores viram um aviso para ressincronizar
+CANAL_POSTGRES = 'agenda_eventos'
+PAYLOAD_NOTIFY_MAX = 7900
+ESCUTA_TIMEOUT = 5  # segundos
+TIPO_RESSINCRONIZAR = 'ressincronizar'
+
+# tipo e dados do evento, e dados já em JSON (o texto enviado a todos os assinantes)
+Evento = namedtuple('Evento', ['tipo', 'dados', 'json'])
+
+
+class ErroEventos(Exception):
+    """Configuração inválida do barramento (backend desconhecido, driver ausente...)."""
+
+
+def criar_evento(tipo, dados):
+    return Evento(tipo, dados, json.dumps(dados, default=str, separators=(',', ':')))
+
+
+class Assinatura:
+    """
+    Fila de eventos de um assinante de um canal. proximo(timeout) devolve o próximo evento
+    ou None se nada chegou no prazo; `ativa` fica False quando a assinatura é cancelada ou
+    descartada por não acompanhar os eventos.
+    """
+
+    def __init__(self, barramento, canal, tamanho_max):
+        self.canal = canal
+        self.ativa = True
+        self._barramento = barramento
+        self._tamanho_max = tamanho_max
+        self._eventos = deque()
+        self._condicao = threading.Condition()
+
+    def entregar(self, evento):
+        with self._condicao:
+            if not self.ativa:
+                return
+            if len(self._eventos) >= self._tamanho_max:
+                self.ativa = False
+                self._eventos.clear()
+            else:
+                self._eventos.append(evento)
+            self._condicao.notify()
+        if not self.ativa:
+            self._barramento.remover(self)
+
+    def proximo(self, timeout=None):
+        with self._condicao:
+            if not self._eventos and self.ativa:
+                self._condicao.wait(timeout)
+            return self._eventos.popleft() if self._eventos else None
+
+    def encerrar(self):
+        """Encerra a assinatura e acorda quem espera em proximo()."""
+        with self._condicao:
+            self.ativa = False
+            self._condicao.notify_all()
+
+    def cancelar(self):
+        self.encerrar()
+        self._barramento.remover(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.cancelar()
+
+
+class BarramentoLocal:
+    """Fan-out em memória: canal -> assinaturas abertas neste processo."""
+
+    def __init__(self, tamanho_fila=EVENTOS_FILA_MAX):
+        self.tamanho_fila = tamanho_fila
+        self.publicados = 0
+        self._assinaturas = {}
+        self._lock = threading.Lock()
+
+    def assinar(self, canal):
+        assinatura = Assinatura(self, canal, self.tamanho_fila)
+        with self._lock:
+            self._assinaturas.setdefault(canal, set()).add(assinatura)
+        return assinatura
+
+    def remover(self, assinatura):
+        with self._lock:
+            assinaturas = self._assinaturas.get(assinatura.canal)
+            if assinaturas is not None:
+                assinaturas.discard(assinatura)
+                if not assinaturas:
+                    del self._assinaturas[assinatura.canal]
+
+    def publicar(self, canal, tipo, dados):
+        """Entrega o evento a todos os assinantes do canal (nenhum custo sem assinantes)."""
+        self.publicados += 1
+        self.distribuir(canal, criar_evento(tipo, dados))
+
+    def distribuir(self, canal, evento):
+        with self._lock:
+            assinaturas = list(self._assinaturas.get(canal, ()))
+        for assinatura in assinaturas:
+            assinatura.entregar(evento)
+
+    def encerrar_todas(self):
+        """Encerra todas as assinaturas (os clientes reconectam e ressincronizam)."""
+        with self._lock:
+            assinaturas = [a for conjunto in self._assinaturas.values() for a in conjunto]
+            self._assinaturas.clear()
+        for assinatura in assinaturas:
+            assinatura.encerrar()
+
+    def total_assinaturas(self):
+        with self._lock:
+            return sum(len(conjunto) for conjunto in self._assinaturas.values())
+
+    def fechar(self):
+        self.encerrar_todas()
+
+
+class BarramentoPostgres(BarramentoLocal):
+    """
+    Publica com pg_notify e entrega pelo fan-out local o que chega ao LISTEN de uma
+    conexão dedicada (thread iniciada na primeira assinatura). Se essa conexão cai, as
+    assinaturas abertas são encerradas, pois os eventos do intervalo se perderam.
+    """
+
+    def __init__(self, dsn, tamanho_fila=EVENTOS_FILA_MAX):
+        try:
+            import psycopg
+            from psycopg_pool import ConnectionPool
+        except ImportError as e:
+            raise ErroEventos(
+                "EVENTOS_BACKEND=postgres requer os pacotes psycopg e psycopg_pool "
+                "(pip install 'psycopg[binary,pool]')."
+            ) from e
+        if not dsn:
+            raise ErroEventos("EVENTOS_BACKEND=postgres requer POSTGRES_DSN.")
+
+        super().__init__(tamanho_fila)
+        self.dsn = dsn
+        self._psycopg = psycopg
+        self.pool = ConnectionPool(dsn, min_size=1, max_size=4, open=True,
+                                   kwargs={'autocommit': True}, name='agenda-eventos')
+        self._thread = None
+        self._fechado = False
+
+    def assinar(self, canal):
+        assinatura = super().assinar(canal)
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._escutar, name='eventos-postgres', daemon=True)
+                self._thread.start()
+        return assinatura
+
+    def publicar(self, canal, tipo, dados):
+        self.publicados += 1
+        evento = criar_evento(tipo, dados)
+        payload = json.dumps({'canal': canal, 'tipo': tipo, 'dados': evento.json}, separators=(',', ':'))
+        if len(payload.encode('utf-8')) > PAYLOAD_NOTIFY_MAX:
+            payload = json.dumps({'canal': canal, 'tipo': TIPO_RESSINCRONIZAR, 'dados': '{}'})
+        with self.pool.connection() as conexao:
+            conexao.execute("SELECT pg_notify(%s, %s)", (CANAL_POSTGRES, payload))
+
+    def _escutar(self):
+        while not self._fechado:
+            try:
+                with self._psycopg.connect(self.dsn, autocommit=True) as conexao:
+                    conexao.execute(f"LISTEN {CANAL_POSTGRES}")
+                    while not self._fechado:
+                        # timeout (psycopg >= 3.2) para notar fechar() sem depender de eventos
+                        for notificacao in conexao.notifies(timeout=ESCUTA_TIMEOUT):
+                            mensagem = json.loads(notificacao.payload)
+                            self.distribuir(mensagem['canal'], Evento(mensagem['tipo'], json.loads(mensagem['dados']), mensagem['dados']))
+            except Exception as e:
+                print(f"Erro na escuta de eventos do Postgres: {str(e)}")
+            self.encerrar_todas()
+            if not self._fechado:
+                time.sleep(1)
+
+    def fechar(self):
+        self._fechado = True
+        self.pool.close()
+        super().fechar()
+
+
+def criar_barramento():
+    """Barramento conforme o ambiente (EVENTOS_BACKEND)."""
+    if EVENTOS_BACKEND == 'local':
+        return BarramentoLocal()
+    if EVENTOS_BACKEND != 'postgres':
+        raise ErroEventos(f"EVENTOS_BACKEND desconhecido: {EVENTOS_BACKEND} (use local ou postgres).")
+    from repositorio import POSTGRES_DSN
+    return BarramentoPostgres(POSTGRES_DSN)
@@ -0,0 +1,31 @@
+import os
+
+from dotenv import load_dotenv
+
+# Mesmo .env que o app lê, para que as checagens abaixo vejam a configuração dele
+load_dotenv()
+
+# O estado de autenticação do cliente Supabase compartilhado não muda entre requisições
+# (login/logout usam clientes descartáveis), então o paralelismo vem das threads. Os caches
+# em memória (cache.py) são por processo e só veem as escritas do próprio worker: por isso
+# o padrão é um worker. Com WEB_CONCURRENCY > 1, um worker pode servir dados anteriores às
+# escritas de outro por até o TTL de cada cache.
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_CONCURRENCY', '1'))
+# Cada stream SSE (/agendas/<id>/eventos) prende uma thread enquanto está aberto: as threads
+# reservadas a eles (EVENTOS_MAX_CONEXOES, limite aplicado pelo app) somam-se às das requisições.
+threads = int(os.getenv('GUNICORN_THREADS', '4')) + int(os.getenv('EVENTOS_MAX_CONEXOES', '8'))
+worker_class = 'gthread'
+keepalive = 5
+
+
+def on_starting(server):
+    # O barramento local de eventos só entrega no próprio processo: com vários workers, os
+    # streams SSE perderiam as escritas feitas nos outros (use EVENTOS_BACKEND=postgres)
+    from eventos import EVENTOS_BACKEND
+
+    if server.cfg.workers > 1 and EVENTOS_BACKEND == 'local':
+        raise SystemExit(
+            f"EVENTOS_BACKEND=local não funciona com {server.cfg.workers} workers: "
+            "use EVENTOS_BACKEND=postgres (com POSTGRES_DSN) ou WEB_CONCURRENCY=1."
+        )
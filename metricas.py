@@ -0,0 +1,218 @@
+import bisect
+import functools
+import json
+import threading
+import time
+
+# Buckets padrão (segundos), os mesmos do cliente oficial do Prometheus
+BUCKETS_PADRAO = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _formatar_rotulos(nomes, valores, extra=None):
+    pares = [f'{nome}="{_escapar(valor)}"' for nome, valor in zip(nomes, valores)]
+    if extra:
+        pares.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+def _formatar_numero(valor):
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Contador:
+    """Contador monotônico com rótulos."""
+
+    tipo = 'counter'
+
+    def __init__(self, nome, descricao, rotulos=()):
+        self.nome = nome
+        self.descricao = descricao
+        self.rotulos = tuple(rotulos)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *valores_rotulos, quantidade=1):
+        with self._lock:
+            self._valores[valores_rotulos] = self._valores.get(valores_rotulos, 0) + quantidade
+
+    def valor(self, *valores_rotulos):
+        with self._lock:
+            return self._valores.get(valores_rotulos, 0)
+
+    def linhas(self):
+        with self._lock:
+            valores = list(self._valores.items())
+        for valores_rotulos, valor in sorted(valores):
+            yield f"{self.nome}{_formatar_rotulos(self.rotulos, valores_rotulos)} {_formatar_numero(valor)}"
+
+
+class Histograma:
+    """Histograma com buckets fixos e rótulos; observar() é O(log #buckets)."""
+
+    tipo = 'histogram'
+
+    def __init__(self, nome, descricao, rotulos=(), buckets=BUCKETS_PADRAO):
+        self.nome = nome
+        self.descricao = descricao
+        self.rotulos = tuple(rotulos)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # valores dos rótulos -> [contagens por bucket (+Inf no fim), soma]
+        self._lock = threading.Lock()
+
+    def observar(self, valor, *valores_rotulos):
+        indice = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(valores_rotulos)
+            if serie is None:
+                serie = self._series[valores_rotulos] = [[0] * (len(self.buckets) + 1), 0.0]
+            serie[0][indice] += 1
+            serie[1] += valor
+
+    def contagem(self, *valores_rotulos):
+        with self._lock:
+            serie = self._series.get(valores_rotulos)
+            return sum(serie[0]) if serie else 0
+
+    def linhas(self):
+        with self._lock:
+            series = [(valores_rotulos, list(contagens), soma) for valores_rotulos, (contagens, soma) in self._series.items()]
+        for valores_rotulos, contagens, soma in sorted(series):
+            acumulado = 0
+            for limite, contagem in zip(self.buckets + (float('inf'),), contagens):
+                acumulado += contagem
+                yield f"{self.nome}_bucket{_formatar_rotulos(self.rotulos, valores_rotulos, ('le', _formatar_numero(limite)))} {acumulado}"
+            yield f"{self.nome}_sum{_formatar_rotulos(self.rotulos, valores_rotulos)} {_formatar_numero(soma)}"
+            yield f"{self.nome}_count{_formatar_rotulos(self.rotulos, valores_rotulos)} {acumulado}"
+
+
+class Registro:
+    """
+    Conjunto de métricas de um processo, exportado no formato texto do Prometheus.
+    Cada processo (worker) tem o seu próprio; o Prometheus agrega por instância.
+    """
+
+    def __init__(self):
+        self._metricas = []
+        self._coletores = []
+
+    def contador(self, nome, descricao, rotulos=()):
+        metrica = Contador(nome, descricao, rotulos)
+        self._metricas.append(metrica)
+        return metrica
+
+    def histograma(self, nome, descricao, rotulos=(), buckets=BUCKETS_PADRAO):
+        metrica = Histograma(nome, descricao, rotulos, buckets)
+        self._metricas.append(metrica)
+        return metrica
+
+    def coletor(self, funcao):
+        """Registra funcao() -> [(nome, tipo, descricao, [(rotulos_dict, valor)])], chamada a cada exportação."""
+        self._coletores.append(funcao)
+        return funcao
+
+    def exportar(self):
+        linhas = []
+        for metrica in self._metricas:
+            linhas.append(f"# HELP {metrica.nome} {metrica.descricao}")
+            linhas.append(f"# TYPE {metrica.nome} {metrica.tipo}")
+            linhas.extend(metrica.linhas())
+        for coletor in self._coletores:
+            for nome, tipo, descricao, amostras in coletor():
+                linhas.append(f"# HELP {nome} {descricao}")
+                linhas.append(f"# TYPE {nome} {tipo}")
+                for rotulos, valor in amostras:
+                    linhas.append(f"{nome}{_formatar_rotulos(rotulos.keys(), rotulos.values())} {_formatar_numero(valor)}")
+        return '\n'.join(linhas) + '\n'
+
+
+def _operacao_postgrest(request_config):
+    """(tabela, operação) de uma requisição do postgrest-py, a partir do caminho e do método HTTP."""
+    partes = str(request_config.path).rstrip('/').split('/')
+    if len(partes) >= 2 and partes[-2] == 'rpc':
+        return partes[-1], 'rpc'
+    metodo = request_config.http_method
+    if metodo == 'POST':
+        preferencias = request_config.headers.get('Prefer', '') or ''
+        return partes[-1], 'upsert' if 'resolution=' in preferencias else 'insert'
+    return partes[-1], {'GET': 'select', 'HEAD': 'select', 'PATCH': 'update', 'DELETE': 'delete'}.get(metodo, metodo.lower())
+
+
+def descrever_postgrest(request_config):
+    """
+    (assinatura, formato) de uma requisição do postgrest-py: a assinatura identifica a
+    consulta exata (método, caminho, parâmetros e corpo); o formato troca os valores dos
+    filtros por "?" e agrupa consultas de mesmo formato (o padrão N+1).
+    """
+    caminho = request_config.path.path if hasattr(request_config.path, 'path') else str(request_config.path)
+    parametros = sorted(request_config.params.multi_items())
+    corpo = '' if request_config.json in (None, {}) else json.dumps(request_config.json, sort_keys=True, default=str)
+    assinatura = f"{request_config.http_method} {caminho}?{'&'.join(f'{k}={v}' for k, v in parametros)} {corpo}".rstrip()
+    formato_parametros = [
+        f"{chave}={valor}" if chave in ('select', 'order', 'limit', 'offset', 'on_conflict', 'columns')
+        else f"{chave}={valor.split('.', 1)[0]}.?"
+        for chave, valor in parametros
+    ]
+    formato = f"{request_config.http_method} {caminho}?{'&'.join(formato_parametros)}"
+    return assinatura, formato
+
+
+# Funções chamadas após cada execute() instrumentado
+_ouvintes = []
+
+
+def instrumentar_postgrest(ao_executar):
+    """
+    Envolve (uma única vez) o execute() dos request builders síncronos do postgrest-py,
+    usados pelo cliente Supabase, e registra ao_executar como ouvinte: após cada chamada
+    ele recebe (tabela, operacao, segundos, erro, request_config), com erro sendo a
+    exceção levantada ou None.
+
+    postgrest._sync.request_builder é interno ao postgrest-py; a versão está fixada em
+    requirements.txt e, se nenhuma das classes esperadas existir, a falha é explícita.
+    """
+    from postgrest._sync import request_builder
+
+    if ao_executar not in _ouvintes:
+        _ouvintes.append(ao_executar)
+
+    encontradas = 0
+    for nome_classe in ('SyncQueryRequestBuilder', 'SyncSingleRequestBuilder',
+                        'SyncMaybeSingleRequestBuilder', 'SyncExplainRequestBuilder'):
+        classe = getattr(request_builder, nome_classe, None)
+        if classe is None:
+            continue
+        encontradas += 1
+        if getattr(classe.execute, '_instrumentado', False):
+            continue
+
+        def envolver(execute_original):
+            @functools.wraps(execute_original)
+            def execute(self, *args, **kwargs):
+                inicio = time.perf_counter()
+                erro = None
+                try:
+                    return execute_original(self, *args, **kwargs)
+                except Exception as e:
+                    erro = e
+                    raise
+                finally:
+                    segundos = time.perf_counter() - inicio
+                    try:
+                        tabela, operacao = _operacao_postgrest(self.request)
+                    except Exception:
+                        tabela, operacao = 'desconhecida', 'desconhecida'
+                    for ouvinte in list(_ouvintes):
+                        ouvinte(tabela, operacao, segundos, erro, self.request)
+            execute._instrumentado = True
+            return execute
+
+        classe.execute = envolver(classe.execute)
+
+    if not encontradas:
+        raise RuntimeError("postgrest-py sem os request builders esperados: instale a versão de requirements.txt.")
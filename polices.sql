@@ -202,6 +202,28 @@ CREATE POLICY "Donos podem atualizar permissões concedidas" ON agenda_permissoe
 CREATE POLICY "Donos podem revogar permissões concedidas" ON agenda_permissoes
     FOR DELETE USING (auth.uid() = usuario_concedeu_id);
 
+-- =========================================
+-- POLÍTICAS PARA A TABELA 'registros_excluidos'
+-- =========================================
+-- Só leitura: as exclusões são registradas pelo gatilho versionar_registro (schema.sql)
+
+-- Política para SELECT (locais do próprio usuário; agendas próprias ou compartilhadas)
+CREATE POLICY "Usuários podem ver as exclusões de seus dados" ON registros_excluidos
+    FOR SELECT USING (
+        auth.uid() = usuario_id
+        OR EXISTS (
+            SELECT 1 FROM agendas
+            WHERE agendas.id_agenda = registros_excluidos.agenda_id
+            AND agendas.usuario_id = auth.uid()
+        )
+        OR EXISTS (
+            SELECT 1 FROM agenda_permissoes
+            WHERE agenda_permissoes.agenda_id = registros_excluidos.agenda_id
+            AND agenda_permissoes.usuario_recebeu_id = auth.uid()
+            AND agenda_permissoes.status = 'ativo'
+        )
+    );
+
 -- =========================================
 -- POLÍTICA ESPECIAL PARA VISUALIZAÇÃO PÚBLICA
 -- =========================================
@@ -0,0 +1,116 @@
+import json
+import os
+import tempfile
+import threading
+
+
+class PublicadorEstatico:
+    """
+    Mantém snapshots estáticos (HTML + JSON) das agendas públicas em um diretório,
+    para que o tráfego público seja servido como arquivos (CDN/servidor estático)
+    sem passar pelo Flask nem pelo Supabase.
+
+    Layout gerado, espelhando as rotas da aplicação:
+        public/agenda/<link_publico_id>/index.html
+        api/public/agenda/<link_publico_id>.json
+        manifesto.json  (agenda_id -> link_publico_id publicado)
+
+    resolver(tarefa) devolve pares (agenda_id, link_publico_id) afetados pela tarefa
+    (link None quando a agenda não existe mais); gerar(link_publico_id) devolve
+    (html, json) ou None se o link não existe mais.
+    """
+
+    def __init__(self, diretorio, resolver, gerar):
+        self.diretorio = diretorio
+        self._resolver = resolver
+        self._gerar = gerar
+        self._lock = threading.Lock()
+        self._pendentes = {}
+        self._condicao = threading.Condition()
+        self._thread = None
+        self._caminho_manifesto = os.path.join(diretorio, 'manifesto.json')
+        self._manifesto = self._ler_manifesto()
+
+    def agendar(self, tarefa):
+        """Enfileira uma tarefa para a thread de publicação (tarefas repetidas são agrupadas)."""
+        with self._condicao:
+            self._pendentes[tarefa] = None
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._executar, name='publicador-agendas', daemon=True)
+                self._thread.start()
+            self._condicao.notify()
+
+    def _executar(self):
+        while True:
+            with self._condicao:
+                while not self._pendentes:
+                    self._condicao.wait()
+                tarefas = list(self._pendentes)
+                self._pendentes.clear()
+            for tarefa in tarefas:
+                try:
+                    self.processar(tarefa)
+                except Exception as e:
+                    print(f"Erro ao publicar snapshot estático ({tarefa}): {str(e)}")
+
+    def processar(self, tarefa):
+        """Executa uma tarefa de forma síncrona."""
+        for agenda_id, link_publico_id in self._resolver(tarefa):
+            self.publicar(agenda_id, link_publico_id)
+
+    def publicar(self, agenda_id, link_publico_id):
+        """Regrava (ou remove) os arquivos de uma agenda. Retorna True se algo foi escrito."""
+        agenda_id = str(agenda_id)
+        conteudo = self._gerar(link_publico_id) if link_publico_id else None
+        with self._lock:
+            link_anterior = self._manifesto.get(agenda_id)
+            if link_anterior and link_anterior != link_publico_id:
+                self._remover_arquivos(link_anterior)
+
+            if conteudo is None:
+                if link_publico_id:
+                    self._remover_arquivos(link_publico_id)
+                self._manifesto.pop(agenda_id, None)
+            else:
+                html, dados_json = conteudo
+                self._escrever(self._caminho_html(link_publico_id), html)
+                self._escrever(self._caminho_json(link_publico_id), dados_json)
+                self._manifesto[agenda_id] = str(link_publico_id)
+            self._escrever(self._caminho_manifesto, json.dumps(self._manifesto, indent=2, sort_keys=True))
+        return conteudo is not None
+
+    def remover_ausentes(self, agenda_ids_existentes):
+        """Remove snapshots de agendas que não estão em agenda_ids_existentes."""
+        existentes = {str(agenda_id) for agenda_id in agenda_ids_existentes}
+        with self._lock:
+            for agenda_id in [agenda_id for agenda_id in self._manifesto if agenda_id not in existentes]:
+                self._remover_arquivos(self._manifesto.pop(agenda_id))
+            self._escrever(self._caminho_manifesto, json.dumps(self._manifesto, indent=2, sort_keys=True))
+
+    def _caminho_html(self, link_publico_id):
+        return os.path.join(self.diretorio, 'public', 'agenda', str(link_publico_id), 'index.html')
+
+    def _caminho_json(self, link_publico_id):
+        return os.path.join(self.diretorio, 'api', 'public', 'agenda', f"{link_publico_id}.json")
+
+    def _remover_arquivos(self, link_publico_id):
+        for caminho in (self._caminho_html(link_publico_id), self._caminho_json(link_publico_id)):
+            if os.path.exists(caminho):
+                os.remove(caminho)
+
+    def _ler_manifesto(self):
+        try:
+            with open(self._caminho_manifesto, encoding='utf-8') as arquivo:
+                return json.load(arquivo)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _escrever(caminho, conteudo):
+        # Escrita atômica: o servidor estático nunca vê um arquivo pela metade
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        descritor, temporario = tempfile.mkstemp(dir=os.path.dirname(caminho), suffix='.tmp')
+        with os.fdopen(descritor, 'w', encoding='utf-8') as arquivo:
+            arquivo.write(conteudo)
+        os.chmod(temporario, 0o644)
+        os.replace(temporario, caminho)
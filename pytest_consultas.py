@@ -0,0 +1,94 @@
+"""
+Plugin do pytest para orçamentos de consultas ao backend (ver detector_consultas.py).
+
+Ativação, no conftest.py:
+
+    pytest_plugins = ['pytest_consultas']
+
+O plugin liga o detector (DETECTOR_CONSULTAS=1) antes de o app ser importado e oferece:
+
+- fixture `orcamento_consultas(maximo=None, permitir_repeticoes=False)`: context manager
+  que falha o teste se alguma requisição do bloco passar do orçamento (maximo, ou o
+  orçamento configurado para a rota quando None) ou repetir consultas / fizer N+1:
+
+      def test_criar_compromisso(client, orcamento_consultas):
+          with orcamento_consultas(5):
+              client.post('/agendas/A/compromissos', json={...})
+
+- marcador `@pytest.mark.orcamento_consultas(maximo=None, permitir_repeticoes=False)`:
+  aplica a mesma verificação a todas as requisições do teste;
+- opção `--orcamento-consultas`: aplica a verificação (orçamentos por rota) a todos os testes.
+
+A fixture `detector_consultas` devolve o detector do app (app.extensions); sobrescreva-a
+no conftest.py para usar outro app.
+"""
+import os
+from contextlib import contextmanager
+
+import pytest
+
+from detector_consultas import DetectorConsultas
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        '--orcamento-consultas', action='store_true', default=False,
+        help='Falha testes cujas requisições passem do orçamento de consultas da rota ou façam N+1.'
+    )
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        'markers',
+        'orcamento_consultas(maximo=None, permitir_repeticoes=False): verifica o orçamento de consultas das requisições do teste'
+    )
+    os.environ.setdefault('DETECTOR_CONSULTAS', '1')
+
+
+def _problemas(relatorio, maximo, permitir_repeticoes):
+    limite = relatorio['orcamento'] if maximo is None else maximo
+    excedeu = limite is not None and relatorio['consultas'] > limite
+    repetiu = not permitir_repeticoes and bool(relatorio['repetidas'] or relatorio['n_mais_1'])
+    if not (excedeu or repetiu):
+        return None
+    return DetectorConsultas.formatar({**relatorio, 'orcamento': limite})
+
+
+@contextmanager
+def _verificando(detector, maximo=None, permitir_repeticoes=False):
+    relatorios = []
+    observador = detector.observar(relatorios.append)
+    try:
+        yield relatorios
+    finally:
+        detector.remover_observador(observador)
+    falhas = [problema for problema in (_problemas(r, maximo, permitir_repeticoes) for r in relatorios) if problema]
+    if falhas:
+        pytest.fail("Orçamento de consultas violado:\n" + '\n'.join(falhas), pytrace=False)
+
+
+@pytest.fixture
+def detector_consultas():
+    from app import app
+    detector = app.extensions.get('detector_consultas')
+    if detector is None:
+        pytest.skip('Detector de consultas desativado (DETECTOR_CONSULTAS=0).')
+    return detector
+
+
+@pytest.fixture
+def orcamento_consultas(detector_consultas):
+    def verificar(maximo=None, permitir_repeticoes=False):
+        return _verificando(detector_consultas, maximo, permitir_repeticoes)
+    return verificar
+
+
+@pytest.fixture(autouse=True)
+def _orcamento_consultas_do_teste(request):
+    marcador = request.node.get_closest_marker('orcamento_consultas')
+    if marcador is None and not request.config.getoption('--orcamento-consultas'):
+        yield
+        return
+    detector = request.getfixturevalue('detector_consultas')
+    with _verificando(detector, **(marcador.kwargs if marcador else {})):
+        yield
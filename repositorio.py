@@ -0,0 +1,724 @@
+"""
+Repositório de dados do app: as leituras (e as alterações com posse verificada) que o
+app.py faz sobre as tabelas do schema.sql, atrás de uma interface com dois backends
+intercambiáveis.
+
+- RepositorioSupabase: o caminho atual, PostgREST via supabase-py (HTTP + JSON). Respeita
+  RLS quando recebe o cliente do usuário. Alterações nas tabelas filhas da agenda usam a
+  função alterar_da_agenda do schema.sql (precisa estar criada no banco).
+- RepositorioPostgres: conexão direta ao Postgres por um pool (psycopg 3 + psycopg_pool),
+  com joins em SQL, várias consultas em uma só ida ao banco (pipeline) e prepared
+  statements. Conecta com um papel do banco, portanto NÃO passa pelo RLS: as verificações
+  de dono/permissão do app (_obter_acesso_agenda etc.) continuam valendo.
+
+Os dois backends devolvem os mesmos formatos que o PostgREST (uuid, date e time como
+texto, numeric como float, jsonb decodificado), de modo que o app não distingue um do outro.
+
+Escolha por configuração: REPOSITORIO_BACKEND=supabase (padrão) ou postgres, com
+POSTGRES_DSN apontando para o banco (ex.: a connection string do Supabase ou um Postgres
+local criado com schema_local.sql).
+"""
+import datetime
+import decimal
+import os
+import threading
+import time
+import uuid
+
+REPOSITORIO_BACKEND = os.getenv('REPOSITORIO_BACKEND', 'supabase')
+POSTGRES_DSN = os.getenv('POSTGRES_DSN')
+POSTGRES_POOL_MIN = int(os.getenv('POSTGRES_POOL_MIN', '1'))
+POSTGRES_POOL_MAX = int(os.getenv('POSTGRES_POOL_MAX', '10'))
+# Prepara cada consulta na primeira execução (os textos SQL são fixos). Use "none" atrás
+# de um pooler em modo transação (pgbouncer / porta 6543 do Supabase), que não os suporta.
+POSTGRES_PREPARE_THRESHOLD = os.getenv('POSTGRES_PREPARE_THRESHOLD', '0')
+
+# Colunas públicas de cada tabela do schema.sql, a chave primária primeiro (também servem
+# de lista branca para o SQL)
+COLUNAS = {
+    'usuarios': ('id_usuario', 'cpf', 'nome', 'email', 'data_criacao', 'versao_locais', 'updated_at_locais'),
+    'locais_trabalho': ('id_local', 'usuario_id', 'nome', 'cor', 'acrescimo_ha_percent', 'periodo_carencia', 'relacionado_com',
+                        'versao', 'updated_at'),
+    'agendas': ('id_agenda', 'usuario_id', 'nome', 'data_inicio', 'data_fim', 'link_publico_id', 'dias_semana',
+                'hora_inicio_padrao', 'hora_fim_padrao', 'versao', 'updated_at'),
+    'agenda_locais_config': ('id_agenda_local', 'agenda_id', 'local_id', 'valor_hora', 'versao', 'updated_at'),
+    'compromissos': ('id_compromisso', 'agenda_id', 'local_id', 'dia_semana', 'hora_inicio', 'hora_fim', 'duracao',
+                     'descricao', 'tipo_hora', 'versao', 'updated_at'),
+    'agenda_permissoes': ('id_permissao', 'agenda_id', 'usuario_concedeu_id', 'usuario_recebeu_id', 'data_concessao', 'status'),
+    'configuracoes_usuario': ('id_configuracao', 'usuario_id', 'dias_semana', 'hora_inicio_padrao', 'hora_fim_padrao'),
+}
+
+# Tabelas sem coluna de dono: pertencem ao dono da agenda (agendas.usuario_id)
+POSSE_PELA_AGENDA = ('compromissos', 'agenda_locais_config', 'agenda_permissoes')
+
+# Sincronização incremental (schema.sql): tabela com versao e updated_at -> (tabela do
+# contador, chave, contador, coluna da linha que aponta para o dono do contador)
+SINCRONIZACAO = {
+    'compromissos': ('agendas', 'id_agenda', 'versao', 'agenda_id'),
+    'agenda_locais_config': ('agendas', 'id_agenda', 'versao', 'agenda_id'),
+    'locais_trabalho': ('usuarios', 'id_usuario', 'versao_locais', 'usuario_id'),
+}
+# Coluna do dono com o momento da última mudança do contador (em agendas, também de
+# qualquer alteração da própria agenda)
+ATUALIZACAO_DO_CONTADOR = {'agendas': 'updated_at', 'usuarios': 'updated_at_locais'}
+
+# Projeções usadas pelo app (mesmas colunas nos dois backends)
+COLUNAS_LOCAL_VALIDACAO = 'id_local, nome, cor, acrescimo_ha_percent, periodo_carencia, relacionado_com, usuario_id'
+COLUNAS_COMPROMISSO_VALIDACAO = 'id_compromisso, local_id, dia_semana, hora_inicio, hora_fim, duracao'
+COLUNAS_LOCAL_RELATORIO = 'id_local, nome, acrescimo_ha_percent, relacionado_com, versao'
+COLUNAS_COMPROMISSO_RELATORIO = 'local_id, dia_semana, tipo_hora, duracao, versao'
+COLUNAS_CONFIG_RELATORIO = 'local_id, valor_hora, versao'
+COLUNAS_AGENDA_PUBLICA = 'id_agenda, nome, dias_semana, hora_inicio_padrao, hora_fim_padrao, usuario_id'
+COLUNAS_COMPROMISSO_PUBLICO = 'dia_semana, hora_inicio, hora_fim, descricao, local_id, duracao'
+COLUNAS_AGENDA_CALENDARIO = 'id_agenda, nome, data_inicio, data_fim, versao'
+# Campos da agenda de que dependem as visões derivadas dela (feed iCalendar, agenda pública)
+COLUNAS_AGENDA_VERSAO = ('id_agenda, usuario_id, nome, data_inicio, data_fim, dias_semana, hora_inicio_padrao, hora_fim_padrao,'
+                         ' versao, updated_at')
+
+
+class ErroRepositorio(Exception):
+    """Configuração inválida do repositório (backend desconhecido, driver ausente...)."""
+
+
+def _colunas(tabela, colunas):
+    """Valida a projeção contra COLUNAS e devolve a lista de nomes."""
+    if colunas == '*':
+        return list(COLUNAS[tabela])
+    nomes = [coluna.strip() for coluna in colunas.split(',')]
+    desconhecidas = [nome for nome in nomes if nome not in COLUNAS[tabela]]
+    if desconhecidas:
+        raise ErroRepositorio(f"Colunas desconhecidas em {tabela}: {', '.join(desconhecidas)}")
+    return nomes
+
+
+def _ordenar_agendas(agendas):
+    """Ordem da lista de agendas do app: data_inicio decrescente, empates por id_agenda."""
+    return sorted(sorted(agendas, key=lambda agenda: agenda['id_agenda']), key=lambda agenda: agenda['data_inicio'], reverse=True)
+
+
+def _filtros_de_posse(tabela, dono_id, filtros):
+    """
+    Filtros de uma alteração com posse: usuario_id = dono_id nas tabelas com dono próprio;
+    nas de POSSE_PELA_AGENDA o filtro agenda_id é obrigatório (a posse é a da agenda).
+    """
+    if tabela in POSSE_PELA_AGENDA:
+        if 'agenda_id' not in filtros:
+            raise ErroRepositorio(f"Alterações em {tabela} exigem o filtro agenda_id.")
+        return dict(filtros)
+    return {**filtros, 'usuario_id': dono_id}
+
+
+class Repositorio:
+    """
+    Interface comum. Cada método devolve linhas como dicts (ou None quando não há
+    linha); os métodos compostos buscam tudo o que uma rota precisa de uma só vez.
+    `consultas` conta as consultas enviadas ao banco; consultas_da_thread() conta só as
+    da thread atual, para medir uma operação num repositório compartilhado.
+    """
+
+    def __init__(self):
+        self.consultas = 0
+        self._consultas_lock = threading.Lock()
+        self._consultas_thread = threading.local()
+
+    def _contar(self, quantidade):
+        with self._consultas_lock:
+            self.consultas += quantidade
+        self._consultas_thread.total = self.consultas_da_thread() + quantidade
+
+    def consultas_da_thread(self):
+        return getattr(self._consultas_thread, 'total', 0)
+
+    def listar(self, tabela, colunas='*', ordem=None, **filtros):
+        """Linhas de `tabela` com colunas = valor para cada filtro, opcionalmente ordenadas."""
+        raise NotImplementedError
+
+    def obter(self, tabela, colunas='*', **filtros):
+        """A linha que casa com os filtros, ou None."""
+        raise NotImplementedError
+
+    def acesso_agenda(self, agenda_id, usuario_id):
+        """(proprietario_id, pode_escrever) se o usuário é dono ou tem permissão ativa; senão None."""
+        raise NotImplementedError
+
+    def dados_validacao(self, agenda_id, usuario_id):
+        """(compromissos da agenda, locais do usuário) para _ValidationSnapshot."""
+        raise NotImplementedError
+
+    def dados_relatorio(self, agenda_id, usuario_id):
+        """(configurações valor/hora, locais do dono, compromissos) para os relatórios."""
+        raise NotImplementedError
+
+    def agenda_publica(self, link_publico_id):
+        """
+        (agenda, compromissos públicos, locais do dono) pelo link público, ou None. A agenda
+        traz também versao e o versao_locais do dono, lidos antes dos compromissos e locais.
+        """
+        raise NotImplementedError
+
+    def locais_config_com_local(self, agenda_id):
+        """Configurações da agenda com o local embutido: {..., 'locais_trabalho': {nome, cor}}."""
+        raise NotImplementedError
+
+    def calendario(self, agenda_id, dias_semana=None):
+        """
+        (agenda com COLUNAS_AGENDA_CALENDARIO, compromissos) para expandir a semana-modelo
+        em datas, ou None se a agenda não existe. Com dias_semana, só os desses dias.
+        """
+        raise NotImplementedError
+
+    def versao_agenda(self, agenda_id=None, link_publico_id=None):
+        """
+        Só o que identifica uma versão das visões derivadas da agenda (pelo id ou pelo link
+        público): COLUNAS_AGENDA_VERSAO e o versao_locais e updated_at_locais do dono; None
+        se a agenda não existe.
+        """
+        raise NotImplementedError
+
+    def relatorio_consolidado(self, usuario_id):
+        """Linhas da função relatorio_consolidado do schema.sql."""
+        raise NotImplementedError
+
+    def dados_iniciais(self, usuario_id, agenda_id=None):
+        """
+        Carga inicial do painel: {'agendas' (do usuário, data_inicio decrescente), 'locais',
+        'configuracoes' (ou None), 'agenda_id', 'compromissos', 'locais_config' (como
+        locais_config_com_local), 'versao_agenda', 'versao_locais' (contadores de
+        SINCRONIZACAO)}. Sem agenda_id, usa a primeira das agendas; a verificação de acesso a
+        agenda_id é do chamador.
+        """
+        raise NotImplementedError
+
+    def alteracoes(self, tabela, dono_id, desde=None):
+        """
+        Linhas de uma tabela de SINCRONIZACAO do dono do contador (a agenda ou o usuário):
+        {'versao' (atual do contador), 'linhas', 'excluidos' (ids)}. Com desde, só as linhas
+        e exclusões de versão maior que ele; None se o dono não existe. agenda_locais_config
+        vem com o local embutido, como locais_config_com_local.
+        """
+        raise NotImplementedError
+
+    def atualizar(self, tabela, valores, dono_id, **filtros):
+        """
+        Atualiza, em um único comando, as linhas que casam com os filtros e pertencem a
+        dono_id; devolve as linhas atualizadas (vazia: inexistente ou de outro dono).
+        """
+        raise NotImplementedError
+
+    def excluir(self, tabela, dono_id, **filtros):
+        """
+        Como atualizar, mas exclui; devolve as linhas excluídas. Nas tabelas de
+        SINCRONIZACAO cada linha traz também versao_exclusao, a versão da lápide (None se o
+        dono do contador não existe mais), para encadear a exclusão como as outras alterações.
+        """
+        raise NotImplementedError
+
+    def validar_compromisso(self, agenda_id, usuario_id, dados, id_compromisso=None):
+        """
+        Resultado da função validar_compromisso do schema.sql: valida e grava (insere, ou
+        atualiza id_compromisso) numa transação. {'sucesso': True, 'compromisso', 'anterior'}
+        ou {'sucesso': False, 'violacao': {'codigo', ...}}.
+        """
+        raise NotImplementedError
+
+
+class RepositorioSupabase(Repositorio):
+    """
+    Backend PostgREST. executar_concorrente(*consultas) recebe query builders e devolve as
+    respostas em ordem (o app passa o seu _execute_concurrently); o padrão é sequencial.
+    """
+
+    def __init__(self, cliente, executar_concorrente=None):
+        super().__init__()
+        self.cliente = cliente
+        self._executar_concorrente = executar_concorrente or (lambda *consultas: [consulta.execute() for consulta in consultas])
+
+    def _executar(self, *consultas):
+        """Envia os query builders (juntos, se possível) e devolve as respostas em ordem."""
+        self._contar(len(consultas))
+        return self._executar_concorrente(*consultas)
+
+    def _consulta(self, tabela, colunas, filtros):
+        consulta = self.cliente.table(tabela).select(', '.join(_colunas(tabela, colunas)))
+        for coluna, valor in filtros.items():
+            consulta = consulta.eq(coluna, valor)
+        return consulta
+
+    def _dados(self, *consultas):
+        return [resposta.data if resposta and resposta.data else [] for resposta in self._executar(*consultas)]
+
+    def listar(self, tabela, colunas='*', ordem=None, **filtros):
+        consulta = self._consulta(tabela, colunas, filtros)
+        if ordem:
+            consulta = consulta.order(ordem, desc=False)
+        return self._dados(consulta)[0]
+
+    def obter(self, tabela, colunas='*', **filtros):
+        resposta = self._executar(self._consulta(tabela, colunas, filtros).maybe_single())[0]
+        return resposta.data if resposta and resposta.data else None
+
+    def acesso_agenda(self, agenda_id, usuario_id):
+        agenda = self.obter('agendas', 'usuario_id', id_agenda=agenda_id)
+        if not agenda:
+            return None
+        if agenda['usuario_id'] == usuario_id:
+            return usuario_id, True
+        permissao = self.listar('agenda_permissoes', 'id_permissao', agenda_id=agenda_id,
+                                usuario_recebeu_id=usuario_id, status='ativo')
+        return (agenda['usuario_id'], False) if permissao else None
+
+    def dados_validacao(self, agenda_id, usuario_id):
+        return self._dados(
+            self._consulta('compromissos', COLUNAS_COMPROMISSO_VALIDACAO, {'agenda_id': agenda_id}),
+            self._consulta('locais_trabalho', COLUNAS_LOCAL_VALIDACAO, {'usuario_id': usuario_id})
+        )
+
+    def dados_relatorio(self, agenda_id, usuario_id):
+        return self._dados(
+            self._consulta('agenda_locais_config', COLUNAS_CONFIG_RELATORIO, {'agenda_id': agenda_id}),
+            self._consulta('locais_trabalho', COLUNAS_LOCAL_RELATORIO, {'usuario_id': usuario_id}),
+            self._consulta('compromissos', COLUNAS_COMPROMISSO_RELATORIO, {'agenda_id': agenda_id})
+        )
+
+    @staticmethod
+    def _com_versao_locais(agenda):
+        """A agenda com o embed usuarios(versao_locais[, ...]) trocado pelas colunas dele."""
+        agenda = dict(agenda)
+        agenda.update({'versao_locais': None, **(agenda.pop('usuarios', None) or {})})
+        return agenda
+
+    def agenda_publica(self, link_publico_id):
+        agendas = self._dados(self.cliente.table('agendas').select(
+            f"{COLUNAS_AGENDA_PUBLICA}, versao, usuarios(versao_locais)"
+        ).eq('link_publico_id', link_publico_id))[0]
+        if not agendas:
+            return None
+        agenda = self._com_versao_locais(agendas[0])
+        compromissos, locais = self._dados(
+            self._consulta('compromissos', COLUNAS_COMPROMISSO_PUBLICO, {'agenda_id': agenda['id_agenda']}),
+            self._consulta('locais_trabalho', 'id_local, nome, cor', {'usuario_id': agenda['usuario_id']})
+        )
+        return agenda, compromissos, locais
+
+    def locais_config_com_local(self, agenda_id):
+        consulta = self.cliente.table('agenda_locais_config').select(
+            f"{', '.join(COLUNAS['agenda_locais_config'])}, locais_trabalho(nome, cor)"
+        ).eq('agenda_id', agenda_id)
+        return self._dados(consulta)[0]
+
+    def calendario(self, agenda_id, dias_semana=None):
+        # Uma consulta: a agenda com os compromissos embutidos
+        consulta = self.cliente.table('agendas').select(
+            f"{COLUNAS_AGENDA_CALENDARIO}, compromissos({', '.join(COLUNAS['compromissos'])})"
+        ).eq('id_agenda', agenda_id)
+        if dias_semana is not None:
+            consulta = consulta.in_('compromissos.dia_semana', sorted(dias_semana))
+        agendas = self._dados(consulta)[0]
+        if not agendas:
+            return None
+        agenda = dict(agendas[0])
+        return agenda, agenda.pop('compromissos', None) or []
+
+    def versao_agenda(self, agenda_id=None, link_publico_id=None):
+        consulta = self.cliente.table('agendas').select(f"{COLUNAS_AGENDA_VERSAO}, usuarios(versao_locais, updated_at_locais)")
+        consulta = consulta.eq('id_agenda', agenda_id) if agenda_id else consulta.eq('link_publico_id', link_publico_id)
+        agendas = self._dados(consulta)[0]
+        return self._com_versao_locais(agendas[0]) if agendas else None
+
+    def relatorio_consolidado(self, usuario_id):
+        return self._executar(self.cliente.rpc('relatorio_consolidado', {'p_usuario_id': usuario_id}))[0].data or []
+
+    def dados_iniciais(self, usuario_id, agenda_id=None):
+        # Duas consultas com embeds: as listas do usuário a partir de usuarios e as da agenda
+        # a partir de agendas; com agenda_id saem juntas
+        do_usuario = self.cliente.table('usuarios').select(
+            f"versao_locais, agendas({', '.join(COLUNAS['agendas'])}), locais_trabalho({', '.join(COLUNAS['locais_trabalho'])}),"
+            f" configuracoes_usuario({', '.join(COLUNAS['configuracoes_usuario'])})"
+        ).eq('id_usuario', usuario_id)
+
+        def da_agenda(id_agenda):
+            return self.cliente.table('agendas').select(
+                f"versao, compromissos({', '.join(COLUNAS['compromissos'])}),"
+                f" agenda_locais_config({', '.join(COLUNAS['agenda_locais_config'])}, locais_trabalho(nome, cor))"
+            ).eq('id_agenda', id_agenda)
+
+        if agenda_id:
+            usuarios, agendas_alvo = self._dados(do_usuario, da_agenda(agenda_id))
+        else:
+            usuarios, agendas_alvo = self._dados(do_usuario)[0], []
+        usuario = usuarios[0] if usuarios else {}
+        agendas = _ordenar_agendas(usuario.get('agendas') or [])
+        if not agenda_id and agendas:
+            agenda_id = agendas[0]['id_agenda']
+            agendas_alvo = self._dados(da_agenda(agenda_id))[0]
+        # Com usuario_id único, o PostgREST embute configuracoes_usuario como objeto (um-para-um)
+        configuracoes = usuario.get('configuracoes_usuario')
+        if isinstance(configuracoes, list):
+            configuracoes = configuracoes[0] if configuracoes else None
+        alvo = agendas_alvo[0] if agendas_alvo else {}
+        return {
+            'agendas': agendas,
+            'locais': usuario.get('locais_trabalho') or [],
+            'configuracoes': configuracoes,
+            'agenda_id': agenda_id if alvo else None,
+            'compromissos': alvo.get('compromissos') or [],
+            'locais_config': alvo.get('agenda_locais_config') or [],
+            'versao_agenda': alvo.get('versao'),
+            'versao_locais': usuario.get('versao_locais'),
+        }
+
+    def alteracoes(self, tabela, dono_id, desde=None):
+        # Uma consulta a partir do dono do contador: contador, linhas e lápides saem do
+        # mesmo instante do banco
+        dono, chave, contador, _ = SINCRONIZACAO[tabela]
+        colunas = ', '.join(COLUNAS[tabela])
+        if tabela == 'agenda_locais_config':
+            colunas += ', locais_trabalho(nome, cor)'
+        selecao = f"{contador}, {tabela}({colunas})"
+        if desde is not None:
+            selecao += ', registros_excluidos(id_registro)'
+        consulta = self.cliente.table(dono).select(selecao).eq(chave, dono_id)
+        if desde is not None:
+            consulta = (consulta.gt(f'{tabela}.versao', desde)
+                        .eq('registros_excluidos.tabela', tabela).gt('registros_excluidos.versao', desde))
+        linhas = self._dados(consulta)[0]
+        if not linhas:
+            return None
+        return {
+            'versao': linhas[0][contador],
+            'linhas': linhas[0].get(tabela) or [],
+            'excluidos': [registro['id_registro'] for registro in linhas[0].get('registros_excluidos') or []],
+        }
+
+    # O PostgREST não filtra alterações por tabelas embutidas: em POSSE_PELA_AGENDA a
+    # alteração vai pela função alterar_da_agenda (schema.sql), que junta agendas e exige o
+    # dono no próprio comando, como o backend Postgres (sem depender do cache do app)
+    def _alteracao(self, tabela, dono_id, filtros, valores=None):
+        filtros = _filtros_de_posse(tabela, dono_id, filtros)
+        _colunas(tabela, ','.join(filtros))
+        if tabela in POSSE_PELA_AGENDA:
+            return self._executar(self.cliente.rpc('alterar_da_agenda', {
+                'p_tabela': tabela, 'p_usuario_id': dono_id, 'p_filtros': filtros, 'p_valores': valores
+            }))[0].data or []
+        consulta = self.cliente.table(tabela).delete() if valores is None else self.cliente.table(tabela).update(valores)
+        for coluna, valor in filtros.items():
+            consulta = consulta.eq(coluna, valor)
+        return self._dados(consulta)[0]
+
+    def atualizar(self, tabela, valores, dono_id, **filtros):
+        _colunas(tabela, ','.join(valores))
+        return self._alteracao(tabela, dono_id, filtros, valores)
+
+    def excluir(self, tabela, dono_id, **filtros):
+        excluidas = self._alteracao(tabela, dono_id, filtros)
+        # Em POSSE_PELA_AGENDA a função já devolve versao_exclusao
+        if tabela not in SINCRONIZACAO or tabela in POSSE_PELA_AGENDA or not excluidas:
+            return excluidas
+        # A lápide é gravada pelo gatilho do DELETE: lida depois dele
+        chave = COLUNAS[tabela][0]
+        lapides = self._dados(self.cliente.table('registros_excluidos').select('id_registro, versao')
+                              .eq('tabela', tabela).in_('id_registro', [linha[chave] for linha in excluidas]))[0]
+        versoes = {str(lapide['id_registro']): lapide['versao'] for lapide in lapides}
+        return [{**linha, 'versao_exclusao': versoes.get(str(linha[chave]))} for linha in excluidas]
+
+    def validar_compromisso(self, agenda_id, usuario_id, dados, id_compromisso=None):
+        return self._executar(self.cliente.rpc('validar_compromisso', {
+            'p_agenda_id': agenda_id, 'p_usuario_id': usuario_id, 'p_dados': dados, 'p_id_compromisso': id_compromisso
+        }))[0].data
+
+
+def _valor_json(valor):
+    """Converte um valor do psycopg para o que o PostgREST devolveria em JSON."""
+    if isinstance(valor, uuid.UUID):
+        return str(valor)
+    if isinstance(valor, decimal.Decimal):
+        return float(valor)
+    if isinstance(valor, (datetime.datetime, datetime.date, datetime.time)):
+        return valor.isoformat()
+    return valor
+
+
+def _linha_json(linha):
+    return {coluna: _valor_json(valor) for coluna, valor in linha.items()}
+
+
+class RepositorioPostgres(Repositorio):
+    """
+    Backend SQL direto. As consultas de um método saem juntas em modo pipeline (uma ida
+    ao banco) por uma conexão do pool. ao_executar(tabela, operacao, segundos, erro, None),
+    se dado, é chamado após cada método, como o ouvinte de instrumentar_postgrest.
+    """
+
+    def __init__(self, dsn, tamanho_min=POSTGRES_POOL_MIN, tamanho_max=POSTGRES_POOL_MAX,
+                 prepare_threshold=POSTGRES_PREPARE_THRESHOLD, ao_executar=None):
+        try:
+            from psycopg import Pipeline
+            from psycopg.rows import dict_row
+            from psycopg_pool import ConnectionPool
+        except ImportError as e:
+            raise ErroRepositorio(
+                "REPOSITORIO_BACKEND=postgres requer os pacotes psycopg e psycopg_pool "
+                "(pip install 'psycopg[binary,pool]')."
+            ) from e
+        if not dsn:
+            raise ErroRepositorio("REPOSITORIO_BACKEND=postgres requer POSTGRES_DSN.")
+
+        super().__init__()
+        limiar = None if str(prepare_threshold).lower() == 'none' else int(prepare_threshold)
+        self.ao_executar = ao_executar
+        # Pipeline exige libpq >= 14; sem ele as consultas de um método saem em sequência
+        self.pipeline = Pipeline.is_supported()
+        self.pool = ConnectionPool(
+            dsn, min_size=tamanho_min, max_size=tamanho_max, open=True,
+            kwargs={'row_factory': dict_row, 'prepare_threshold': limiar, 'autocommit': True},
+            name='agenda-repositorio'
+        )
+
+    def fechar(self):
+        self.pool.close()
+
+    def _consultar(self, tabela, operacao, *consultas):
+        """Executa (sql, parametros) em pipeline e devolve a lista de linhas de cada consulta."""
+        self._contar(len(consultas))
+        inicio = time.perf_counter()
+        erro = None
+        try:
+            with self.pool.connection() as conexao:
+                if len(consultas) == 1 or not self.pipeline:
+                    return [[_linha_json(linha) for linha in conexao.execute(*consulta).fetchall()] for consulta in consultas]
+                with conexao.pipeline():
+                    cursores = [conexao.execute(sql, parametros) for sql, parametros in consultas]
+                    return [[_linha_json(linha) for linha in cursor.fetchall()] for cursor in cursores]
+        except Exception as e:
+            erro = e
+            raise
+        finally:
+            if self.ao_executar:
+                self.ao_executar(tabela, operacao, time.perf_counter() - inicio, erro, None)
+
+    def _select(self, tabela, colunas, filtros, ordem=None):
+        nomes = _colunas(tabela, colunas)
+        condicoes = [f"{coluna} = %s" for coluna in _colunas(tabela, ','.join(filtros))] if filtros else []
+        sql = f"SELECT {', '.join(nomes)} FROM {tabela}"
+        if condicoes:
+            sql += f" WHERE {' AND '.join(condicoes)}"
+        if ordem:
+            sql += f" ORDER BY {_colunas(tabela, ordem)[0]}"
+        return sql, list(filtros.values())
+
+    def listar(self, tabela, colunas='*', ordem=None, **filtros):
+        return self._consultar(tabela, 'select', self._select(tabela, colunas, filtros, ordem))[0]
+
+    def obter(self, tabela, colunas='*', **filtros):
+        linhas = self.listar(tabela, colunas, **filtros)
+        return linhas[0] if linhas else None
+
+    def acesso_agenda(self, agenda_id, usuario_id):
+        # Dono e permissão em uma consulta só
+        linhas = self._consultar('agendas', 'select', (
+            "SELECT a.usuario_id, a.usuario_id = %(usuario)s AS pode_escrever,"
+            "       EXISTS (SELECT 1 FROM agenda_permissoes p"
+            "               WHERE p.agenda_id = a.id_agenda AND p.usuario_recebeu_id = %(usuario)s"
+            "                 AND p.status = 'ativo') AS compartilhada"
+            "  FROM agendas a WHERE a.id_agenda = %(agenda)s",
+            {'agenda': agenda_id, 'usuario': usuario_id}
+        ))[0]
+        if not linhas:
+            return None
+        linha = linhas[0]
+        if linha['pode_escrever']:
+            return usuario_id, True
+        return (linha['usuario_id'], False) if linha['compartilhada'] else None
+
+    def dados_validacao(self, agenda_id, usuario_id):
+        return self._consultar(
+            'compromissos', 'select',
+            self._select('compromissos', COLUNAS_COMPROMISSO_VALIDACAO, {'agenda_id': agenda_id}),
+            self._select('locais_trabalho', COLUNAS_LOCAL_VALIDACAO, {'usuario_id': usuario_id})
+        )
+
+    def dados_relatorio(self, agenda_id, usuario_id):
+        return self._consultar(
+            'compromissos', 'select',
+            self._select('agenda_locais_config', COLUNAS_CONFIG_RELATORIO, {'agenda_id': agenda_id}),
+            self._select('locais_trabalho', COLUNAS_LOCAL_RELATORIO, {'usuario_id': usuario_id}),
+            self._select('compromissos', COLUNAS_COMPROMISSO_RELATORIO, {'agenda_id': agenda_id})
+        )
+
+    def agenda_publica(self, link_publico_id):
+        # Compromissos e locais pelo join com a agenda: as três leituras saem juntas
+        agenda_sql = (
+            "SELECT " + ', '.join(f"a.{coluna.strip()}" for coluna in COLUNAS_AGENDA_PUBLICA.split(',')) +
+            ", a.versao, u.versao_locais FROM agendas a JOIN usuarios u ON u.id_usuario = a.usuario_id"
+            " WHERE a.link_publico_id = %s"
+        )
+        compromissos_sql = (
+            "SELECT " + ', '.join(f"c.{coluna.strip()}" for coluna in COLUNAS_COMPROMISSO_PUBLICO.split(',')) +
+            " FROM compromissos c JOIN agendas a ON a.id_agenda = c.agenda_id WHERE a.link_publico_id = %s"
+        )
+        locais_sql = (
+            "SELECT l.id_local, l.nome, l.cor FROM locais_trabalho l"
+            " JOIN agendas a ON a.usuario_id = l.usuario_id WHERE a.link_publico_id = %s"
+        )
+        agendas, compromissos, locais = self._consultar(
+            'agendas', 'select',
+            (agenda_sql, [link_publico_id]), (compromissos_sql, [link_publico_id]), (locais_sql, [link_publico_id])
+        )
+        return (agendas[0], compromissos, locais) if agendas else None
+
+    @staticmethod
+    def _locais_config_sql(agenda):
+        """Configurações com o local; agenda é a expressão SQL do id da agenda."""
+        return (
+            f"SELECT {', '.join(f'c.{coluna}' for coluna in COLUNAS['agenda_locais_config'])},"
+            "       l.nome AS local_nome, l.cor AS local_cor, l.id_local IS NOT NULL AS tem_local"
+            "  FROM agenda_locais_config c LEFT JOIN locais_trabalho l ON l.id_local = c.local_id"
+            f" WHERE c.agenda_id = {agenda}"
+        )
+
+    @staticmethod
+    def _locais_config_json(linhas):
+        return [
+            {**{coluna: linha[coluna] for coluna in COLUNAS['agenda_locais_config']},
+             'locais_trabalho': {'nome': linha['local_nome'], 'cor': linha['local_cor']} if linha['tem_local'] else None}
+            for linha in linhas
+        ]
+
+    def locais_config_com_local(self, agenda_id):
+        linhas = self._consultar('agenda_locais_config', 'select', (self._locais_config_sql('%s'), [agenda_id]))[0]
+        return self._locais_config_json(linhas)
+
+    def calendario(self, agenda_id, dias_semana=None):
+        parametros = {'agenda': agenda_id, 'dias': sorted(dias_semana) if dias_semana is not None else None}
+        agendas, compromissos = self._consultar(
+            'agendas', 'select',
+            (f"SELECT {COLUNAS_AGENDA_CALENDARIO} FROM agendas WHERE id_agenda = %(agenda)s", parametros),
+            (f"SELECT {', '.join(COLUNAS['compromissos'])} FROM compromissos"
+             " WHERE agenda_id = %(agenda)s AND (%(dias)s::int[] IS NULL OR dia_semana = ANY(%(dias)s::int[]))", parametros)
+        )
+        return (agendas[0], compromissos) if agendas else None
+
+    def versao_agenda(self, agenda_id=None, link_publico_id=None):
+        coluna, valor = ('id_agenda', agenda_id) if agenda_id else ('link_publico_id', link_publico_id)
+        colunas = ', '.join(f"a.{coluna.strip()}" for coluna in COLUNAS_AGENDA_VERSAO.split(','))
+        agendas = self._consultar('agendas', 'select', (
+            f"SELECT {colunas}, u.versao_locais, u.updated_at_locais"
+            f"  FROM agendas a JOIN usuarios u ON u.id_usuario = a.usuario_id WHERE a.{coluna} = %s", [valor]
+        ))[0]
+        return agendas[0] if agendas else None
+
+    def relatorio_consolidado(self, usuario_id):
+        return self._consultar('relatorio_consolidado', 'rpc', ("SELECT * FROM relatorio_consolidado(%s)", [usuario_id]))[0]
+
+    def dados_iniciais(self, usuario_id, agenda_id=None):
+        # Seis consultas em uma ida ao banco; sem agenda_id, a agenda padrão sai de subconsulta.
+        # Os contadores vêm primeiro (ver alteracoes)
+        parametros = {'usuario': usuario_id, 'agenda': agenda_id}
+        ordem_agendas = "ORDER BY data_inicio DESC, id_agenda"
+        agenda = (f"COALESCE(%(agenda)s::uuid, (SELECT id_agenda FROM agendas WHERE usuario_id = %(usuario)s"
+                  f" {ordem_agendas} LIMIT 1))")
+        versoes, agendas, locais, configuracoes, compromissos, locais_config = self._consultar(
+            'agendas', 'select',
+            (f"SELECT (SELECT versao FROM agendas WHERE id_agenda = {agenda}) AS versao_agenda,"
+             "        (SELECT versao_locais FROM usuarios WHERE id_usuario = %(usuario)s) AS versao_locais", parametros),
+            (f"SELECT {', '.join(COLUNAS['agendas'])} FROM agendas WHERE usuario_id = %(usuario)s {ordem_agendas}", parametros),
+            (f"SELECT {', '.join(COLUNAS['locais_trabalho'])} FROM locais_trabalho WHERE usuario_id = %(usuario)s", parametros),
+            (f"SELECT {', '.join(COLUNAS['configuracoes_usuario'])} FROM configuracoes_usuario WHERE usuario_id = %(usuario)s", parametros),
+            (f"SELECT {', '.join(COLUNAS['compromissos'])} FROM compromissos WHERE agenda_id = {agenda}", parametros),
+            (self._locais_config_sql(agenda), parametros)
+        )
+        if not agenda_id:
+            agenda_id = agendas[0]['id_agenda'] if agendas else None
+        return {
+            'agendas': agendas,
+            'locais': locais,
+            'configuracoes': configuracoes[0] if configuracoes else None,
+            'agenda_id': agenda_id,
+            'compromissos': compromissos,
+            'locais_config': self._locais_config_json(locais_config),
+            'versao_agenda': versoes[0]['versao_agenda'],
+            'versao_locais': versoes[0]['versao_locais'],
+        }
+
+    def alteracoes(self, tabela, dono_id, desde=None):
+        # Contador antes das linhas e das lápides: uma gravação concluída entre as leituras
+        # só pode vir a mais (com versão acima da devolvida) e será reenviada, nunca perdida
+        dono, chave, contador, coluna_dono = SINCRONIZACAO[tabela]
+        parametros = {'dono': dono_id, 'desde': desde, 'tabela': tabela}
+        if tabela == 'agenda_locais_config':
+            linhas_sql = self._locais_config_sql('%(dono)s')
+        else:
+            linhas_sql = f"SELECT {', '.join(f'c.{coluna}' for coluna in COLUNAS[tabela])} FROM {tabela} c WHERE c.{coluna_dono} = %(dono)s"
+        consultas = [(f"SELECT {contador} AS versao FROM {dono} WHERE {chave} = %(dono)s", parametros)]
+        if desde is None:
+            consultas.append((linhas_sql, parametros))
+        else:
+            consultas += [
+                (linhas_sql + " AND c.versao > %(desde)s", parametros),
+                (f"SELECT id_registro FROM registros_excluidos"
+                 f" WHERE tabela = %(tabela)s AND {coluna_dono} = %(dono)s AND versao > %(desde)s", parametros),
+            ]
+        versao, linhas, *excluidos = self._consultar(tabela, 'select', *consultas)
+        if not versao:
+            return None
+        if tabela == 'agenda_locais_config':
+            linhas = self._locais_config_json(linhas)
+        return {
+            'versao': versao[0]['versao'],
+            'linhas': linhas,
+            'excluidos': [registro['id_registro'] for registro in excluidos[0]] if excluidos else [],
+        }
+
+    def _alteracao(self, comando, tabela, dono_id, filtros, atribuicoes='', parametros=()):
+        """UPDATE/DELETE com RETURNING; nas tabelas de POSSE_PELA_AGENDA junta agendas."""
+        filtros = _filtros_de_posse(tabela, dono_id, filtros)
+        condicoes = [f"t.{coluna} = %s" for coluna in _colunas(tabela, ','.join(filtros))]
+        parametros = [*parametros, *filtros.values()]
+        juncao = ''
+        if tabela in POSSE_PELA_AGENDA:
+            juncao = ' FROM agendas a' if comando == 'UPDATE' else ' USING agendas a'
+            condicoes += ["a.id_agenda = t.agenda_id", "a.usuario_id = %s"]
+            parametros.append(dono_id)
+        retorno = ', '.join(f't.{coluna}' for coluna in COLUNAS[tabela])
+        sql = (f"UPDATE {tabela} t SET {atribuicoes}" if comando == 'UPDATE' else f"DELETE FROM {tabela} t")
+        sql += f"{juncao} WHERE {' AND '.join(condicoes)} RETURNING {retorno}"
+        return self._consultar(tabela, comando.lower(), (sql, parametros))[0]
+
+    def atualizar(self, tabela, valores, dono_id, **filtros):
+        from psycopg.types.json import Jsonb
+
+        atribuicoes = ', '.join(f"{coluna} = %s" for coluna in _colunas(tabela, ','.join(valores)))
+        parametros = [Jsonb(valor) if isinstance(valor, (list, dict)) else valor for valor in valores.values()]
+        return self._alteracao('UPDATE', tabela, dono_id, filtros, atribuicoes, parametros)
+
+    def excluir(self, tabela, dono_id, **filtros):
+        excluidas = self._alteracao('DELETE', tabela, dono_id, filtros)
+        if tabela not in SINCRONIZACAO or not excluidas:
+            return excluidas
+        # A lápide é gravada pelo gatilho do DELETE (em autocommit, já confirmada aqui)
+        chave = COLUNAS[tabela][0]
+        lapides = self._consultar(tabela, 'select', (
+            "SELECT id_registro, versao FROM registros_excluidos WHERE tabela = %s AND id_registro = ANY(%s::uuid[])",
+            [tabela, [linha[chave] for linha in excluidas]]
+        ))[0]
+        versoes = {lapide['id_registro']: lapide['versao'] for lapide in lapides}
+        return [{**linha, 'versao_exclusao': versoes.get(linha[chave])} for linha in excluidas]
+
+    def validar_compromisso(self, agenda_id, usuario_id, dados, id_compromisso=None):
+        from psycopg.types.json import Jsonb
+
+        # Em autocommit a chamada é uma transação: o lock da agenda vale até a gravação
+        linhas = self._consultar('validar_compromisso', 'rpc', (
+            "SELECT validar_compromisso(%s, %s, %s, %s) AS resultado",
+            [agenda_id, usuario_id, Jsonb(dados), id_compromisso]
+        ))[0]
+        return linhas[0]['resultado']
+
+
+def criar_repositorio_postgres(ao_executar=None):
+    """RepositorioPostgres conforme o ambiente, ou None quando o backend é o Supabase."""
+    if REPOSITORIO_BACKEND == 'supabase':
+        return None
+    if REPOSITORIO_BACKEND != 'postgres':
+        raise ErroRepositorio(f"REPOSITORIO_BACKEND desconhecido: {REPOSITORIO_BACKEND} (use supabase ou postgres).")
+    return RepositorioPostgres(POSTGRES_DSN, ao_executar=ao_executar)
@@ -155,6 +155,409 @@ COMMENT ON TABLE compromissos IS 'Compromissos/eventos agendados';
 COMMENT ON TABLE agenda_permissoes IS 'Permissões de compartilhamento de agendas entre usuários';
 COMMENT ON TABLE configuracoes_usuario IS 'Configurações gerais do usuário (dias da semana, horários padrão)';
 
+-- =========================================
+-- FUNÇÃO: relatorio_consolidado
+-- =========================================
+-- Horas semanais de todas as agendas de um usuário, agrupadas por agenda e local,
+-- calculadas no banco em uma única chamada RPC (em vez de um relatório por agenda).
+-- Agendas sem compromissos aparecem com local_id NULL; valor_hora é NULL quando o
+-- local não está configurado na agenda.
+CREATE OR REPLACE FUNCTION relatorio_consolidado(p_usuario_id UUID)
+RETURNS TABLE (
+    agenda_id UUID,
+    agenda_nome TEXT,
+    data_inicio DATE,
+    data_fim DATE,
+    local_id UUID,
+    local_nome TEXT,
+    relacionado_com UUID,
+    valor_hora DECIMAL(10,2),
+    base_horas NUMERIC,
+    acrescimo_horas NUMERIC
+) AS $$
+    SELECT
+        a.id_agenda,
+        a.nome,
+        a.data_inicio,
+        a.data_fim,
+        l.id_local,
+        l.nome,
+        l.relacionado_com,
+        cfg.valor_hora,
+        COALESCE(SUM(c.duracao), 0),
+        COALESCE(SUM(CASE WHEN c.tipo_hora = 'HA' THEN c.duracao * l.acrescimo_ha_percent / 100.0 ELSE 0 END), 0)
+    FROM agendas a
+    LEFT JOIN compromissos c ON c.agenda_id = a.id_agenda
+    LEFT JOIN locais_trabalho l ON l.id_local = c.local_id AND l.usuario_id = a.usuario_id
+    LEFT JOIN agenda_locais_config cfg ON cfg.agenda_id = a.id_agenda AND cfg.local_id = l.id_local
+    WHERE a.usuario_id = p_usuario_id
+    GROUP BY a.id_agenda, a.nome, a.data_inicio, a.data_fim, l.id_local, l.nome, l.relacionado_com, cfg.valor_hora
+    ORDER BY a.data_inicio DESC, a.id_agenda, l.nome;
+$$ LANGUAGE sql STABLE;
+
+-- =========================================
+-- FUNÇÃO: validar_compromisso
+-- =========================================
+-- Valida e grava (insere ou, com p_id_compromisso, atualiza) um compromisso em uma única
+-- transação, sob um lock por agenda: duas requisições concorrentes na mesma agenda não
+-- conseguem mais passar ambas pela validação e criar horários sobrepostos.
+-- Aplica as mesmas quatro regras de _appointment_rule_violation no app.py:
+--   1. no máximo 6 horas contínuas;
+--   2. no máximo 8 horas por dia somando os locais relacionados (relacionado_com, transitivo);
+--   3. período de carência entre locais não relacionados (periodo_carencia do local);
+--   4. 11 horas de descanso entre o último compromisso de um dia e o primeiro do seguinte.
+-- Retorna {"sucesso": true, "compromisso": {...}, "anterior": {...}|null} ou
+-- {"sucesso": false, "violacao": {"codigo": ..., <detalhes>}}; o app monta as mensagens.
+CREATE OR REPLACE FUNCTION minutos_do_dia(p_hora TIME) RETURNS INTEGER AS $$
+    SELECT (EXTRACT(HOUR FROM p_hora) * 60 + EXTRACT(MINUTE FROM p_hora))::INTEGER;
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION validar_compromisso(
+    p_agenda_id UUID,
+    p_usuario_id UUID,
+    p_dados JSONB,
+    p_id_compromisso UUID DEFAULT NULL
+) RETURNS JSONB AS $$
+DECLARE
+    v_anterior compromissos%ROWTYPE;
+    v_novo compromissos%ROWTYPE;
+    v_local locais_trabalho%ROWTYPE;
+    v_inicio INTEGER;
+    v_fim INTEGER;
+    v_grupo UUID[];
+    v_total NUMERIC;
+    v_vizinho RECORD;
+    v_gap INTEGER;
+    v_borda INTEGER;
+BEGIN
+    -- Lock por agenda até o fim da transação (serializa validação + gravação)
+    PERFORM pg_advisory_xact_lock(hashtextextended('compromissos:' || p_agenda_id::TEXT, 0));
+
+    IF NOT EXISTS (SELECT 1 FROM agendas WHERE id_agenda = p_agenda_id AND usuario_id = p_usuario_id) THEN
+        RETURN jsonb_build_object('sucesso', FALSE, 'violacao', jsonb_build_object('codigo', 'agenda_nao_encontrada'));
+    END IF;
+
+    -- Estado futuro: o original (na edição) com os campos enviados por cima
+    IF p_id_compromisso IS NOT NULL THEN
+        SELECT * INTO v_anterior FROM compromissos
+         WHERE id_compromisso = p_id_compromisso AND agenda_id = p_agenda_id
+           FOR UPDATE;
+        IF NOT FOUND THEN
+            RETURN jsonb_build_object('sucesso', FALSE, 'violacao', jsonb_build_object('codigo', 'compromisso_nao_encontrado'));
+        END IF;
+        v_novo := jsonb_populate_record(v_anterior, p_dados - 'id_compromisso' - 'agenda_id');
+    ELSE
+        v_novo := jsonb_populate_record(NULL::compromissos, p_dados - 'id_compromisso');
+        v_novo.id_compromisso := uuid_generate_v4();
+        v_novo.agenda_id := p_agenda_id;
+    END IF;
+    v_inicio := minutos_do_dia(v_novo.hora_inicio);
+    v_fim := minutos_do_dia(v_novo.hora_fim);
+
+    -- Regra 1: limite de trabalho contínuo
+    IF v_novo.duracao > 6.0 THEN
+        RETURN jsonb_build_object('sucesso', FALSE, 'violacao', jsonb_build_object('codigo', 'duracao_maxima'));
+    END IF;
+
+    SELECT * INTO v_local FROM locais_trabalho WHERE id_local = v_novo.local_id AND usuario_id = p_usuario_id;
+    IF NOT FOUND THEN
+        RETURN jsonb_build_object('sucesso', FALSE, 'violacao', jsonb_build_object('codigo', 'local_nao_encontrado'));
+    END IF;
+
+    -- Sobreposição com qualquer compromisso do dia (o primeiro pela hora de início)
+    SELECT hora_inicio, hora_fim INTO v_vizinho FROM compromissos
+     WHERE agenda_id = p_agenda_id AND dia_semana = v_novo.dia_semana
+       AND id_compromisso IS DISTINCT FROM p_id_compromisso
+       AND minutos_do_dia(hora_inicio) < v_fim AND minutos_do_dia(hora_fim) > v_inicio
+     ORDER BY hora_inicio
+     LIMIT 1;
+    IF FOUND THEN
+        RETURN jsonb_build_object('sucesso', FALSE, 'violacao', jsonb_build_object(
+            'codigo', 'conflito', 'hora_inicio', v_vizinho.hora_inicio, 'hora_fim', v_vizinho.hora_fim));
+    END IF;
+
+    -- Regra 2: grupo de locais relacionados (componente conexa entre os locais do usuário)
+    WITH RECURSIVE arestas AS (
+        SELECT l.id_local AS origem, l.relacionado_com AS destino
+          FROM locais_trabalho l JOIN locais_trabalho r ON r.id_local = l.relacionado_com
+         WHERE l.usuario_id = p_usuario_id AND r.usuario_id = p_usuario_id
+        UNION ALL
+        SELECT l.relacionado_com, l.id_local
+          FROM locais_trabalho l JOIN locais_trabalho r ON r.id_local = l.relacionado_com
+         WHERE l.usuario_id = p_usuario_id AND r.usuario_id = p_usuario_id
+    ), grupo(id_local) AS (
+        SELECT v_novo.local_id
+        UNION
+        SELECT a.destino FROM grupo g JOIN arestas a ON a.origem = g.id_local
+    )
+    SELECT array_agg(id_local) INTO v_grupo FROM grupo;
+
+    SELECT v_novo.duracao + COALESCE(SUM(duracao), 0) INTO v_total FROM compromissos
+     WHERE agenda_id = p_agenda_id AND dia_semana = v_novo.dia_semana
+       AND id_compromisso IS DISTINCT FROM p_id_compromisso
+       AND local_id = ANY (v_grupo);
+    IF round(v_total, 4) > 8.0 THEN
+        RETURN jsonb_build_object('sucesso', FALSE, 'violacao', jsonb_build_object(
+            'codigo', 'limite_diario',
+            'total', v_total,
+            'locais', (SELECT jsonb_agg(COALESCE(nome, id_local::TEXT) ORDER BY id_local::TEXT)
+                         FROM locais_trabalho WHERE id_local = ANY (v_grupo))));
+    END IF;
+
+    -- Regra 3: período de carência com o vizinho imediato, se for de um local não relacionado
+    SELECT local_id, hora_fim INTO v_vizinho FROM compromissos
+     WHERE agenda_id = p_agenda_id AND dia_semana = v_novo.dia_semana
+       AND id_compromisso IS DISTINCT FROM p_id_compromisso
+       AND minutos_do_dia(hora_fim) <= v_inicio
+     ORDER BY minutos_do_dia(hora_fim) DESC, hora_inicio
+     LIMIT 1;
+    IF FOUND AND NOT v_vizinho.local_id = ANY (v_grupo)
+       AND EXISTS (SELECT 1 FROM locais_trabalho WHERE id_local = v_vizinho.local_id AND usuario_id = p_usuario_id) THEN
+        v_gap := v_inicio - minutos_do_dia(v_vizinho.hora_fim);
+        IF v_gap < v_local.periodo_carencia THEN
+            RETURN jsonb_build_object('sucesso', FALSE, 'violacao', jsonb_build_object(
+                'codigo', 'carencia_anterior', 'gap', v_gap, 'necessario', v_local.periodo_carencia));
+        END IF;
+    END IF;
+
+    SELECT local_id, hora_inicio INTO v_vizinho FROM compromissos
+     WHERE agenda_id = p_agenda_id AND dia_semana = v_novo.dia_semana
+       AND id_compromisso IS DISTINCT FROM p_id_compromisso
+       AND minutos_do_dia(hora_inicio) >= v_fim
+     ORDER BY minutos_do_dia(hora_inicio)
+     LIMIT 1;
+    IF FOUND AND NOT v_vizinho.local_id = ANY (v_grupo)
+       AND EXISTS (SELECT 1 FROM locais_trabalho WHERE id_local = v_vizinho.local_id AND usuario_id = p_usuario_id) THEN
+        v_gap := minutos_do_dia(v_vizinho.hora_inicio) - v_fim;
+        IF v_gap < v_local.periodo_carencia THEN
+            RETURN jsonb_build_object('sucesso', FALSE, 'violacao', jsonb_build_object(
+                'codigo', 'carencia_seguinte', 'gap', v_gap, 'necessario', v_local.periodo_carencia));
+        END IF;
+    END IF;
+
+    -- Regra 4: descanso inter-jornada (o compromisso em edição é ignorado também nos dias vizinhos)
+    SELECT minutos_do_dia(hora_fim) INTO v_borda FROM compromissos
+     WHERE agenda_id = p_agenda_id AND dia_semana = (v_novo.dia_semana + 6) % 7
+       AND id_compromisso IS DISTINCT FROM p_id_compromisso
+     ORDER BY minutos_do_dia(hora_inicio) DESC
+     LIMIT 1;
+    IF FOUND AND (24 * 60 - v_borda) + v_inicio < 11 * 60 THEN
+        RETURN jsonb_build_object('sucesso', FALSE, 'violacao', jsonb_build_object('codigo', 'descanso_anterior'));
+    END IF;
+
+    SELECT minutos_do_dia(hora_inicio) INTO v_borda FROM compromissos
+     WHERE agenda_id = p_agenda_id AND dia_semana = (v_novo.dia_semana + 1) % 7
+       AND id_compromisso IS DISTINCT FROM p_id_compromisso
+     ORDER BY minutos_do_dia(hora_inicio)
+     LIMIT 1;
+    IF FOUND AND (24 * 60 - v_fim) + v_borda < 11 * 60 THEN
+        RETURN jsonb_build_object('sucesso', FALSE, 'violacao', jsonb_build_object('codigo', 'descanso_seguinte'));
+    END IF;
+
+    -- Gravação
+    IF p_id_compromisso IS NOT NULL THEN
+        UPDATE compromissos
+           SET local_id = v_novo.local_id, dia_semana = v_novo.dia_semana, hora_inicio = v_novo.hora_inicio,
+               hora_fim = v_novo.hora_fim, duracao = v_novo.duracao, descricao = v_novo.descricao,
+               tipo_hora = v_novo.tipo_hora
+         WHERE id_compromisso = p_id_compromisso
+        RETURNING * INTO v_novo;
+        RETURN jsonb_build_object('sucesso', TRUE, 'compromisso', to_jsonb(v_novo), 'anterior', to_jsonb(v_anterior));
+    END IF;
+
+    INSERT INTO compromissos SELECT v_novo.* RETURNING * INTO v_novo;
+    RETURN jsonb_build_object('sucesso', TRUE, 'compromisso', to_jsonb(v_novo), 'anterior', NULL);
+END;
+$$ LANGUAGE plpgsql;
+
+-- =========================================
+-- SINCRONIZAÇÃO INCREMENTAL
+-- =========================================
+-- Cada alteração em compromissos e agenda_locais_config incrementa agendas.versao; em
+-- locais_trabalho, usuarios.versao_locais. A linha alterada guarda a versão em que mudou
+-- (versao) e quando (updated_at); as excluídas deixam um registro em registros_excluidos.
+-- Com isso as listagens aceitam ?since=<versao> e devolvem só o que mudou depois dela.
+-- O UPDATE do contador trava a linha da agenda (ou do usuário) até o commit: as versões
+-- de uma agenda ficam visíveis na ordem em que foram atribuídas.
+ALTER TABLE agendas ADD COLUMN IF NOT EXISTS versao BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE usuarios ADD COLUMN IF NOT EXISTS versao_locais BIGINT NOT NULL DEFAULT 0;
+-- Quando o contador (ou, nas agendas, a própria linha) mudou: o Last-Modified das visões
+-- derivadas da agenda, igual em todos os processos do app
+ALTER TABLE agendas ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW();
+ALTER TABLE usuarios ADD COLUMN IF NOT EXISTS updated_at_locais TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW();
+
+ALTER TABLE compromissos ADD COLUMN IF NOT EXISTS versao BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE compromissos ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW();
+ALTER TABLE agenda_locais_config ADD COLUMN IF NOT EXISTS versao BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE agenda_locais_config ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW();
+ALTER TABLE locais_trabalho ADD COLUMN IF NOT EXISTS versao BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE locais_trabalho ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW();
+
+-- Lápides: id e versão da exclusão, presos à agenda (compromissos, agenda_locais_config)
+-- ou ao usuário (locais_trabalho); somem junto com o dono
+CREATE TABLE IF NOT EXISTS registros_excluidos (
+  tabela TEXT NOT NULL,
+  id_registro UUID NOT NULL,
+  agenda_id UUID REFERENCES agendas(id_agenda) ON DELETE CASCADE,
+  usuario_id UUID REFERENCES usuarios(id_usuario) ON DELETE CASCADE,
+  versao BIGINT NOT NULL,
+  excluido_em TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+  PRIMARY KEY (tabela, id_registro)
+);
+COMMENT ON TABLE registros_excluidos IS 'Exclusões registradas para a sincronização incremental (?since=)';
+
+-- Política de leitura em polices.sql; as gravações vêm só do gatilho abaixo
+ALTER TABLE registros_excluidos ENABLE ROW LEVEL SECURITY;
+
+CREATE INDEX IF NOT EXISTS idx_compromissos_agenda_versao ON compromissos(agenda_id, versao);
+CREATE INDEX IF NOT EXISTS idx_agenda_locais_config_agenda_versao ON agenda_locais_config(agenda_id, versao);
+CREATE INDEX IF NOT EXISTS idx_locais_trabalho_usuario_versao ON locais_trabalho(usuario_id, versao);
+CREATE INDEX IF NOT EXISTS idx_registros_excluidos_agenda ON registros_excluidos(agenda_id, versao);
+CREATE INDEX IF NOT EXISTS idx_registros_excluidos_usuario ON registros_excluidos(usuario_id, versao);
+
+-- Argumentos do gatilho: coluna do id da linha e dono do contador ('agenda' ou 'usuario').
+-- SECURITY DEFINER: o contador e as lápides são gravados mesmo sob o RLS do usuário.
+CREATE OR REPLACE FUNCTION versionar_registro() RETURNS TRIGGER AS $$
+DECLARE
+    v_linha JSONB;
+    v_versao BIGINT;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        v_linha := to_jsonb(OLD);
+    ELSE
+        v_linha := to_jsonb(NEW);
+    END IF;
+
+    IF TG_ARGV[1] = 'agenda' THEN
+        UPDATE agendas SET versao = versao + 1
+         WHERE id_agenda = (v_linha->>'agenda_id')::UUID
+        RETURNING versao INTO v_versao;
+    ELSE
+        UPDATE usuarios SET versao_locais = versao_locais + 1, updated_at_locais = NOW()
+         WHERE id_usuario = (v_linha->>'usuario_id')::UUID
+        RETURNING versao_locais INTO v_versao;
+    END IF;
+
+    IF TG_OP = 'DELETE' THEN
+        -- Exclusão em cascata do próprio dono (agenda ou usuário): não há o que registrar
+        IF v_versao IS NOT NULL THEN
+            INSERT INTO registros_excluidos (tabela, id_registro, agenda_id, usuario_id, versao)
+            VALUES (
+                TG_TABLE_NAME, (v_linha->>TG_ARGV[0])::UUID,
+                CASE WHEN TG_ARGV[1] = 'agenda' THEN (v_linha->>'agenda_id')::UUID END,
+                CASE WHEN TG_ARGV[1] = 'usuario' THEN (v_linha->>'usuario_id')::UUID END,
+                v_versao
+            )
+            ON CONFLICT (tabela, id_registro) DO UPDATE SET versao = EXCLUDED.versao, excluido_em = NOW();
+        END IF;
+        RETURN OLD;
+    END IF;
+
+    -- Sem o dono, a chave estrangeira recusa a linha logo depois
+    NEW.versao := COALESCE(v_versao, 0);
+    NEW.updated_at := NOW();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- agendas.updated_at acompanha qualquer UPDATE da agenda, inclusive o do contador acima
+CREATE OR REPLACE FUNCTION tocar_agenda() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at := NOW();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tocar_agendas ON agendas;
+CREATE TRIGGER tocar_agendas BEFORE UPDATE ON agendas
+  FOR EACH ROW EXECUTE FUNCTION tocar_agenda();
+
+DROP TRIGGER IF EXISTS versionar_compromissos ON compromissos;
+CREATE TRIGGER versionar_compromissos BEFORE INSERT OR UPDATE ON compromissos
+  FOR EACH ROW EXECUTE FUNCTION versionar_registro('id_compromisso', 'agenda');
+DROP TRIGGER IF EXISTS excluir_compromissos ON compromissos;
+CREATE TRIGGER excluir_compromissos AFTER DELETE ON compromissos
+  FOR EACH ROW EXECUTE FUNCTION versionar_registro('id_compromisso', 'agenda');
+
+DROP TRIGGER IF EXISTS versionar_agenda_locais_config ON agenda_locais_config;
+CREATE TRIGGER versionar_agenda_locais_config BEFORE INSERT OR UPDATE ON agenda_locais_config
+  FOR EACH ROW EXECUTE FUNCTION versionar_registro('id_agenda_local', 'agenda');
+DROP TRIGGER IF EXISTS excluir_agenda_locais_config ON agenda_locais_config;
+CREATE TRIGGER excluir_agenda_locais_config AFTER DELETE ON agenda_locais_config
+  FOR EACH ROW EXECUTE FUNCTION versionar_registro('id_agenda_local', 'agenda');
+
+DROP TRIGGER IF EXISTS versionar_locais_trabalho ON locais_trabalho;
+CREATE TRIGGER versionar_locais_trabalho BEFORE INSERT OR UPDATE ON locais_trabalho
+  FOR EACH ROW EXECUTE FUNCTION versionar_registro('id_local', 'usuario');
+DROP TRIGGER IF EXISTS excluir_locais_trabalho ON locais_trabalho;
+CREATE TRIGGER excluir_locais_trabalho AFTER DELETE ON locais_trabalho
+  FOR EACH ROW EXECUTE FUNCTION versionar_registro('id_local', 'usuario');
+
+-- =========================================
+-- FUNÇÃO: alterar_da_agenda
+-- =========================================
+-- UPDATE (p_valores) ou DELETE (p_valores NULL) das linhas de uma tabela filha da agenda
+-- (compromissos, agenda_locais_config, agenda_permissoes) que casam com p_filtros
+-- (coluna -> valor, agenda_id obrigatório), com a posse verificada no próprio comando:
+-- junta agendas e exige agendas.usuario_id = p_usuario_id, como o backend Postgres do
+-- app. Devolve as linhas alteradas (JSONB, lista); nas exclusões de tabelas versionadas
+-- cada linha traz também versao_exclusao, a versão da lápide gravada pelo gatilho.
+CREATE OR REPLACE FUNCTION alterar_da_agenda(
+    p_tabela TEXT,
+    p_usuario_id UUID,
+    p_filtros JSONB,
+    p_valores JSONB DEFAULT NULL
+) RETURNS JSONB AS $$
+DECLARE
+    v_chave TEXT;
+    v_filtros TEXT;
+    v_colunas_filtro TEXT;
+    v_valores TEXT;
+    v_comando TEXT;
+    v_linhas JSONB;
+BEGIN
+    v_chave := CASE p_tabela
+        WHEN 'compromissos' THEN 'id_compromisso'
+        WHEN 'agenda_locais_config' THEN 'id_agenda_local'
+        WHEN 'agenda_permissoes' THEN 'id_permissao'
+    END;
+    IF v_chave IS NULL THEN
+        RAISE EXCEPTION 'alterar_da_agenda: tabela não suportada: %', p_tabela;
+    END IF;
+    IF NOT p_filtros ? 'agenda_id' THEN
+        RAISE EXCEPTION 'alterar_da_agenda: o filtro agenda_id é obrigatório';
+    END IF;
+
+    -- Colunas como identificadores (%I) e valores convertidos pelo tipo da própria tabela
+    SELECT string_agg(format('t.%I', chave), ', '), string_agg(format('%I', chave), ', ')
+      INTO v_filtros, v_colunas_filtro FROM jsonb_object_keys(p_filtros) chave;
+    IF p_valores IS NULL THEN
+        v_comando := format(
+            'DELETE FROM %1$I t USING agendas a'
+            ' WHERE a.id_agenda = t.agenda_id AND a.usuario_id = $2'
+            ' AND (%2$s) = (SELECT %3$s FROM jsonb_populate_record(NULL::%1$I, $1))'
+            ' RETURNING t.*', p_tabela, v_filtros, v_colunas_filtro);
+    ELSE
+        SELECT string_agg(format('%I', chave), ', ') INTO v_valores FROM jsonb_object_keys(p_valores) chave;
+        v_comando := format(
+            'UPDATE %1$I t SET (%4$s) = (SELECT %4$s FROM jsonb_populate_record(NULL::%1$I, $3)) FROM agendas a'
+            ' WHERE a.id_agenda = t.agenda_id AND a.usuario_id = $2'
+            ' AND (%2$s) = (SELECT %3$s FROM jsonb_populate_record(NULL::%1$I, $1))'
+            ' RETURNING t.*', p_tabela, v_filtros, v_colunas_filtro, v_valores);
+    END IF;
+    EXECUTE format('WITH alteradas AS (%s) SELECT COALESCE(jsonb_agg(to_jsonb(alteradas)), ''[]'') FROM alteradas', v_comando)
+       INTO v_linhas USING p_filtros, p_usuario_id, p_valores;
+
+    -- As lápides do gatilho AFTER DELETE já estão visíveis a este comando
+    IF p_valores IS NULL AND p_tabela <> 'agenda_permissoes' THEN
+        SELECT COALESCE(jsonb_agg(linha || jsonb_build_object('versao_exclusao', r.versao)), '[]') INTO v_linhas
+          FROM jsonb_array_elements(v_linhas) linha
+          LEFT JOIN registros_excluidos r ON r.tabela = p_tabela AND r.id_registro = (linha->>v_chave)::UUID;
+    END IF;
+    RETURN v_linhas;
+END;
+$$ LANGUAGE plpgsql;
+
 -- =========================================
 -- FUNÇÃO PARA VERIFICAR INTEGRIDADE
 -- =========================================
@@ -182,7 +585,8 @@ BEGIN
         'agenda_locais_config', 
         'compromissos', 
         'agenda_permissoes',
-        'configuracoes_usuario'
+        'configuracoes_usuario',
+        'registros_excluidos'
     )
     GROUP BY t.table_name;
 END;
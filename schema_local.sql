@@ -0,0 +1,31 @@
+-- Preparação de um Postgres local (fora do Supabase) para o schema.sql
+-- Usado pelo backend REPOSITORIO_BACKEND=postgres em desenvolvimento e testes:
+--
+--   createdb agenda_local
+--   psql -d agenda_local -f schema_local.sql -f schema.sql
+--   POSTGRES_DSN=postgresql:///agenda_local REPOSITORIO_BACKEND=postgres flask run
+--
+-- Cria apenas o que o Supabase já fornece e o schema.sql referencia: o schema "auth"
+-- (tabela users e função uid()) e o schema "extensions" no search_path.
+
+CREATE SCHEMA IF NOT EXISTS auth;
+CREATE SCHEMA IF NOT EXISTS extensions;
+
+-- usuarios.id_usuario referencia auth.users(id)
+CREATE TABLE IF NOT EXISTS auth.users (
+  id UUID PRIMARY KEY
+);
+
+-- Usada pelas políticas RLS; sem PostgREST não há JWT, então devolve o usuário definido
+-- na sessão (SET request.jwt.claim.sub = '<uuid>') ou NULL
+CREATE OR REPLACE FUNCTION auth.uid() RETURNS UUID AS $$
+    SELECT NULLIF(current_setting('request.jwt.claim.sub', true), '')::UUID;
+$$ LANGUAGE sql STABLE;
+
+-- No Supabase o schema extensions está no search_path (uuid_generate_v4() sem prefixo)
+DO $$
+BEGIN
+    EXECUTE format('ALTER DATABASE %I SET search_path = public, extensions', current_database());
+END
+$$;
+SELECT set_config('search_path', 'public, extensions', false);
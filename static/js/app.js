@@ -70,26 +70,26 @@ function inicializarEventListeners() {
 
 // Carregamento de dados
 function carregarDados() {
-    // Carregar configurações do usuário
-    config.carregarConfiguracoes()
-        .then(() => {
+    // Uma requisição traz configurações, agendas, locais e os dados da agenda ativa
+    const agendaSalva = sessionStorage.getItem('agendaAtivaId');
+    const url = agendaSalva ? `/bootstrap?agenda=${encodeURIComponent(agendaSalva)}` : '/bootstrap';
+
+    fetch(url)
+        .then(response => response.json())
+        .then(data => {
+            if (!data.sucesso) {
+                throw new Error(data.mensagem);
+            }
+
+            // Configurações do usuário (a agenda ativa sobrescreve ao ser selecionada)
+            config.aplicarConfiguracoes(data.configuracoes);
+            workplaces.aplicarLocaisTrabalho(data.locais, data.versao_locais);
+
             // Inicializar UI de Agendas
             if (document.getElementById('activeScheduleSelector')) {
-                return initSchedules();
+                return initSchedules(data);
             }
         })
-        .then(() => {
-            // Aguardar um pequeno delay para garantir que a agenda foi selecionada
-            return new Promise(resolve => setTimeout(resolve, 100));
-        })
-        .then(() => {
-            // Carregar locais de trabalho
-            return workplaces.carregarLocaisTrabalho();
-        })
-        .then(() => {
-            // Carregar compromissos (agora baseado na agenda ativa)
-            return appointments.carregarCompromissos();
-        })
         .then(() => {
             // CORREÇÃO: Não inicializar calendário aqui, pois já foi feito ao selecionar agenda
             // Apenas renderizar compromissos se houver agenda ativa
@@ -200,9 +200,9 @@ function mostrarSeletorAgendaParaCompartilhar(agendas) {
     });
 }
 
-// Função para copiar o link para a área de transferência
-function copyShareLink() {
-    const linkInput = document.getElementById('shareLink');
+// Função para copiar o link (da página ou do calendário .ics) para a área de transferência
+function copyShareLink(inputId = 'shareLink') {
+    const linkInput = document.getElementById(inputId);
     
     // Verificar se há um link válido
     if (!linkInput.value || linkInput.value === 'Selecione uma agenda para gerar o link') {
@@ -248,14 +248,17 @@ function copyShareLink() {
 function habilitarBotoesCopia() {
     const copyBtn1 = document.getElementById('copyLinkBtn');
     const copyBtn2 = document.getElementById('copyLinkBtn2');
+    const copyBtn3 = document.getElementById('copyCalendarLinkBtn');
     const linkInput = document.getElementById('shareLink');
     
     if (linkInput.value && linkInput.value !== 'Selecione uma agenda para gerar o link') {
         if (copyBtn1) copyBtn1.disabled = false;
         if (copyBtn2) copyBtn2.disabled = false;
+        if (copyBtn3) copyBtn3.disabled = false;
     } else {
         if (copyBtn1) copyBtn1.disabled = true;
         if (copyBtn2) copyBtn2.disabled = true;
+        if (copyBtn3) copyBtn3.disabled = true;
     }
 }
 
@@ -268,6 +271,7 @@ function obterLinkCompartilhamento(agendaId) {
                 // Criar o link de compartilhamento
                 const shareLink = `${window.location.origin}/public/agenda/${data.link_publico_id}`;
                 document.getElementById('shareLink').value = shareLink;
+                document.getElementById('calendarLink').value = `${shareLink}/calendario.ics`;
                 
                 // Habilitar botões de cópia
                 habilitarBotoesCopia();
@@ -297,6 +301,7 @@ function closeShareModal() {
     document.getElementById('shareModal').classList.add('hidden');
     // Limpar o input e desabilitar botões
     document.getElementById('shareLink').value = 'Selecione uma agenda para gerar o link';
+    document.getElementById('calendarLink').value = '';
     habilitarBotoesCopia();
 }
 
@@ -5,28 +5,48 @@
 import { atualizarDadosGlobais, compromissos, locaisTrabalho } from './app.js';
 import { renderizarCompromissos } from './calendar.js';
 import { atualizarRelatorios } from './reports.js';
-import { converterTempoParaMinutos } from './utils.js';
+import { converterTempoParaMinutos, mesclarAlteracoes } from './utils.js';
 import { getActiveScheduleId } from './schedules.js';
 
-// Carregar compromissos do servidor
+// Agenda e versão refletidas na lista `compromissos`: com elas as recargas pedem ao
+// servidor só o que mudou (?since=) em vez da semana inteira
+let versaoCompromissos = { agendaId: null, versao: null };
+
+// Registrar a versão dos compromissos carregados por outra rota (ex.: /bootstrap)
+export function registrarVersaoCompromissos(agendaId, versao) {
+    versaoCompromissos = { agendaId, versao: versao ?? null };
+}
+
+// Carregar compromissos do servidor (só as alterações quando já há cache da agenda)
 export function carregarCompromissos() {
     const agendaId = getActiveScheduleId();
 
     if (!agendaId) {
         // Se não há agenda ativa, limpar compromissos
+        registrarVersaoCompromissos(null, null);
         atualizarDadosGlobais('compromissos', []);
         return Promise.resolve();
     }
 
-    return fetch(`/agendas/${agendaId}/compromissos`)
+    const incremental = versaoCompromissos.agendaId === agendaId && versaoCompromissos.versao !== null;
+    const url = incremental
+        ? `/agendas/${agendaId}/compromissos?since=${versaoCompromissos.versao}`
+        : `/agendas/${agendaId}/compromissos`;
+
+    return fetch(url)
         .then(response => response.json())
         .then(data => {
-            if (data.sucesso && data.compromissos) {
-                atualizarDadosGlobais('compromissos', data.compromissos);
-            }
+            // A agenda ativa pode ter mudado durante a requisição
+            if (!data.sucesso || !data.compromissos || getActiveScheduleId() !== agendaId) return;
+            const lista = incremental && !data.completo
+                ? mesclarAlteracoes(compromissos, data.compromissos, data.excluidos, 'id_compromisso')
+                : data.compromissos;
+            atualizarDadosGlobais('compromissos', lista);
+            registrarVersaoCompromissos(agendaId, data.versao);
         })
         .catch(error => {
             console.error('Erro ao carregar compromissos:', error);
+            registrarVersaoCompromissos(null, null);
             atualizarDadosGlobais('compromissos', []);
         });
 }
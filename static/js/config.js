@@ -14,16 +14,7 @@ export function carregarConfiguracoes() {
         .then(response => response.json())
         .then(data => {
             if (data.sucesso && data.configuracoes) {
-                const novasConfig = {
-                    diasSemana: data.configuracoes.dias_semana,
-                    horaInicioPadrao: data.configuracoes.hora_inicio_padrao,
-                    horaFimPadrao: data.configuracoes.hora_fim_padrao
-                };
-
-                atualizarDadosGlobais('configuracoes', novasConfig);
-
-                // Atualizar interface com as configurações
-                atualizarInterfaceConfiguracoes();
+                aplicarConfiguracoes(data.configuracoes);
             }
         })
         .catch(error => {
@@ -38,6 +29,20 @@ export function carregarConfiguracoes() {
         });
 }
 
+// Aplicar as configurações do usuário vindas do servidor (/configuracoes ou /bootstrap)
+export function aplicarConfiguracoes(configuracoesServidor) {
+    const novasConfig = {
+        diasSemana: configuracoesServidor.dias_semana,
+        horaInicioPadrao: configuracoesServidor.hora_inicio_padrao,
+        horaFimPadrao: configuracoesServidor.hora_fim_padrao
+    };
+
+    atualizarDadosGlobais('configuracoes', novasConfig);
+
+    // Atualizar interface com as configurações
+    atualizarInterfaceConfiguracoes();
+}
+
 // Carregar configurações da agenda ativa (sobrescreve as gerais)
 export function carregarConfiguracoesAgenda(agenda) {
     if (!agenda) return;
@@ -3,7 +3,18 @@
  */
 
 import { obterCorLocal } from './utils.js';
-import { getActiveScheduleId } from './schedules.js';
+import { getActiveSchedule, getActiveScheduleId } from './schedules.js';
+
+// Mês exibido no relatório mensal: o atual, ou o primeiro/último mês da agenda quando
+// hoje está fora da vigência (data_inicio/data_fim)
+function mesDoRelatorio(agenda) {
+    const hoje = new Date();
+    let referencia = `${hoje.getFullYear()}-${String(hoje.getMonth() + 1).padStart(2, '0')}-${String(hoje.getDate()).padStart(2, '0')}`;
+    if (agenda?.data_inicio && referencia < agenda.data_inicio.slice(0, 10)) referencia = agenda.data_inicio.slice(0, 10);
+    if (agenda?.data_fim && referencia > agenda.data_fim.slice(0, 10)) referencia = agenda.data_fim.slice(0, 10);
+    const [ano, mes] = referencia.split('-').map(Number);
+    return { ano, mes };
+}
 
 // Atualizar relatórios de acordo com o período selecionado
 export function atualizarRelatorios() {
@@ -18,9 +29,11 @@ export function atualizarRelatorios() {
     const periodo = document.getElementById('periodSelect')?.value || 'week';
 
     // Endpoint baseado no período selecionado
-    const endpoint = periodo === 'week' ?
-        `/agendas/${agendaId}/relatorios/semanal` :
-        `/agendas/${agendaId}/relatorios/mensal`;
+    let endpoint = `/agendas/${agendaId}/relatorios/semanal`;
+    if (periodo !== 'week') {
+        const { ano, mes } = mesDoRelatorio(getActiveSchedule());
+        endpoint = `/agendas/${agendaId}/relatorios/mensal?ano=${ano}&mes=${mes}`;
+    }
 
     fetch(endpoint)
         .then(response => response.json())
@@ -3,21 +3,29 @@
  */
 
 import { atualizarDadosGlobais } from './app.js';
-import { carregarCompromissos } from './appointments.js';
+import { carregarCompromissos, registrarVersaoCompromissos } from './appointments.js';
 import { renderizarCompromissos } from './calendar.js';
 import { atualizarRelatorios } from './reports.js';
+import { conectarEventosAgenda, desconectarEventosAgenda } from './sync.js';
+import { mesclarAlteracoes } from './utils.js';
 import { carregarLocaisTrabalho } from './workplaces.js';
 
 // Variável para armazenar agenda ativa
 let agendaAtiva = null;
 let agendas = [];
+// Agenda e versão da configuração financeira em sessionStorage (recargas com ?since=)
+let versaoConfigFinanceira = { agendaId: null, versao: null };
 
-// Inicializar módulo de agendas
-export function initSchedules() {
+// Inicializar módulo de agendas (com a resposta de /bootstrap, sem novas requisições)
+export function initSchedules(dadosIniciais = null) {
     console.log('Inicializando módulo de agendas...');
 
     // Carregar agendas do usuário
-    carregarAgendas().then(() => {
+    const carga = dadosIniciais
+        ? Promise.resolve(aplicarAgendas(dadosIniciais.agendas, dadosIniciais))
+        : carregarAgendas();
+
+    return carga.then(() => {
         // Configurar event listeners
         configurarEventListeners();
     });
@@ -75,25 +83,7 @@ export function carregarAgendas() {
         .then(response => response.json())
         .then(data => {
             if (data.sucesso && data.agendas) {
-                agendas = data.agendas;
-                atualizarListaAgendas();
-                atualizarSeletorAgendaAtiva();
-
-                // Se houver agendas e nenhuma estiver selecionada, selecionar a primeira
-                if (agendas.length > 0 && !agendaAtiva) {
-                    // Verificar se há uma agenda salva no sessionStorage
-                    const agendaAtivaId = sessionStorage.getItem('agendaAtivaId');
-                    if (agendaAtivaId && agendas.find(a => a.id_agenda === agendaAtivaId)) {
-                        selecionarAgendaAtiva(agendaAtivaId);
-                    } else {
-                        selecionarAgendaAtiva(agendas[0].id_agenda);
-                    }
-                } else if (agendas.length === 0) {
-                    // CORREÇÃO: Se não há agendas, limpar o calendário
-                    import('./calendar.js').then(module => {
-                        module.inicializarCalendario();
-                    });
-                }
+                aplicarAgendas(data.agendas);
             }
         })
         .catch(error => {
@@ -101,6 +91,32 @@ export function carregarAgendas() {
         });
 }
 
+// Atualizar a lista de agendas e selecionar a ativa; dadosAgenda (resposta de /bootstrap)
+// já traz os compromissos e a configuração financeira de dadosAgenda.agenda_ativa
+function aplicarAgendas(lista, dadosAgenda = null) {
+    agendas = lista;
+    atualizarListaAgendas();
+    atualizarSeletorAgendaAtiva();
+
+    // Se houver agendas e nenhuma estiver selecionada, selecionar a primeira
+    if (agendas.length > 0 && !agendaAtiva) {
+        // Verificar se há uma agenda salva no sessionStorage
+        const agendaAtivaId = sessionStorage.getItem('agendaAtivaId');
+        if (dadosAgenda && agendas.find(a => a.id_agenda === dadosAgenda.agenda_ativa)) {
+            selecionarAgendaAtiva(dadosAgenda.agenda_ativa, dadosAgenda);
+        } else if (agendaAtivaId && agendas.find(a => a.id_agenda === agendaAtivaId)) {
+            selecionarAgendaAtiva(agendaAtivaId);
+        } else {
+            selecionarAgendaAtiva(agendas[0].id_agenda);
+        }
+    } else if (agendas.length === 0) {
+        // CORREÇÃO: Se não há agendas, limpar o calendário
+        import('./calendar.js').then(module => {
+            module.inicializarCalendario();
+        });
+    }
+}
+
 // Atualizar lista de agendas no modal
 function atualizarListaAgendas() {
     const schedulesList = document.getElementById('schedulesList');
@@ -170,8 +186,8 @@ function atualizarSeletorAgendaAtiva() {
     });
 }
 
-// Selecionar agenda ativa
-function selecionarAgendaAtiva(agendaId) {
+// Selecionar agenda ativa (dadosAgenda: compromissos e configuração já carregados)
+function selecionarAgendaAtiva(agendaId, dadosAgenda = null) {
     if (!agendaId) return;
 
     agendaAtiva = agendas.find(a => a.id_agenda === agendaId);
@@ -188,10 +204,20 @@ function selecionarAgendaAtiva(agendaId) {
         });
 
         // Recarregar dados relacionados à agenda
-        Promise.all([
-            carregarCompromissosAgenda(),
-            carregarConfiguracaoFinanceira()
-        ]).then(() => {
+        const carregamento = dadosAgenda
+            ? Promise.resolve(aplicarDadosAgenda(dadosAgenda))
+            : Promise.all([
+                carregarCompromissos(),
+                carregarConfiguracaoFinanceira()
+            ]);
+
+        carregamento.then(() => {
+            // Alterações feitas em outras abas ou por outros usuários passam a chegar ao vivo;
+            // ao abrir, o stream confere pelo ?since= o que mudou desde a carga
+            if (agendaAtiva && agendaAtiva.id_agenda === agendaId) {
+                conectarEventosAgenda(agendaId, acoesEventosAgenda);
+            }
+
             // CORREÇÃO: Inicializar calendário antes de renderizar compromissos
             import('./calendar.js').then(module => {
                 module.inicializarCalendario();
@@ -202,33 +228,87 @@ function selecionarAgendaAtiva(agendaId) {
     }
 }
 
-// Carregar compromissos da agenda ativa
-function carregarCompromissosAgenda() {
-    if (!agendaAtiva) return Promise.resolve();
-
-    return fetch(`/agendas/${agendaAtiva.id_agenda}/compromissos`)
-        .then(response => response.json())
-        .then(data => {
-            if (data.sucesso && data.compromissos) {
-                atualizarDadosGlobais('compromissos', data.compromissos);
-            }
-        });
-}
-
-// Carregar configuração financeira da agenda
+// Carregar configuração financeira da agenda (só as alterações quando já está em cache)
 function carregarConfiguracaoFinanceira() {
     if (!agendaAtiva) return Promise.resolve();
 
-    return fetch(`/agendas/${agendaAtiva.id_agenda}/locais_config`)
+    const agendaId = agendaAtiva.id_agenda;
+    const incremental = versaoConfigFinanceira.agendaId === agendaId && versaoConfigFinanceira.versao !== null;
+    const url = incremental
+        ? `/agendas/${agendaId}/locais_config?since=${versaoConfigFinanceira.versao}`
+        : `/agendas/${agendaId}/locais_config`;
+
+    return fetch(url)
         .then(response => response.json())
         .then(data => {
             if (data.sucesso && data.configuracoes) {
+                const configuracoes = incremental && !data.completo
+                    ? mesclarAlteracoes(JSON.parse(sessionStorage.getItem('configFinanceiraAgenda') || '[]'),
+                        data.configuracoes, data.excluidos, 'id_agenda_local')
+                    : data.configuracoes;
                 // Armazenar configurações para uso nos relatórios
-                sessionStorage.setItem('configFinanceiraAgenda', JSON.stringify(data.configuracoes));
+                sessionStorage.setItem('configFinanceiraAgenda', JSON.stringify(configuracoes));
+                versaoConfigFinanceira = { agendaId, versao: data.versao ?? null };
             }
         });
 }
 
+// Reações aos eventos ao vivo da agenda ativa (sync.js)
+const acoesEventosAgenda = {
+    ressincronizar() {
+        return Promise.all([carregarCompromissos(), carregarConfiguracaoFinanceira()]).then(() => {
+            renderizarCompromissos();
+            atualizarRelatorios();
+        });
+    },
+    configuracao(configuracoes, excluidos) {
+        const atuais = JSON.parse(sessionStorage.getItem('configFinanceiraAgenda') || '[]');
+        sessionStorage.setItem('configFinanceiraAgenda',
+            JSON.stringify(mesclarAlteracoes(atuais, configuracoes, excluidos, 'id_agenda_local')));
+        atualizarRelatorios();
+    },
+    agenda(agendaAtualizada) {
+        const agenda = agendas.find(a => a.id_agenda === agendaAtualizada.id_agenda);
+        if (agenda) Object.assign(agenda, agendaAtualizada);
+        if (agendaAtiva && agendaAtiva.id_agenda === agendaAtualizada.id_agenda) {
+            atualizarDadosGlobais('configuracoes', {
+                diasSemana: agendaAtiva.dias_semana || [1, 2, 3, 4, 5],
+                horaInicioPadrao: agendaAtiva.hora_inicio_padrao || '07:00',
+                horaFimPadrao: agendaAtiva.hora_fim_padrao || '23:00'
+            });
+            import('./calendar.js').then(module => {
+                module.inicializarCalendario();
+                module.renderizarCompromissos();
+            });
+        }
+        atualizarListaAgendas();
+        atualizarSeletorAgendaAtiva();
+    },
+    acessoPerdido(mensagem) {
+        agendaAtiva = null;
+        sessionStorage.removeItem('agendaAtivaId');
+        atualizarDadosGlobais('compromissos', []);
+        registrarVersaoCompromissos(null, null);
+        renderizarCompromissos();
+        atualizarRelatorios();
+        carregarAgendas();
+        Swal.fire({
+            icon: 'info',
+            title: 'Agenda indisponível',
+            text: mensagem
+        });
+    }
+};
+
+// Aplicar compromissos e configuração financeira da agenda vindos de /bootstrap
+function aplicarDadosAgenda(dados) {
+    atualizarDadosGlobais('compromissos', dados.compromissos);
+    registrarVersaoCompromissos(dados.agenda_ativa, dados.versao_agenda);
+    // Armazenar configurações para uso nos relatórios
+    sessionStorage.setItem('configFinanceiraAgenda', JSON.stringify(dados.locais_config));
+    versaoConfigFinanceira = { agendaId: dados.agenda_ativa, versao: dados.versao_agenda ?? null };
+}
+
 // Mostrar formulário de nova agenda
 function mostrarFormularioNovaAgenda() {
     document.getElementById('scheduleFormTitle').textContent = 'Nova Agenda';
@@ -794,7 +874,9 @@ window.excluirAgenda = function (agendaId) {
                         if (agendaAtiva && agendaAtiva.id_agenda === agendaId) {
                             agendaAtiva = null;
                             sessionStorage.removeItem('agendaAtivaId');
+                            desconectarEventosAgenda();
                             atualizarDadosGlobais('compromissos', []);
+                            registrarVersaoCompromissos(null, null);
                             renderizarCompromissos();
                             atualizarRelatorios();
                         }
@@ -0,0 +1,77 @@
+/**
+ * Agenda de Trabalho - Atualizações ao vivo da agenda ativa (SSE)
+ */
+
+import { atualizarDadosGlobais, compromissos } from './app.js';
+import { renderizarCompromissos } from './calendar.js';
+import { atualizarRelatorios } from './reports.js';
+import { mesclarAlteracoes } from './utils.js';
+
+// Espera antes de tentar de novo quando o servidor recusa o stream (limite de conexões)
+const ESPERA_RECONEXAO_MS = 30000;
+
+let fonte = null;
+let agendaConectada = null;
+let temporizador = null;
+
+// Acompanhar as alterações da agenda. `acoes` vem de schedules.js:
+// configuracao(configuracoes, excluidos), agenda(agenda), ressincronizar() e acessoPerdido(mensagem)
+export function conectarEventosAgenda(agendaId, acoes) {
+    desconectarEventosAgenda();
+    if (!agendaId || typeof EventSource === 'undefined') return;
+
+    agendaConectada = agendaId;
+    fonte = new EventSource(`/agendas/${agendaId}/eventos`);
+
+    // A cada (re)conexão, buscar o que mudou enquanto o stream esteve fechado (?since=)
+    fonte.addEventListener('open', () => acoes.ressincronizar());
+
+    fonte.addEventListener('compromisso_criado', evento => aplicarCompromissos([lerDados(evento).compromisso], []));
+    fonte.addEventListener('compromisso_atualizado', evento => aplicarCompromissos([lerDados(evento).compromisso], []));
+    fonte.addEventListener('compromisso_excluido', evento => aplicarCompromissos([], [lerDados(evento).id_compromisso]));
+    fonte.addEventListener('configuracao_alterada', evento => {
+        const dados = lerDados(evento);
+        acoes.configuracao(dados.configuracoes, dados.excluidos);
+    });
+    fonte.addEventListener('agenda_atualizada', evento => acoes.agenda(lerDados(evento).agenda));
+    fonte.addEventListener('ressincronizar', () => acoes.ressincronizar());
+    fonte.addEventListener('permissao_revogada', () => {
+        desconectarEventosAgenda();
+        acoes.acessoPerdido('Seu acesso a esta agenda foi revogado.');
+    });
+    fonte.addEventListener('agenda_excluida', () => {
+        desconectarEventosAgenda();
+        acoes.acessoPerdido('Esta agenda foi excluída.');
+    });
+
+    fonte.addEventListener('error', () => {
+        // O navegador reconecta sozinho quando o stream termina; uma resposta de erro
+        // (ex.: 503 por limite de conexões) fecha a fonte, e a nova tentativa fica por nossa conta
+        if (fonte && fonte.readyState === EventSource.CLOSED) {
+            fonte = null;
+            temporizador = setTimeout(() => {
+                if (agendaConectada === agendaId) conectarEventosAgenda(agendaId, acoes);
+            }, ESPERA_RECONEXAO_MS);
+        }
+    });
+}
+
+export function desconectarEventosAgenda() {
+    clearTimeout(temporizador);
+    temporizador = null;
+    if (fonte) fonte.close();
+    fonte = null;
+    agendaConectada = null;
+}
+
+function lerDados(evento) {
+    return JSON.parse(evento.data);
+}
+
+// Os eventos trazem as linhas como o ?since= traria; a versão registrada não muda, então a
+// próxima recarga incremental ainda confere tudo o que veio por aqui
+function aplicarCompromissos(alterados, excluidos) {
+    atualizarDadosGlobais('compromissos', mesclarAlteracoes(compromissos, alterados, excluidos, 'id_compromisso'));
+    renderizarCompromissos();
+    atualizarRelatorios();
+}
@@ -11,6 +11,15 @@ export function converterTempoParaMinutos(tempo) {
     return horas * 60 + minutos;
 }
 
+// Aplicar uma resposta incremental (?since=) a uma lista em cache: tira os ids excluídos e
+// substitui ou acrescenta as linhas alteradas, identificadas pela coluna `chave`
+export function mesclarAlteracoes(lista, alteradas, excluidos, chave) {
+    const removidos = new Set(excluidos || []);
+    const porId = new Map(lista.filter(item => !removidos.has(item[chave])).map(item => [item[chave], item]));
+    alteradas.forEach(item => porId.set(item[chave], item));
+    return Array.from(porId.values());
+}
+
 // Obter cor associada a um local de trabalho pelo nome
 export function obterCorLocal(nomeLocal) {
     const local = locaisTrabalho.find(l => l.nome === nomeLocal);
@@ -6,19 +6,33 @@ import { atualizarDadosGlobais, locaisTrabalho } from './app.js';
 import { carregarCompromissos } from './appointments.js';
 import { renderizarCompromissos } from './calendar.js';
 import { atualizarRelatorios } from './reports.js';
+import { mesclarAlteracoes } from './utils.js';
 
-// Carregar locais de trabalho do servidor
+// Versão dos locais em `locaisTrabalho` (null: recarregar tudo)
+let versaoLocais = null;
+
+// Carregar locais de trabalho do servidor (só as alterações quando já há versão)
 export function carregarLocaisTrabalho() {
-    return fetch('/locais')
+    const incremental = versaoLocais !== null;
+    return fetch(incremental ? `/locais?since=${versaoLocais}` : '/locais')
         .then(response => response.json())
         .then(data => {
             if (data.sucesso && data.locais) {
-                atualizarDadosGlobais('locaisTrabalho', data.locais);
-                atualizarInterfaceLocaisTrabalho();
+                const locais = incremental && !data.completo
+                    ? mesclarAlteracoes(locaisTrabalho, data.locais, data.excluidos, 'id_local')
+                    : data.locais;
+                aplicarLocaisTrabalho(locais, data.versao);
             }
         });
 }
 
+// Aplicar os locais de trabalho vindos do servidor (/locais ou /bootstrap)
+export function aplicarLocaisTrabalho(locais, versao = null) {
+    versaoLocais = versao ?? null;
+    atualizarDadosGlobais('locaisTrabalho', locais);
+    atualizarInterfaceLocaisTrabalho();
+}
+
 // Atualizar interface com os locais de trabalho
 export function atualizarInterfaceLocaisTrabalho() {
     // Atualizar lista de locais de trabalho
@@ -1,5 +1,8 @@
 import os
-from supabase import create_client, Client
+import httpx
+from supabase import create_client, Client, ClientOptions
+from postgrest import SyncPostgrestClient
+from supabase_auth import SyncGoTrueClient
 from dotenv import load_dotenv
 
 # Carregar variáveis de ambiente (apenas tem efeito em desenvolvimento local)
@@ -32,9 +35,56 @@ if not SUPABASE_URL or not SUPABASE_KEY:
     
     raise ValueError(error_msg)
 
+# Pool HTTP compartilhado por todos os clientes do processo (keep-alive entre requisições).
+# httpx.Client é seguro entre threads; os clientes abaixo só guardam URL e cabeçalhos.
+SUPABASE_HTTP_MAX_CONNECTIONS = int(os.getenv('SUPABASE_HTTP_MAX_CONNECTIONS', '100'))
+SUPABASE_HTTP_MAX_KEEPALIVE = int(os.getenv('SUPABASE_HTTP_MAX_KEEPALIVE', '20'))
+
+http_pool = httpx.Client(
+    limits=httpx.Limits(
+        max_connections=SUPABASE_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=SUPABASE_HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=30
+    ),
+    timeout=httpx.Timeout(30.0),
+    follow_redirects=True
+)
+
 # Criar cliente
+# Cliente compartilhado do servidor: nunca faz login, então seu estado de autenticação
+# não muda entre requisições (seguro com workers com várias threads)
 try:
-    supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    supabase_client = create_client(
+        SUPABASE_URL,
+        SUPABASE_KEY,
+        options=ClientOptions(httpx_client=http_pool, auto_refresh_token=False, persist_session=False)
+    )
     print(f"Supabase client criado com sucesso! (Vercel: {is_vercel})")
 except Exception as e:
-    raise ValueError(f"Erro ao criar cliente Supabase: {str(e)}")
\ No newline at end of file
+    raise ValueError(f"Erro ao criar cliente Supabase: {str(e)}")
+
+
+def criar_cliente_auth():
+    """
+    Cliente do Supabase Auth descartável (sessão só em memória, sem auto refresh) para
+    registro, login, refresh e logout, sem tocar no estado do supabase_client compartilhado.
+    """
+    return SyncGoTrueClient(
+        url=f"{SUPABASE_URL}/auth/v1",
+        headers={"apikey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}"},
+        auto_refresh_token=False,
+        persist_session=False,
+        http_client=http_pool
+    )
+
+
+def cliente_do_usuario(access_token):
+    """
+    Cliente PostgREST leve ligado ao JWT do usuário (as políticas de RLS se aplicam a ele),
+    usando o pool HTTP compartilhado. Criar um por requisição é barato.
+    """
+    return SyncPostgrestClient(
+        f"{SUPABASE_URL}/rest/v1",
+        headers={"apikey": SUPABASE_KEY, "Authorization": f"Bearer {access_token}"},
+        http_client=http_pool
+    )
\ No newline at end of file
@@ -0,0 +1,121 @@
+import os
+import sys
+
+import pytest
+from supabase import ClientOptions, create_client
+
+# A raiz do repositório no caminho de import (app.py, benchmarks/...)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.postgrest_local import BancoEmMemoria, iniciar_em_thread  # noqa: E402
+from benchmarks.supabase_falso import ClienteSupabaseFalso  # noqa: E402
+
+# Orçamentos de consultas por rota (liga o detector antes de o app ser importado)
+pytest_plugins = ['pytest_consultas']
+
+# O app exige as variáveis do Supabase ao ser importado; nos testes o cliente é substituído
+os.environ.setdefault('SUPABASE_URL', 'http://localhost:54321')
+os.environ.setdefault('SUPABASE_KEY', 'chave-testes')
+os.environ.setdefault('METRICAS', '0')
+
+USUARIO_ID = 'usuario-1'
+AGENDA_ID = 'agenda-1'
+CONVIDADO_ID = 'usuario-2'
+CHAVE_LOCAL = 'eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.x'
+
+
+def tabelas_basicas():
+    """Um usuário com dois locais relacionados e uma agenda com dois compromissos e valores/hora."""
+    return {
+        'agendas': [{'id_agenda': AGENDA_ID, 'usuario_id': USUARIO_ID, 'nome': 'Agenda', 'data_inicio': '2026-02-01',
+                     'data_fim': '2026-12-15', 'dias_semana': [1, 2, 3, 4, 5], 'hora_inicio_padrao': '07:00:00',
+                     'hora_fim_padrao': '23:00:00', 'link_publico_id': 'link-1'}],
+        'locais_trabalho': [
+            {'id_local': 'local-a', 'usuario_id': USUARIO_ID, 'nome': 'Escola A', 'cor': '#111111',
+             'acrescimo_ha_percent': 0, 'periodo_carencia': 60, 'relacionado_com': None},
+            {'id_local': 'local-b', 'usuario_id': USUARIO_ID, 'nome': 'Escola B', 'cor': '#222222',
+             'acrescimo_ha_percent': 10, 'periodo_carencia': 30, 'relacionado_com': 'local-a'},
+        ],
+        'compromissos': [
+            {'id_compromisso': 'comp-1', 'agenda_id': AGENDA_ID, 'local_id': 'local-a', 'dia_semana': 1,
+             'hora_inicio': '08:00:00', 'hora_fim': '10:00:00', 'duracao': 2.0, 'tipo_hora': 'HA', 'descricao': None},
+            {'id_compromisso': 'comp-2', 'agenda_id': AGENDA_ID, 'local_id': 'local-b', 'dia_semana': 2,
+             'hora_inicio': '14:00:00', 'hora_fim': '15:00:00', 'duracao': 1.0, 'tipo_hora': 'HT', 'descricao': None},
+        ],
+        'agenda_locais_config': [
+            {'id_agenda_local': 'config-a', 'agenda_id': AGENDA_ID, 'local_id': 'local-a', 'valor_hora': 50.0},
+            {'id_agenda_local': 'config-b', 'agenda_id': AGENDA_ID, 'local_id': 'local-b', 'valor_hora': 40.0},
+        ],
+        'agenda_permissoes': [],
+    }
+
+
+@pytest.fixture
+def aplicacao():
+    """O módulo app, importado na primeira fixture (depois da configuração dos plugins)."""
+    import app as aplicacao
+
+    aplicacao.app.config['TESTING'] = True
+    return aplicacao
+
+
+@pytest.fixture
+def limpar_caches(aplicacao):
+    """Esvazia os caches em memória do processo antes e depois do teste."""
+    def limpar():
+        with aplicacao._workplace_group_indexes_lock:
+            aplicacao._workplace_group_indexes.clear()
+        aplicacao._report_aggregates.clear()
+        aplicacao._agenda_access_cache.clear()
+        aplicacao._public_agenda_cache.clear()
+        aplicacao._calendario_cache.clear()
+
+    limpar()
+    yield
+    limpar()
+
+
+@pytest.fixture
+def banco(aplicacao, limpar_caches, monkeypatch):
+    """Supabase em memória no lugar do supabase_client, com a validação feita no app."""
+    cliente = ClienteSupabaseFalso(tabelas_basicas())
+    monkeypatch.setattr(aplicacao, 'supabase_client', cliente)
+    monkeypatch.setattr(aplicacao, 'VALIDACAO_NO_BANCO', False)
+    return cliente
+
+
+@pytest.fixture
+def supabase_local(aplicacao, limpar_caches, monkeypatch):
+    """
+    O app apontado para o substituto local do Supabase (com os gatilhos de versionamento),
+    com as tabelas_basicas e um convidado na agenda.
+    """
+    tabelas = tabelas_basicas()
+    tabelas['usuarios'] = [
+        {'id_usuario': USUARIO_ID, 'cpf': '00000000001', 'nome': 'Dono', 'email': 'dono@testes.local'},
+        {'id_usuario': CONVIDADO_ID, 'cpf': '00000000002', 'nome': 'Convidado', 'email': 'convidado@testes.local'},
+    ]
+    tabelas['agenda_permissoes'] = [{
+        'id_permissao': 'permissao-1', 'agenda_id': AGENDA_ID, 'usuario_concedeu_id': USUARIO_ID,
+        'usuario_recebeu_id': CONVIDADO_ID, 'status': 'ativo'
+    }]
+    banco = BancoEmMemoria(tabelas)
+    servidor, url = iniciar_em_thread(banco)
+    cliente = create_client(url, CHAVE_LOCAL, options=ClientOptions(auto_refresh_token=False, persist_session=False))
+    monkeypatch.setattr(aplicacao, 'supabase_client', cliente)
+    monkeypatch.setattr(aplicacao, 'VALIDACAO_NO_BANCO', False)
+    yield banco
+    servidor.shutdown()
+    servidor.server_close()
+
+
+@pytest.fixture
+def cliente_http(aplicacao, banco):
+    cliente = aplicacao.app.test_client()
+    entrar(cliente, USUARIO_ID)
+    return cliente
+
+
+def entrar(cliente_http, usuario_id):
+    with cliente_http.session_transaction() as sessao:
+        sessao['usuario_id'] = usuario_id
@@ -0,0 +1,51 @@
+import time
+
+import pytest
+
+LINK = 'link-1'
+
+
+@pytest.fixture
+def publico(aplicacao, banco):
+    return aplicacao.app.test_client()
+
+
+def _leituras(banco):
+    return {tabela: banco.chamadas[(tabela, 'select')] for tabela in ('agendas', 'compromissos', 'locais_trabalho')}
+
+
+def test_payload_em_cache_e_304_com_etag(publico, banco):
+    primeira = publico.get(f'/api/public/agenda/{LINK}')
+    assert primeira.status_code == 200
+    leituras = _leituras(banco)
+
+    segunda = publico.get(f'/api/public/agenda/{LINK}', headers={'If-None-Match': primeira.headers['ETag']})
+
+    assert segunda.status_code == 304
+    assert _leituras(banco) == leituras
+
+
+def test_versao_reconferida_no_banco_apos_o_intervalo(aplicacao, publico, banco, monkeypatch):
+    monkeypatch.setattr(aplicacao, 'PUBLIC_AGENDA_REVALIDAR', 0)
+    primeira = publico.get(f'/api/public/agenda/{LINK}')
+
+    # Mesma versão: só a leitura da versão, e o mesmo ETag
+    banco.zerar_chamadas()
+    segunda = publico.get(f'/api/public/agenda/{LINK}', headers={'If-None-Match': primeira.headers['ETag']})
+    assert segunda.status_code == 304
+    assert _leituras(banco) == {'agendas': 1, 'compromissos': 0, 'locais_trabalho': 0}
+
+    # Outro worker alterou a agenda: a versão no banco mudou e o payload é refeito
+    agenda = banco.tabelas['agendas'][0]
+    agenda['nome'], agenda['versao'] = 'Agenda renomeada', 2
+    terceira = publico.get(f'/api/public/agenda/{LINK}', headers={'If-None-Match': primeira.headers['ETag']})
+    assert terceira.status_code == 200
+    assert terceira.get_json()['agenda_nome'] == 'Agenda renomeada'
+    assert terceira.headers['ETag'] != primeira.headers['ETag']
+
+
+def test_link_inexistente_fica_pouco_tempo_em_cache(aplicacao, publico):
+    assert publico.get('/api/public/agenda/nao-existe').status_code == 404
+
+    _, expira_em = aplicacao._public_agenda_cache._data['nao-existe']
+    assert expira_em - time.monotonic() <= aplicacao.PUBLIC_AGENDA_REVALIDAR
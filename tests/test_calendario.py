@@ -0,0 +1,83 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from conftest import AGENDA_ID, USUARIO_ID, entrar
+
+FEED = '/public/agenda/link-1/calendario.ics'
+
+
+@pytest.fixture
+def assinante(aplicacao, supabase_local):
+    return aplicacao.app.test_client()
+
+
+def _atualizado_em(banco):
+    """O Last-Modified esperado: o updated_at mais recente entre a agenda e os locais do dono."""
+    agenda = banco.tabelas['agendas'][0]
+    dono = next(usuario for usuario in banco.tabelas['usuarios'] if usuario['id_usuario'] == USUARIO_ID)
+    return max(datetime.fromisoformat(valor) for valor in (agenda['updated_at'], dono['updated_at_locais'])).replace(microsecond=0)
+
+
+def test_feed_com_os_compromissos_semanais(assinante):
+    resposta = assinante.get(FEED)
+
+    assert resposta.status_code == 200
+    assert resposta.mimetype == 'text/calendar'
+    texto = resposta.get_data(as_text=True)
+    assert texto.count('BEGIN:VEVENT') == 2
+    assert 'RRULE:FREQ=WEEKLY;UNTIL=20261215T235959' in texto
+
+
+def test_last_modified_vem_do_banco_e_e_o_mesmo_em_todos_os_processos(aplicacao, assinante, supabase_local):
+    supabase_local.tabelas['agendas'][0]['updated_at'] = '2026-03-01T12:00:00.250000+00:00'
+    for usuario in supabase_local.tabelas['usuarios']:
+        usuario['updated_at_locais'] = '2026-02-01T08:00:00+00:00'
+    primeira = assinante.get(FEED)
+    # Outro processo: sem o validador em memória, chega ao mesmo ETag e Last-Modified
+    aplicacao._calendario_cache.clear()
+    segunda = assinante.get(FEED)
+
+    assert primeira.last_modified == segunda.last_modified == datetime(2026, 3, 1, 12, 0, tzinfo=timezone.utc)
+    assert primeira.headers['ETag'] == segunda.headers['ETag']
+
+
+@pytest.mark.parametrize('cabecalho, valor', [
+    ('If-None-Match', lambda resposta: resposta.headers['ETag']),
+    ('If-Modified-Since', lambda resposta: resposta.headers['Last-Modified']),
+])
+def test_validador_atual_responde_304_sem_ler_os_compromissos(assinante, supabase_local, cabecalho, valor):
+    primeira = assinante.get(FEED)
+    supabase_local.zerar_chamadas()
+
+    segunda = assinante.get(FEED, headers={cabecalho: valor(primeira)})
+
+    assert segunda.status_code == 304
+    assert segunda.headers['ETag'] == primeira.headers['ETag']
+    assert not segunda.get_data()
+    assert supabase_local.total_chamadas() == 0
+
+
+def test_alteracao_muda_o_validador(aplicacao, assinante, supabase_local):
+    primeira = assinante.get(FEED)
+    dono = aplicacao.app.test_client()
+    entrar(dono, USUARIO_ID)
+    assert dono.delete(f'/agendas/{AGENDA_ID}/compromissos/comp-2').status_code == 200
+
+    segunda = assinante.get(FEED, headers={'If-None-Match': primeira.headers['ETag']})
+
+    assert segunda.status_code == 200
+    assert segunda.get_data(as_text=True).count('BEGIN:VEVENT') == 1
+    assert segunda.headers['ETag'] != primeira.headers['ETag']
+    assert segunda.last_modified == _atualizado_em(supabase_local) >= primeira.last_modified
+
+
+def test_feed_privado_exige_acesso(aplicacao, supabase_local):
+    assert aplicacao.app.test_client().get(f'/agendas/{AGENDA_ID}/calendario.ics').status_code == 302
+    dono = aplicacao.app.test_client()
+    entrar(dono, USUARIO_ID)
+
+    resposta = dono.get(f'/agendas/{AGENDA_ID}/calendario.ics')
+
+    assert resposta.status_code == 200
+    assert resposta.headers['Cache-Control'] == 'private, no-cache'
@@ -0,0 +1,46 @@
+def _indice(aplicacao):
+    # Cadeia a <- b <- c e um local isolado d
+    return aplicacao._WorkplaceGroupIndex([
+        {'id_local': 'a', 'relacionado_com': None},
+        {'id_local': 'b', 'relacionado_com': 'a'},
+        {'id_local': 'c', 'relacionado_com': 'b'},
+        {'id_local': 'd', 'relacionado_com': None},
+    ])
+
+
+def test_grupos_sao_transitivos(aplicacao):
+    indice = _indice(aplicacao)
+
+    assert indice.group_of('c') == {'a', 'b', 'c'}
+    assert indice.group_of('d') == {'d'}
+    assert indice.group_of('desconhecido') == frozenset()
+
+
+def test_alteracoes_devolvem_um_indice_novo(aplicacao):
+    indice = _indice(aplicacao)
+
+    com_e = indice.with_workplace('e', 'd')
+    sem_b = indice.without_workplace('b')
+    religado = indice.with_relation('d', 'c')
+
+    assert com_e.group_of('d') == {'d', 'e'}
+    assert sem_b.group_of('a') == {'a'} and sem_b.group_of('c') == {'c'}
+    assert religado.group_of('a') == {'a', 'b', 'c', 'd'}
+    # O índice original, que leitores podem estar usando sem lock, não muda
+    assert indice.group_of('c') == {'a', 'b', 'c'}
+    assert indice.group_of('d') == {'d'}
+    assert 'e' not in indice.relacionado_com
+    assert com_e.loaded_at == indice.loaded_at
+
+
+def test_troca_no_cache_so_com_indice_carregado(aplicacao, limpar_caches):
+    aplicacao._replace_workplace_group_index('usuario-1', lambda grupos: grupos.with_workplace('e'))
+    assert aplicacao._cached_workplace_group_index('usuario-1') is None
+
+    indice = _indice(aplicacao)
+    aplicacao._store_workplace_group_index('usuario-1', indice)
+    aplicacao._replace_workplace_group_index('usuario-1', lambda grupos: grupos.with_workplace('e', 'a'))
+
+    atual = aplicacao._cached_workplace_group_index('usuario-1')
+    assert atual is not indice
+    assert atual.group_of('e') == {'a', 'b', 'c', 'e'}
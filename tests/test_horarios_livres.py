@@ -0,0 +1,45 @@
+import pytest
+
+from conftest import AGENDA_ID, entrar
+
+
+@pytest.mark.parametrize('dia_semana', ['abc', '9', '-1', '1.5', ''])
+def test_dia_semana_invalido_responde_400(cliente_http, dia_semana):
+    resposta = cliente_http.get(f'/agendas/{AGENDA_ID}/horarios_livres',
+                                query_string={'local_id': 'local-a', 'duracao': 1, 'dia_semana': dia_semana})
+
+    assert resposta.status_code == 400
+    assert 'dia_semana' in resposta.get_json()['mensagem']
+
+
+def test_horarios_livres_de_um_dia(cliente_http):
+    resposta = cliente_http.get(f'/agendas/{AGENDA_ID}/horarios_livres',
+                                query_string={'local_id': 'local-a', 'duracao': 1, 'dia_semana': 1, 'passo': 60})
+
+    corpo = resposta.get_json()
+    assert resposta.status_code == 200, corpo
+    inicios = [horario['hora_inicio'] for horario in corpo['horarios']]
+    assert {horario['dia_semana'] for horario in corpo['horarios']} == {1}
+    # 08:00-10:00 está ocupado
+    assert '08:00' not in inicios and '09:00' not in inicios
+    assert '10:00' in inicios
+
+
+def test_limite_diario_com_local_relacionado_fora_do_snapshot(aplicacao, banco):
+    # Um local relacionado que não está entre os locais do usuário não derruba a mensagem
+    snapshot = aplicacao._ValidationSnapshot(banco, AGENDA_ID, 'usuario-1')
+    snapshot.workplace_groups = snapshot.workplace_groups.with_workplace('local-x', 'local-a')
+    snapshot.days[1].duration_by_local['local-x'] = 6.0
+
+    mensagem = aplicacao._appointment_rule_violation(snapshot, 'local-a', 1, 11 * 60, 12 * 60, 1.0)
+
+    assert 'local-x' in mensagem
+
+
+def test_agenda_de_outro_usuario_responde_404(aplicacao, banco):
+    cliente = aplicacao.app.test_client()
+    entrar(cliente, 'usuario-2')
+
+    resposta = cliente.get(f'/agendas/{AGENDA_ID}/horarios_livres', query_string={'local_id': 'local-a', 'duracao': 1})
+
+    assert resposta.status_code == 404
@@ -0,0 +1,67 @@
+import pytest
+
+from benchmarks.supabase_falso import ConsultaFalsa, RespostaFalsa
+from conftest import AGENDA_ID
+
+ITENS = [
+    {'local_id': 'local-a', 'dia_semana': 3, 'hora_inicio': '08:00', 'hora_fim': '09:00', 'duracao': 1, 'tipo_hora': 'HA'},
+    {'local_id': 'local-a', 'dia_semana': 3, 'hora_inicio': '08:30', 'hora_fim': '09:30', 'duracao': 1, 'tipo_hora': 'HA'},
+    {'local_id': 'local-b', 'dia_semana': 4, 'hora_inicio': '10:00', 'hora_fim': '11:00', 'duracao': 1, 'tipo_hora': 'HT'},
+]
+
+
+@pytest.fixture
+def eventos(aplicacao, monkeypatch):
+    publicados = []
+    monkeypatch.setattr(aplicacao, '_publicar_evento', lambda agenda_id, tipo, **dados: publicados.append(tipo))
+    return publicados
+
+
+def test_lote_insere_os_aceitos_e_rejeita_o_conflito_interno(cliente_http, banco, eventos):
+    resposta = cliente_http.post(f'/agendas/{AGENDA_ID}/compromissos/lote', json={'compromissos': ITENS})
+
+    corpo = resposta.get_json()
+    assert resposta.status_code == 201, corpo
+    assert [resultado['sucesso'] for resultado in corpo['resultados']] == [True, False, True]
+    assert all('compromisso' in corpo['resultados'][i] for i in (0, 2))
+    assert banco.chamadas[('compromissos', 'insert')] == 1
+    assert eventos == ['compromisso_criado', 'compromisso_criado']
+
+
+def test_lote_com_contagem_divergente_nao_confirma_nenhum_item(cliente_http, banco, eventos, monkeypatch):
+    executar = ConsultaFalsa.execute
+
+    def insercao_incompleta(consulta):
+        resposta = executar(consulta)
+        if consulta._operacao == 'insert':
+            return RespostaFalsa(resposta.data[:-1])
+        return resposta
+
+    monkeypatch.setattr(ConsultaFalsa, 'execute', insercao_incompleta)
+
+    resposta = cliente_http.post(f'/agendas/{AGENDA_ID}/compromissos/lote', json={'compromissos': ITENS})
+
+    corpo = resposta.get_json()
+    assert resposta.status_code == 400
+    assert [resultado['sucesso'] for resultado in corpo['resultados']] == [False, False, False]
+    assert not any('compromisso' in resultado for resultado in corpo['resultados'])
+    assert eventos == ['ressincronizar']
+
+
+@pytest.mark.parametrize('invalido, campo', [
+    ({'dia_semana': 9}, 'dia_semana'),
+    ({'tipo_hora': 'XX'}, 'tipo_hora'),
+    ({'hora_inicio': '11:00', 'hora_fim': '10:00'}, 'início'),
+    ({'hora_inicio': '25:00'}, 'hora_inicio'),
+])
+def test_lote_rejeita_so_os_itens_que_violam_as_restricoes_das_colunas(cliente_http, banco, eventos, invalido, campo):
+    itens = [ITENS[0], {**ITENS[2], **invalido}]
+
+    resposta = cliente_http.post(f'/agendas/{AGENDA_ID}/compromissos/lote', json={'compromissos': itens})
+
+    corpo = resposta.get_json()
+    assert resposta.status_code == 201, corpo
+    assert [resultado['sucesso'] for resultado in corpo['resultados']] == [True, False]
+    assert campo in corpo['resultados'][1]['mensagem']
+    assert len([c for c in banco.tabelas['compromissos'] if c['dia_semana'] == 3]) == 1
+    assert eventos == ['compromisso_criado']
@@ -0,0 +1,29 @@
+import pytest
+
+
+# /debug/consultas existe com o detector ligado (pytest_consultas) e usa o mesmo token
+ROTAS_COM_TOKEN = ['/metrics', '/debug/consultas']
+
+
+@pytest.mark.parametrize('url', ROTAS_COM_TOKEN)
+def test_metricas_sem_token_configurado_nao_sao_expostas(aplicacao, monkeypatch, url):
+    monkeypatch.setattr(aplicacao, 'METRICS_TOKEN', None)
+
+    assert aplicacao.app.test_client().get(url).status_code == 404
+
+
+@pytest.mark.parametrize('url', ROTAS_COM_TOKEN)
+def test_metricas_exigem_o_token(aplicacao, monkeypatch, url):
+    monkeypatch.setattr(aplicacao, 'METRICS_TOKEN', 'segredo')
+    cliente = aplicacao.app.test_client()
+
+    assert cliente.get(url).status_code == 401
+    assert cliente.get(url, headers={'Authorization': 'Bearer outro'}).status_code == 401
+    assert cliente.get(url, headers={'Authorization': 'Bearer segredo'}).status_code == 200
+
+
+def test_metricas_no_formato_do_prometheus(aplicacao, monkeypatch):
+    monkeypatch.setattr(aplicacao, 'METRICS_TOKEN', 'segredo')
+
+    resposta = aplicacao.app.test_client().get('/metrics', headers={'Authorization': 'Bearer segredo'})
+    assert resposta.content_type.startswith('text/plain')
@@ -0,0 +1,62 @@
+import pytest
+
+from conftest import AGENDA_ID, USUARIO_ID, entrar
+
+OCORRENCIAS = f'/agendas/{AGENDA_ID}/ocorrencias'
+
+
+@pytest.fixture
+def cliente(aplicacao, supabase_local):
+    cliente = aplicacao.app.test_client()
+    entrar(cliente, USUARIO_ID)
+    return cliente
+
+
+def _paginas(cliente, consulta, limite):
+    """Segue proximo_cursor até o fim; devolve as páginas (listas de ocorrências)."""
+    paginas, cursor = [], None
+    while True:
+        url = f'{OCORRENCIAS}?{consulta}&limite={limite}' + (f'&cursor={cursor}' if cursor else '')
+        corpo = cliente.get(url).get_json()
+        paginas.append(corpo['ocorrencias'])
+        cursor = corpo['proximo_cursor']
+        if cursor is None:
+            return paginas
+
+
+def test_paginas_pelo_cursor_cobrem_a_janela_sem_repetir(cliente):
+    completa = cliente.get(f'{OCORRENCIAS}?de=2026-03-01&ate=2026-03-31').get_json()
+
+    paginas = _paginas(cliente, 'de=2026-03-01&ate=2026-03-31', limite=3)
+
+    # Segundas e terças de março de 2026: comp-1 e comp-2 cinco vezes cada
+    assert [len(pagina) for pagina in paginas] == [3, 3, 3, 1]
+    assert [ocorrencia for pagina in paginas for ocorrencia in pagina] == completa['ocorrencias']
+    assert [(o['data'], o['id_compromisso']) for o in completa['ocorrencias'][:2]] == [
+        ('2026-03-02', 'comp-1'), ('2026-03-03', 'comp-2')]
+    datas = [o['data'] for o in completa['ocorrencias']]
+    assert datas == sorted(datas) and len(set(datas)) == 10
+
+
+def test_limite_exato_nao_deixa_pagina_vazia(cliente):
+    corpo = cliente.get(f'{OCORRENCIAS}?de=2026-03-02&ate=2026-03-03&limite=2').get_json()
+
+    assert len(corpo['ocorrencias']) == 2
+    assert corpo['proximo_cursor'] is None
+
+
+def test_janela_limitada_a_vigencia_da_agenda(cliente):
+    corpo = cliente.get(f'{OCORRENCIAS}?de=2026-01-01&ate=2026-02-03').get_json()
+
+    assert corpo['periodo'] == {'de_efetivo': '2026-02-01', 'ate_efetivo': '2026-02-03'}
+    assert [o['data'] for o in corpo['ocorrencias']] == ['2026-02-02', '2026-02-03']
+
+
+@pytest.mark.parametrize('consulta', [
+    'de=2026-03-01',
+    'de=2026-03-31&ate=2026-03-01',
+    'de=2026-03-01&ate=2026-03-31&limite=0',
+    'de=2026-03-01&ate=2026-03-31&cursor=nao-e-um-cursor',
+])
+def test_parametros_invalidos(cliente, consulta):
+    assert cliente.get(f'{OCORRENCIAS}?{consulta}').status_code == 400
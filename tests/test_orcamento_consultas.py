@@ -0,0 +1,59 @@
+"""
+Orçamentos de consultas das rotas (ORCAMENTO_CONSULTAS_POR_ROTA): cada teste faz uma
+requisição à rota com os caches vazios contra o substituto local do Supabase
+(benchmarks/postgrest_local.py), cujas chamadas passam pelo postgrest-py e chegam ao
+detector de consultas.
+"""
+import pytest
+
+from conftest import AGENDA_ID, CONVIDADO_ID, USUARIO_ID, entrar
+
+
+def _cliente(aplicacao, usuario_id):
+    cliente = aplicacao.app.test_client()
+    entrar(cliente, usuario_id)
+    return cliente
+
+
+NOVO_COMPROMISSO = {'local_id': 'local-a', 'dia_semana': 3, 'hora_inicio': '08:00', 'hora_fim': '09:00',
+                    'duracao': 1.0, 'tipo_hora': 'HA', 'descricao': 'Aula'}
+
+
+@pytest.mark.parametrize('metodo, url, corpo', [
+    ('POST', f'/agendas/{AGENDA_ID}/compromissos', NOVO_COMPROMISSO),
+    ('POST', f'/agendas/{AGENDA_ID}/compromissos/lote', {'compromissos': [
+        NOVO_COMPROMISSO, {**NOVO_COMPROMISSO, 'dia_semana': 4}]}),
+    ('PUT', f'/agendas/{AGENDA_ID}/compromissos/comp-1', {'hora_inicio': '08:30', 'hora_fim': '10:00'}),
+    ('DELETE', f'/agendas/{AGENDA_ID}/compromissos/comp-2', None),
+    ('POST', f'/agendas/{AGENDA_ID}/clonar', {'nome': 'Cópia', 'data_inicio': '2027-02-01', 'data_fim': '2027-12-15'}),
+    ('GET', f'/agendas/{AGENDA_ID}/horarios_livres?local_id=local-a&dia_semana=3&duracao=1', None),
+    ('GET', f'/agendas/{AGENDA_ID}/relatorios/semanal', None),
+    ('GET', f'/agendas/{AGENDA_ID}/relatorios/mensal?ano=2026&mes=3', None),
+    ('GET', f'/agendas/{AGENDA_ID}/relatorios/periodo?de=2026-03-01&ate=2026-04-30', None),
+])
+def test_rota_do_dono_dentro_do_orcamento(aplicacao, supabase_local, orcamento_consultas, metodo, url, corpo):
+    cliente = _cliente(aplicacao, USUARIO_ID)
+
+    with orcamento_consultas():
+        resposta = cliente.open(url, method=metodo, json=corpo)
+
+    assert resposta.status_code in (200, 201), resposta.get_json()
+
+
+# Leitura feita pelo convidado: o pior caso dos orçamentos (+1 consulta para a permissão)
+def test_eventos_do_convidado_dentro_do_orcamento(aplicacao, supabase_local, orcamento_consultas):
+    cliente = _cliente(aplicacao, CONVIDADO_ID)
+
+    with orcamento_consultas():
+        resposta = cliente.get(f'/agendas/{AGENDA_ID}/eventos', buffered=False)
+        assert resposta.status_code == 200
+        # O stream fica aberto; fechá-lo encerra a requisição (e a medição dela)
+        resposta.close()
+
+
+@pytest.mark.parametrize('url', ['/api/public/agenda/link-1', '/public/agenda/link-1'])
+def test_agenda_publica_dentro_do_orcamento(aplicacao, supabase_local, orcamento_consultas, url):
+    with orcamento_consultas():
+        resposta = aplicacao.app.test_client().get(url)
+
+    assert resposta.status_code == 200
@@ -0,0 +1,112 @@
+import pytest
+
+from conftest import AGENDA_ID, USUARIO_ID, entrar
+
+
+@pytest.mark.parametrize('data_inicio, data_fim, esperado', [
+    ('2099-03-10', '2099-06-30', ('2099-03-01', '2099-03-31')),
+    ('2000-01-01', '2000-02-10', ('2000-02-01', '2000-02-29')),
+])
+def test_mensal_sem_parametros_usa_um_mes_da_vigencia(cliente_http, banco, data_inicio, data_fim, esperado):
+    banco.tabelas['agendas'][0].update(data_inicio=data_inicio, data_fim=data_fim)
+
+    resposta = cliente_http.get(f'/agendas/{AGENDA_ID}/relatorios/mensal')
+
+    corpo = resposta.get_json()
+    assert resposta.status_code == 200, corpo
+    periodo = corpo['relatorio']['periodo']
+    assert (periodo['de'], periodo['ate']) == esperado
+    assert corpo['relatorio']['total_horas'] > 0
+
+
+def test_mensal_com_ano_e_mes(cliente_http):
+    resposta = cliente_http.get(f'/agendas/{AGENDA_ID}/relatorios/mensal', query_string={'ano': 2026, 'mes': 1})
+
+    periodo = resposta.get_json()['relatorio']['periodo']
+    assert (periodo['de'], periodo['ate']) == ('2026-01-01', '2026-01-31')
+    # Janeiro de 2026 é anterior à vigência da agenda
+    assert periodo['de_efetivo'] is None
+
+
+def test_mensal_com_mes_invalido(cliente_http):
+    resposta = cliente_http.get(f'/agendas/{AGENDA_ID}/relatorios/mensal', query_string={'ano': 2026, 'mes': 13})
+
+    assert resposta.status_code == 400
+
+
+def _total_semanal(cliente_http):
+    resposta = cliente_http.get(f'/agendas/{AGENDA_ID}/relatorios/semanal')
+    assert resposta.status_code == 200, resposta.get_json()
+    return resposta.get_json()['relatorio']['total_horas']
+
+
+def test_semanal_recarrega_quando_a_versao_da_agenda_muda(cliente_http, banco):
+    banco.tabelas['agendas'][0]['versao'] = 7
+    antes = _total_semanal(cliente_http)
+
+    # Escrita feita por outro processo: a linha nova e o contador da agenda no banco
+    banco.tabelas['compromissos'].append({
+        'id_compromisso': 'comp-3', 'agenda_id': AGENDA_ID, 'local_id': 'local-a', 'dia_semana': 3,
+        'hora_inicio': '08:00:00', 'hora_fim': '11:00:00', 'duracao': 3.0, 'tipo_hora': 'HA', 'descricao': None,
+        'versao': 8})
+    banco.tabelas['agendas'][0]['versao'] = 8
+
+    assert _total_semanal(cliente_http) > antes
+
+
+def test_consistencia_sem_agregado_em_memoria_nao_verifica(cliente_http):
+    corpo = cliente_http.get(f'/agendas/{AGENDA_ID}/relatorios/consistencia').get_json()
+
+    assert corpo['verificado'] is False
+    assert corpo['consistente'] is None
+
+
+def test_consistencia_compara_o_agregado_da_versao_atual(cliente_http, banco):
+    banco.tabelas['agendas'][0]['versao'] = 7
+    _total_semanal(cliente_http)
+
+    corpo = cliente_http.get(f'/agendas/{AGENDA_ID}/relatorios/consistencia').get_json()
+    assert (corpo['verificado'], corpo['consistente']) == (True, True)
+
+    # Agregado de uma versão anterior à do banco não é comparado
+    banco.tabelas['agendas'][0]['versao'] = 8
+    assert cliente_http.get(f'/agendas/{AGENDA_ID}/relatorios/consistencia').get_json()['verificado'] is False
+
+
+@pytest.mark.parametrize('url', [
+    f'/agendas/{AGENDA_ID}/relatorios/semanal',
+    f'/agendas/{AGENDA_ID}/relatorios/mensal',
+    f'/agendas/{AGENDA_ID}/relatorios/periodo?de=2026-03-01&ate=2026-03-31',
+    f'/agendas/{AGENDA_ID}/relatorios/consistencia',
+    f'/agendas/{AGENDA_ID}/locais_config',
+])
+def test_valores_e_totais_sao_so_do_dono(aplicacao, banco, url):
+    banco.tabelas['agenda_permissoes'].append({
+        'id_permissao': 'permissao-1', 'agenda_id': AGENDA_ID, 'usuario_concedeu_id': 'usuario-1',
+        'usuario_recebeu_id': 'usuario-2', 'status': 'ativo'})
+    convidado = aplicacao.app.test_client()
+    entrar(convidado, 'usuario-2')
+
+    assert convidado.get(url).status_code == 404
+    # A permissão continua valendo para o que é aberto ao convidado
+    assert convidado.get(f'/agendas/{AGENDA_ID}/ocorrencias?de=2026-03-01&ate=2026-03-07').status_code == 200
+
+
+def test_exclusoes_aplicadas_ao_agregado_sem_recarregar(aplicacao, supabase_local):
+    cliente = aplicacao.app.test_client()
+    entrar(cliente, USUARIO_ID)
+    url = f'/agendas/{AGENDA_ID}/relatorios/semanal'
+    assert cliente.get(url).status_code == 200
+    agregado = aplicacao._report_aggregates.get(AGENDA_ID)
+
+    assert cliente.delete(f'/agendas/{AGENDA_ID}/compromissos/comp-2').status_code == 200
+    assert cliente.delete(f'/agendas/{AGENDA_ID}/locais_config/config-b').status_code == 200
+    supabase_local.zerar_chamadas()
+    relatorio = cliente.get(url).get_json()['relatorio']
+
+    # As exclusões encadearam pela versão da lápide: o mesmo agregado, sem reler as linhas
+    assert aplicacao._report_aggregates.get(AGENDA_ID) is agregado
+    assert not {tabela for tabela, _ in supabase_local.chamadas} & {'compromissos', 'agenda_locais_config', 'locais_trabalho'}
+    aplicacao._report_aggregates.clear()
+    assert cliente.get(url).get_json()['relatorio'] == relatorio
+    assert [local['id_local'] for local in relatorio['locais']] == ['local-a']
@@ -0,0 +1,77 @@
+import pytest
+
+from conftest import AGENDA_ID, USUARIO_ID, entrar
+
+COMPROMISSOS = f'/agendas/{AGENDA_ID}/compromissos'
+
+
+@pytest.fixture
+def dono(aplicacao, supabase_local):
+    cliente = aplicacao.app.test_client()
+    entrar(cliente, USUARIO_ID)
+    return cliente
+
+
+def _mesclar(linhas, delta, chave):
+    """O que o cliente faz com uma resposta incremental (mesclarAlteracoes em static/js/utils.js)."""
+    alteradas = {linha[chave] for linha in delta['compromissos']}
+    mantidas = [linha for linha in linhas if linha[chave] not in alteradas and linha[chave] not in delta['excluidos']]
+    return mantidas + delta['compromissos']
+
+
+def _por_id(linhas):
+    return sorted(linhas, key=lambda linha: linha['id_compromisso'])
+
+
+def test_since_traz_so_as_alteracoes_e_as_exclusoes(dono):
+    inicial = dono.get(COMPROMISSOS).get_json()
+    assert inicial['completo'] and len(inicial['compromissos']) == 2
+
+    dono.put(f'{COMPROMISSOS}/comp-1', json={'hora_inicio': '08:30', 'hora_fim': '10:00'})
+    criado = dono.post(COMPROMISSOS, json={'local_id': 'local-a', 'dia_semana': 3, 'hora_inicio': '08:00', 'hora_fim': '09:00',
+                                           'duracao': 1.0, 'tipo_hora': 'HA'}).get_json()['compromisso']
+    dono.delete(f'{COMPROMISSOS}/comp-2')
+
+    delta = dono.get(f"{COMPROMISSOS}?since={inicial['versao']}").get_json()
+
+    assert not delta['completo']
+    assert delta['versao'] == inicial['versao'] + 3
+    assert sorted(linha['id_compromisso'] for linha in delta['compromissos']) == sorted(['comp-1', criado['id_compromisso']])
+    assert delta['excluidos'] == ['comp-2']
+    # Mesclado ao cache do cliente, dá a lista completa atual
+    completo = dono.get(COMPROMISSOS).get_json()
+    assert _por_id(_mesclar(inicial['compromissos'], delta, 'id_compromisso')) == _por_id(completo['compromissos'])
+
+
+def test_since_na_versao_atual_nao_traz_nada(dono):
+    versao = dono.get(COMPROMISSOS).get_json()['versao']
+
+    resposta = dono.get(f'{COMPROMISSOS}?since={versao}').get_json()
+
+    assert (resposta['compromissos'], resposta['excluidos'], resposta['completo']) == ([], [], False)
+
+
+def test_since_a_frente_do_contador_devolve_a_lista_completa(dono):
+    versao = dono.get(COMPROMISSOS).get_json()['versao']
+
+    # Ex.: cache de outro banco ou de antes de um backup restaurado
+    resposta = dono.get(f'{COMPROMISSOS}?since={versao + 10}').get_json()
+
+    assert resposta['completo']
+    assert resposta['versao'] == versao
+    assert len(resposta['compromissos']) == 2
+
+
+@pytest.mark.parametrize('since', ['abc', '-1'])
+def test_since_invalido(dono, since):
+    assert dono.get(f'{COMPROMISSOS}?since={since}').status_code == 400
+
+
+def test_since_nas_configuracoes_de_valor_hora(dono):
+    versao = dono.get(f'/agendas/{AGENDA_ID}/locais_config').get_json()['versao']
+    dono.delete(f'/agendas/{AGENDA_ID}/locais_config/config-b')
+
+    delta = dono.get(f'/agendas/{AGENDA_ID}/locais_config?since={versao}').get_json()
+
+    assert delta['excluidos'] == ['config-b']
+    assert delta['versao'] == versao + 1
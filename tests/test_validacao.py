@@ -0,0 +1,68 @@
+from conftest import AGENDA_ID
+
+
+def _consultas_do_snapshot(banco):
+    """Leituras feitas para validar: compromissos da agenda e locais do usuário."""
+    return banco.chamadas[('compromissos', 'select')] + banco.chamadas[('locais_trabalho', 'select')]
+
+
+def test_criar_compromisso_carrega_o_snapshot_com_duas_consultas(cliente_http, banco):
+    resposta = cliente_http.post(f'/agendas/{AGENDA_ID}/compromissos', json={
+        'local_id': 'local-a', 'dia_semana': 1, 'hora_inicio': '11:00', 'hora_fim': '12:00', 'duracao': 1, 'tipo_hora': 'HA'
+    })
+
+    assert resposta.status_code == 201, resposta.get_json()
+    assert _consultas_do_snapshot(banco) <= 2
+    assert banco.chamadas[('compromissos', 'insert')] == 1
+
+
+def test_criar_compromisso_rejeita_conflito_sem_consultas_extras(cliente_http, banco):
+    resposta = cliente_http.post(f'/agendas/{AGENDA_ID}/compromissos', json={
+        'local_id': 'local-a', 'dia_semana': 1, 'hora_inicio': '09:00', 'hora_fim': '11:00', 'duracao': 2, 'tipo_hora': 'HA'
+    })
+
+    assert resposta.status_code == 400
+    assert 'Conflito de horário' in resposta.get_json()['mensagem']
+    assert _consultas_do_snapshot(banco) <= 2
+    assert banco.chamadas[('compromissos', 'insert')] == 0
+
+
+def test_atualizar_compromisso_carrega_o_snapshot_com_duas_consultas(cliente_http, banco):
+    resposta = cliente_http.put(f'/agendas/{AGENDA_ID}/compromissos/comp-1', json={'hora_inicio': '08:30', 'hora_fim': '10:30'})
+
+    assert resposta.status_code == 200, resposta.get_json()
+    # A leitura do compromisso original é a única consulta fora do snapshot
+    assert _consultas_do_snapshot(banco) - 1 <= 2
+    assert banco.chamadas[('alterar_da_agenda', 'rpc')] == 1
+
+
+def test_atualizar_compromisso_rejeita_limite_diario_dos_locais_relacionados(cliente_http, banco):
+    banco.tabelas['compromissos'].append(
+        {'id_compromisso': 'comp-3', 'agenda_id': AGENDA_ID, 'local_id': 'local-b', 'dia_semana': 1,
+         'hora_inicio': '11:00:00', 'hora_fim': '17:00:00', 'duracao': 6.0, 'tipo_hora': 'HA', 'descricao': None}
+    )
+
+    resposta = cliente_http.put(f'/agendas/{AGENDA_ID}/compromissos/comp-1', json={'hora_fim': '10:30', 'duracao': 2.5})
+
+    assert resposta.status_code == 400
+    assert 'Escola A, Escola B' in resposta.get_json()['mensagem']
+    assert banco.chamadas[('alterar_da_agenda', 'rpc')] == 0
+
+
+def test_snapshot_conta_as_consultas_ao_backend(aplicacao, banco):
+    snapshot = aplicacao._ValidationSnapshot(banco, AGENDA_ID, 'usuario-1')
+
+    assert snapshot.backend_calls == 2
+    assert snapshot.backend_calls == _consultas_do_snapshot(banco)
+
+
+def test_exclusao_verifica_a_posse_no_proprio_comando(cliente_http, banco):
+    # O acesso do dono fica em cache...
+    assert cliente_http.get(f'/agendas/{AGENDA_ID}/ocorrencias?de=2026-03-02&ate=2026-03-08').status_code == 200
+    # ...e a agenda muda de dono antes de ele expirar: a gravação é recusada pelo banco
+    banco.tabelas['agendas'][0]['usuario_id'] = 'usuario-2'
+
+    resposta = cliente_http.delete(f'/agendas/{AGENDA_ID}/compromissos/comp-1')
+
+    assert resposta.status_code == 404
+    assert [c['id_compromisso'] for c in banco.tabelas['compromissos']] == ['comp-1', 'comp-2']